@@ -1,23 +1,203 @@
+import time
+
+# Taken before the other imports so a process's first run includes their cost
+rerun_started = time.perf_counter()
+
 import streamlit as st
-from langchain_groq import ChatGroq
 from dotenv import load_dotenv
 import json
 import os
 import re
+import uuid
 from helper import *
+from query_cache import (
+    ChangeStreamInvalidator,
+    cache_from_env,
+    count_cache_from_env,
+    result_cache_from_env,
+)
+from schema_profiler import default_profiler
+from catalog import DatabaseCatalog
+from fast_path import fast_path_from_env
+from prompt_builder import default_prompt_builder
+from index_advisor import advisor_from_env
+from query_guard import guard_from_env
+from summaries import summaries_from_env
+from refinement import fully_fetched, refiner_from_env
+from metrics import registry, start_metrics_server
+from history_store import HistoryStore, global_budget
+from mongo_pool import clients
+from warmup import warmup_from_env
+from llm_router import router_from_env
+from executor import (
+    DB_TIMEOUT_SECONDS,
+    LLM_TIMEOUT_SECONDS,
+    cancel_all,
+    run_stage,
+    submit,
+    wait_stage,
+    warm_connection,
+)
 
 load_dotenv()
 
 MONGO_STRING = os.environ["MONGODB_CONNECTION_STRING"]
 GROQ_API = os.environ["GROQ_KEY"]
 
-def apply_custom_css(file_name="./styles.css"):
+@st.cache_resource
+def load_custom_css(file_name="./styles.css"):
+    # Read once per process; the <style> element itself is sent on every rerun
     with open(file_name) as f:
-        css = f.read()
-        st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
-    print("Custom CSS applied.")
+        return f.read()
+
+
+def apply_custom_css(file_name="./styles.css"):
+    st.markdown(f"<style>{load_custom_css(file_name)}</style>", unsafe_allow_html=True)
 apply_custom_css()
 
+
+@st.cache_resource
+def get_llm(api_key):
+    # One router (clients, rate limits, latency stats) per key for the whole process
+    return router_from_env(api_key)
+
+
+@st.cache_resource
+def get_warm_start():
+    # Connect to and profile WARM_DATABASE/WARM_COLLECTION while the first visitor
+    # fills in the sidebar; a no-op when warmup.py already did it in this process
+    return warmup_from_env(background=True)
+
+
+get_warm_start()
+
+
+@st.cache_resource
+def get_translation_cache():
+    # Shared across sessions so one analyst's question warms the cache for everyone
+    return cache_from_env()
+
+
+@st.cache_resource
+def get_count_cache():
+    return count_cache_from_env()
+
+
+@st.cache_resource
+def get_schema_profiler():
+    # The module-level profiler, so profiles taken by the warm-up are reused
+    return default_profiler
+
+
+@st.cache_resource
+def get_catalog(_database, database_name):
+    # One catalog per database; collection profiles come from the shared profiler
+    return DatabaseCatalog(_database, schema_profiler)
+
+
+@st.cache_resource
+def get_fast_path():
+    return fast_path_from_env()
+
+
+@st.cache_resource
+def get_metrics_server():
+    # Prometheus scrapes /metrics on a side port; Streamlit itself can't add routes
+    port = os.getenv("METRICS_PORT")
+    return start_metrics_server(int(port)) if port else None
+
+
+get_metrics_server()
+
+
+@st.cache_resource
+def get_index_advisor():
+    # Shared so recurring query shapes are counted across all sessions
+    return advisor_from_env()
+
+
+@st.cache_resource
+def get_query_guard():
+    # Shared so per-user budgets hold across reruns and tabs
+    return guard_from_env()
+
+
+@st.cache_resource
+def get_result_cache():
+    return result_cache_from_env()
+
+
+@st.cache_resource
+def get_summary_store():
+    # Shared: one maintainer thread per summarized collection for the whole process
+    return summaries_from_env(on_update=result_cache.invalidate)
+
+
+@st.cache_resource
+def get_refiner():
+    return refiner_from_env()
+
+
+@st.cache_resource
+def watch_collection(_collection, namespace):
+    # One change-stream watcher per collection for the whole process
+    return ChangeStreamInvalidator(result_cache, _collection)
+
+
+translation_cache = get_translation_cache()
+result_cache = get_result_cache()
+summary_store = get_summary_store()
+index_advisor = get_index_advisor()
+query_guard = get_query_guard()
+schema_profiler = get_schema_profiler()
+fast_path = get_fast_path()
+count_cache = get_count_cache()
+refiner = get_refiner()
+
+MAX_LIVE_PAGERS = int(os.getenv("MAX_LIVE_PAGERS", "5"))
+
+
+RESULT_TYPES = ("query_results", "all_documents")
+
+
+def compact_history(messages):
+    # Older result messages keep only their columnar table, not the raw documents
+    result_indexes = [
+        index
+        for index, msg in enumerate(messages)
+        if isinstance(msg["content"], dict) and msg["content"].get("type") in RESULT_TYPES
+    ]
+    for index in result_indexes[:-1]:
+        content = messages[index]["content"]
+        if content.get("table") is not None:
+            content["results"] = None
+
+
+def previous_turn(messages):
+    # The latest answer a follow-up can refine, with the question that produced it
+    for index in range(len(messages) - 1, 0, -1):
+        content = messages[index]["content"]
+        if not isinstance(content, dict) or content.get("type") not in (*RESULT_TYPES, "count"):
+            continue
+        question = messages[index - 1]["content"]
+        return {
+            "question": question if isinstance(question, str) else "",
+            # As generated, before any summary rewrite
+            "query_dict": content.get("source_query") or content["query_dict"],
+            "results": content.get("results"),
+            "table": content.get("table"),
+            "complete": content.get("complete", False),
+        }
+    return None
+
+
+def register_pager(message_key, pager):
+    # Only the most recent results keep an open cursor; older ones are closed
+    pagers = st.session_state.pagers
+    pagers[message_key] = pager
+    for key in sorted(pagers)[:-MAX_LIVE_PAGERS]:
+        pagers.pop(key).close()
+
 st.set_page_config(page_title="\n\nLangChain: Chat with MongoDB")
 st.title("LangChain: Chat with MongoDB")
 
@@ -28,14 +208,133 @@ st.sidebar.markdown(
 )
 mongo_uri = MONGO_STRING
 mongo_db_name = st.sidebar.text_input(
-    "Database Name", value=st.session_state.get("mongo_db_name", "")
+    "Database Name",
+    value=st.session_state.get("mongo_db_name", os.getenv("WARM_DATABASE", "")),
 )
 mongo_collection_name = st.sidebar.text_input(
-    "Collection Name", value=st.session_state.get("mongo_collection_name", "")
+    "Collection Name",
+    value=st.session_state.get("mongo_collection_name", os.getenv("WARM_COLLECTION", "")),
 )
 api_key = GROQ_API
 submit_clicked = st.sidebar.button("Submit")
 
+with st.sidebar.expander("Translation cache", expanded=False):
+    cache_stats = translation_cache.stats()
+    st.write(
+        f"Hits: {cache_stats['hits']} | Near hits: {cache_stats['near_hits']} "
+        f"| Misses: {cache_stats['misses']}"
+    )
+    st.write(f"Hit rate: {cache_stats['hit_rate']:.0%} ({cache_stats['entries']} entries)")
+    prompt_stats = default_prompt_builder.stats()
+    st.write(
+        f"Avg prompt: ~{prompt_stats['avg_prompt_tokens']:.0f} tokens "
+        f"({prompt_stats['examples']} few-shot examples known)"
+    )
+
+if fast_path is not None:
+    with st.sidebar.expander("Fast path", expanded=False):
+        fast_stats = fast_path.stats()
+        st.write(
+            f"Answered locally: {fast_stats['hits']} | Sent to LLM: {fast_stats['fallbacks']}"
+        )
+        st.write(f"Hit rate: {fast_stats['hit_rate']:.0%} of LLM calls saved")
+
+if refiner is not None:
+    with st.sidebar.expander("Follow-up questions", expanded=False):
+        refine_stats = refiner.stats()
+        st.write(
+            f"Follow-ups: {refine_stats['follow_ups']} | Parsed locally: {refine_stats['fast_deltas']} "
+            f"| New questions: {refine_stats['new_questions']}"
+        )
+        st.write(
+            f"Answered from previous rows: {refine_stats['answered_locally']} "
+            f"| Sent to MongoDB: {refine_stats['sent_to_mongodb']}"
+        )
+
+if "llm" in st.session_state:
+    with st.sidebar.expander("LLM backends", expanded=False):
+        for name, stats in st.session_state.llm.stats().items():
+            latency = (
+                f"p50 {stats['p50_ms']:.0f} ms, p95 {stats['p95_ms']:.0f} ms"
+                if stats["p50_ms"] is not None
+                else "no answers yet"
+            )
+            st.write(
+                f"`{name}`: {stats['ok']}/{stats['calls']} answered, "
+                f"{stats['error_rate']:.0%} errors, {latency}"
+            )
+            st.write(
+                f"Hedges {stats['hedges']} | Rate limited {stats['rate_limited']} "
+                f"| Throttled {stats['throttled']} | JSON retries {stats['json_retries']}"
+                + (" | cooling down" if stats["cooling_down"] else "")
+            )
+
+with st.sidebar.expander("Result cache", expanded=False):
+    result_stats = result_cache.stats()
+    st.write(
+        f"Hits: {result_stats['hits']} | Misses: {result_stats['misses']} "
+        f"| {result_stats['entries']} entries, {result_stats['bytes'] / 1024:.0f} KiB"
+    )
+
+with st.sidebar.expander("Connection pool", expanded=False):
+    pool_stats = clients.stats()
+    if not pool_stats:
+        st.write("No MongoDB clients yet.")
+    for name, stats in pool_stats.items():
+        st.write(
+            f"`{name}`: {stats['checked_out']}/{stats['max_pool_size']} in use "
+            f"({stats['utilization']:.0%}), {stats['open']} open"
+        )
+        st.write(
+            f"Checkout wait avg {stats['avg_wait_ms']:.1f} ms, "
+            f"max {stats['max_wait_ms']:.1f} ms, failures {stats['checkout_failures']}"
+        )
+
+with st.sidebar.expander("Chat history memory", expanded=False):
+    if "history_store" in st.session_state:
+        history_stats = st.session_state.history_store.stats()
+        st.write(
+            f"This session: {history_stats['resident_bytes'] / 1024:.0f} KiB in memory, "
+            f"{history_stats['spilled']}/{history_stats['results']} results on disk"
+        )
+    st.write(
+        f"All sessions: {global_budget.resident_bytes() / 1024 / 1024:.1f} / "
+        f"{global_budget.max_bytes / 1024 / 1024:.0f} MiB"
+    )
+
+with st.sidebar.expander("Query guard", expanded=False):
+    guard_stats = query_guard.stats()
+    st.write(f"Rejected: {guard_stats['rejected']} | Rewritten: {guard_stats['rewritten']}")
+    if "user_id" in st.session_state:
+        spent = query_guard.budget.spent(st.session_state.user_id)
+        st.write(
+            f"This session: ~{spent:,} of {query_guard.budget.docs_per_minute:,} "
+            "documents examined per minute"
+        )
+
+with st.sidebar.expander("Summaries", expanded=False):
+    summary_stats = summary_store.stats()
+    if not summary_stats:
+        st.write("No materialized summaries (set SUMMARY_SPECS).")
+    for name, stats in summary_stats.items():
+        state = "building" if not stats["ready"] else "stale" if stats["stale"] else "live"
+        updated = stats["updated_seconds_ago"]
+        st.write(
+            f"`{name}`: {state} via {stats['mode']}, {stats['groups']} groups, "
+            f"{stats['hits']} answers"
+            + (f", updated {updated:.0f}s ago" if updated is not None else "")
+        )
+        if stats["error"]:
+            st.caption(stats["error"])
+
+with st.sidebar.expander("Index advisor", expanded=False):
+    recurring = index_advisor.recurring()
+    if not recurring:
+        st.write("No unindexed recurring query shapes yet.")
+    for item in recurring:
+        spec = ", ".join(f'"{f}": {d}' for f, d in item["recommended_index"])
+        st.write(f"**{item['count']}×** `{item['namespace']}` → `{{{spec}}}`")
+
 if submit_clicked:
     if not mongo_uri or not mongo_db_name or not mongo_collection_name or not api_key:
         st.warning("⚠️ Please fill in all fields before submitting.")
@@ -47,9 +346,7 @@ if submit_clicked:
     st.session_state.mongo_collection_name = mongo_collection_name
     st.session_state.api_key = api_key
 
-    st.session_state.llm = ChatGroq(
-        groq_api_key=api_key, model_name="llama-3.3-70b-versatile", streaming=True
-    )
+    st.session_state.llm = get_llm(api_key)
 
     collection = configure_mongo(mongo_uri, mongo_db_name, mongo_collection_name)
     if collection is None:
@@ -57,10 +354,18 @@ if submit_clicked:
         st.stop()
 
     st.session_state.mongo_collection = collection
+    if os.getenv("RESULT_CACHE_WATCH", "").lower() in ("1", "true", "yes"):
+        watch_collection(collection, collection.full_name)
+    # Configured summaries start building in the background before the first question
+    summary_store.attach(collection)
 
-    schema_info, sample_docs = get_collection_schema(collection, mongo_collection_name)
+    # Profiles are cached per collection, so re-submitting only folds in a small delta
+    schema_info, sample_docs = get_collection_schema(
+        collection, mongo_collection_name, profiler=schema_profiler
+    )
     st.session_state.schema_info = schema_info
     st.session_state.sample_docs = sample_docs
+    st.session_state.schema_profile = schema_profiler.cached(collection)
 
 # --- Show Schema if Connection Exists ---
 if "mongo_collection" in st.session_state:
@@ -86,14 +391,39 @@ if "mongo_collection" in st.session_state:
             }
         ]
 
+    if "pagers" not in st.session_state:
+        st.session_state.pagers = {}
+
+    # Result tables beyond the session/global memory caps spill to a per-session file
+    if "history_store" not in st.session_state:
+        st.session_state.history_store = HistoryStore()
+
+    # Query budgets are charged per browser session
+    if "user_id" not in st.session_state:
+        st.session_state.user_id = uuid.uuid4().hex
+
+    # Only the latest result is rendered as a table; older ones stay collapsed
+    # summaries so each rerun doesn't re-materialize the whole history
+    latest_result = max(
+        (
+            index
+            for index, msg in enumerate(st.session_state.messages)
+            if isinstance(msg["content"], dict)
+            and msg["content"].get("type") in RESULT_TYPES
+        ),
+        default=None,
+    )
+
     # Display all previous messages
-    for msg in st.session_state.messages:
+    for index, msg in enumerate(st.session_state.messages):
         if isinstance(msg["content"], dict) and "type" in msg["content"]:
             display_chat_message(
                 msg["role"],
                 msg["content"],
                 msg["content"].get("query_dict"),
                 msg["content"].get("results"),
+                message_key=index,
+                collapsed=index != latest_result,
             )
         else:
             display_chat_message(msg["role"], msg["content"])
@@ -122,45 +452,196 @@ if "mongo_collection" in st.session_state:
 
                 elif "all documents" in user_query.lower():
                     query_dict = {"filter": {}, "projection": {}, "limit": 50}
-                    docs = query_mongodb(st.session_state.mongo_collection, query_dict)
+                    docs = query_mongodb(
+                        st.session_state.mongo_collection, query_dict, cache=result_cache
+                    )
                     result_data = {
                         "type": "all_documents",
                         "query_dict": query_dict,
                         "results": docs,
+                        "table": ResultTable.from_results(docs, query_dict),
+                        "complete": fully_fetched(query_dict, len(docs), False),
                     }
                     display_chat_message("assistant", result_data, query_dict, docs)
                     st.session_state.messages.append(
                         {"role": "assistant", "content": result_data}
                     )
 
-                elif "count" in user_query.lower() or "how many" in user_query.lower():
-                    count = count_documents(st.session_state.mongo_collection)
-                    result_data = {"type": "count", "data": count}
-                    display_chat_message("assistant", result_data)
-                    st.session_state.messages.append(
-                        {"role": "assistant", "content": result_data}
+                else:
+                    collection = st.session_state.mongo_collection
+                    catalog = get_catalog(collection.database, collection.database.name)
+                    query_dict = local = translated = None
+                    previous = (
+                        previous_turn(st.session_state.messages[:-1])
+                        if refiner is not None
+                        else None
                     )
+                    if previous is not None and refiner.is_follow_up(user_query):
+                        # "now only ...", "sort those by ..." change the previous query;
+                        # a narrowing of fully fetched rows is answered from those rows
+                        base = catalog.resolve(collection, previous["query_dict"])
+                        base_profile = schema_profiler.cached(base)
+                        delta = refiner.fast_delta(user_query, previous, fast_path, base_profile)
+                        if delta is None:
+                            with st.spinner("Refining the previous query..."):
+                                delta = run_stage(
+                                    "Query generation",
+                                    process_refinement,
+                                    user_query,
+                                    st.session_state.llm,
+                                    previous,
+                                    profile=base_profile,
+                                    timeout=LLM_TIMEOUT_SECONDS,
+                                )
+                        query_dict, local = refiner.refine(previous, delta, base_profile)
+                    if query_dict is None and fast_path is not None:
+                        # Simple filter/sort/count questions are parsed locally
+                        query_dict = fast_path.parse(
+                            user_query, schema_profiler.cached(collection)
+                        )
+                    if query_dict is None:
+                        with st.spinner("Analyzing your query..."):
+                            # Other collections are profiled in parallel the first time
+                            # a question needs them, so the generator can target or join them
+                            related = catalog.profiles(timeout=DB_TIMEOUT_SECONDS)
 
-                else:
-                    with st.spinner("Analyzing your query..."):
-                        query_dict = process_user_query(
-                            user_query, st.session_state.llm
+                            def on_key(key, value, completed, collection=collection):
+                                # As soon as the filter is written, load the target
+                                # collection's size and indexes for the guard
+                                if key == "filter":
+                                    target = catalog.resolve(collection, completed)
+                                    submit(query_guard.prefetch, target)
+
+                            # Warm the connection and refresh the schema profile on the
+                            # shared pool while the LLM is generating
+                            translation_profile = schema_profiler.cached(collection)
+                            translation = submit(
+                                process_user_query,
+                                user_query,
+                                st.session_state.llm,
+                                schema_info=st.session_state.schema_info,
+                                cache=translation_cache,
+                                profile=translation_profile,
+                                related=related,
+                                on_key=on_key,
+                            )
+                            prefetch = [
+                                submit(warm_connection, collection),
+                                submit(schema_profiler.profile, collection),
+                            ]
+                            try:
+                                query_dict = wait_stage(
+                                    translation, "Query generation", LLM_TIMEOUT_SECONDS
+                                )
+                            finally:
+                                cancel_all([translation, *prefetch])
+                            # Recorded as a few-shot example only if it passes the guard and finds something
+                            translated = {
+                                "query_dict": query_dict,
+                                "profile": translation_profile,
+                                "related": related,
+                            }
+
+                    source_query = query_dict
+                    if local is None:
+                        # The generator may target another collection of the database
+                        collection = catalog.resolve(collection, query_dict)
+                        profile = schema_profiler.cached(collection)
+
+                        # Recurring group-by questions are read from a materialized summary
+                        summary_store.observe(collection, query_dict)
+                        routed = summary_store.route(collection, query_dict)
+                        if routed is not None:
+                            collection, query_dict, summary_note = routed
+                            profile = None  # the rewrite only reads summarized fields
+                            st.caption(f"📊 {summary_note}")
+
+                        # Validate, rewrite and cost the query before it reaches MongoDB
+                        query_dict, guard_notes = query_guard.check(
+                            collection,
+                            query_dict,
+                            profile=profile,
+                            user=st.session_state.user_id,
+                            collections=catalog.names(),
                         )
+                        for note in guard_notes:
+                            st.caption(f"🛡️ {note}")
 
-                    with st.spinner("Executing query..."):
-                        docs = query_mongodb(
-                            st.session_state.mongo_collection, query_dict
+                    if local is not None:
+                        st.caption("♻️ Answered from the previous result without querying MongoDB.")
+                        if isinstance(local, int):
+                            result_data = {"type": "count", "query_dict": query_dict, "data": local}
+                            display_chat_message("assistant", result_data)
+                        else:
+                            result_data = {
+                                "type": "query_results",
+                                "collection": base.name,
+                                "query_dict": query_dict,
+                                "results": local,
+                                "table": ResultTable.from_results(local, query_dict),
+                                "complete": fully_fetched(query_dict, len(local), False),
+                            }
+                            display_chat_message("assistant", result_data, query_dict, local)
+                        st.session_state.messages.append(
+                            {"role": "assistant", "content": result_data}
                         )
 
-                    result_data = {
-                        "type": "query_results",
-                        "query_dict": query_dict,
-                        "results": docs,
-                    }
-                    display_chat_message("assistant", result_data, query_dict, docs)
-                    st.session_state.messages.append(
-                        {"role": "assistant", "content": result_data}
-                    )
+                    elif is_count(query_dict):
+                        count = run_stage(
+                            "Count",
+                            count_documents,
+                            collection,
+                            query_dict.get("filter"),
+                            cache=count_cache,
+                            max_time_ms=query_dict.get("max_time_ms"),
+                            summaries=summary_store,
+                            timeout=DB_TIMEOUT_SECONDS,
+                        )
+                        result_data = {
+                            "type": "count",
+                            "query_dict": query_dict,
+                            "source_query": source_query,
+                            "data": count,
+                        }
+                        display_chat_message("assistant", result_data)
+                        st.session_state.messages.append(
+                            {"role": "assistant", "content": result_data}
+                        )
+                        if translated is not None:
+                            remember_translation(user_query, result=count, **translated)
+
+                    else:
+                        # Explain the plan on the pool while the first page streams in;
+                        # findings are attached to the message once they arrive
+                        plan_future = submit(index_advisor.analyze, collection, query_dict)
+
+                        # Stream the first page into the table while the cursor keeps loading
+                        display_compact_query_analysis(query_dict)
+                        pager = ResultPager(collection, query_dict, cache=result_cache)
+                        table = display_streamed_results(pager, query_dict)
+
+                        result_data = {
+                            "type": "query_results",
+                            "collection": collection.name,
+                            "query_dict": query_dict,
+                            "source_query": source_query,
+                            "results": pager.page,
+                            "table": table,
+                            "complete": fully_fetched(
+                                query_dict, len(pager.page), pager.has_more
+                            ),
+                        }
+                        plan_future.add_done_callback(
+                            lambda f, data=result_data: data.update(
+                                plan=None if f.cancelled() else f.result()
+                            )
+                        )
+                        st.session_state.messages.append(
+                            {"role": "assistant", "content": result_data}
+                        )
+                        register_pager(len(st.session_state.messages) - 1, pager)
+                        if translated is not None:
+                            remember_translation(user_query, result=pager.page, **translated)
 
             except Exception as e:
                 error_data = {"type": "error", "data": f"Error: {str(e)}"}
@@ -169,6 +650,15 @@ if "mongo_collection" in st.session_state:
                     {"role": "assistant", "content": error_data}
                 )
 
+        compact_history(st.session_state.messages)
+        last_message = st.session_state.messages[-1]
+        if isinstance(last_message["content"], dict) and last_message["content"].get("table") is not None:
+            st.session_state.history_store.put(
+                len(st.session_state.messages) - 1, last_message["content"]
+            )
+        registry.record("rerun", time.perf_counter() - rerun_started)
         st.rerun()
 else:
     st.info("👈 Enter MongoDB details in the sidebar and click **Submit** button.")
+
+registry.record("rerun", time.perf_counter() - rerun_started)
@@ -0,0 +1,326 @@
+"""End-to-end benchmark of the question -> query -> results -> table path.
+
+Runs the real process_user_query, query_mongodb and display_unified_results
+against a deterministic fake chat model and a mongomock (or local mongod)
+collection, and writes machine-readable results for regression gating:
+
+    python benchmark.py --sizes 1000 10000 --sessions 1 8 --output bench.json
+    python benchmark.py --baseline bench.json --max-regression 0.2
+    python benchmark.py --startup 5 --sizes --output startup.json
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from connect import UniversityDB
+from local_llm import LocalChatModel
+from warmup import import_modules
+
+# Each benchmark question and the JSON a well-behaved model would answer with
+QUESTIONS = {
+    "find students with gpa above 3.5": {"filter": {"gpa": {"$gt": 3.5}}},
+    "top 20 students by credits_taken": {
+        "filter": {},
+        "sort": {"credits_taken": -1},
+        "limit": 20,
+    },
+    "computer science students sorted by gpa": {
+        "filter": {"major": "Computer Science"},
+        "sort": {"gpa": -1},
+    },
+    "names and majors of students who took CSE 401": {
+        "filter": {"courses_completed.course_id": "CSE 401"},
+        "projection": {"name": 1, "major": 1},
+    },
+    "average gpa per major": {
+        "operation": "aggregate",
+        "pipeline": [
+            {"$group": {"_id": "$major", "avg_gpa": {"$avg": "$gpa"}}},
+            {"$sort": {"avg_gpa": -1}},
+        ],
+    },
+    "how many students enrolled in 2022": {
+        "operation": "count",
+        "filter": {"enrollment_year": 2022},
+    },
+}
+
+
+class FakeChatModel(LocalChatModel):
+    """Deterministic stand-in for ChatGroq with an optional simulated latency"""
+
+    answers: Dict[str, Any] = QUESTIONS
+    default_answer: Dict[str, Any] = {"filter": {}}
+    # Chatty models keep explaining after the JSON; streaming stops before this
+    trailer: str = "\n\nThis query returns the matching students from the collection."
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50_ms": 1000 * percentile(values, 50),
+        "p95_ms": 1000 * percentile(values, 95),
+        "p99_ms": 1000 * percentile(values, 99),
+        "mean_ms": 1000 * statistics.fmean(values) if values else 0.0,
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+# Runs app.py headless in a fresh interpreter: one cold run, then reruns
+STARTUP_SCRIPT = """
+import json, sys, threading, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file("app.py", default_timeout=120)
+app.run()
+first = time.perf_counter() - started
+# Reruns are timed once the background warm-up has finished importing
+for thread in threading.enumerate():
+    if thread.name == "warmup":
+        thread.join()
+reruns = []
+for _ in range(int(sys.argv[1])):
+    started = time.perf_counter()
+    app.run()
+    reruns.append(time.perf_counter() - started)
+print(json.dumps({"first": first, "reruns": reruns, "modules": len(sys.modules)}))
+"""
+
+
+def measure_startup(processes: int, reruns: int = 5) -> Dict[str, Any]:
+    """Cold start (interpreter, imports, first script run) and per-rerun overhead of app.py"""
+    env = dict(os.environ)
+    # The sidebar renders without a database; these only satisfy app.py's lookups
+    env.setdefault("MONGODB_CONNECTION_STRING", "mongodb://localhost:1/?serverSelectionTimeoutMS=1")
+    env.setdefault("GROQ_KEY", "benchmark")
+    env.pop("WARM_DATABASE", None)
+    process_times, first_runs, rerun_times, modules = [], [], [], 0
+    for _ in range(processes):
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT, str(reruns)],
+            capture_output=True,
+            text=True,
+            env=env,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True,
+        )
+        process_times.append(time.perf_counter() - started)
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        first_runs.append(result["first"])
+        rerun_times.extend(result["reruns"])
+        modules = result["modules"]
+    return {
+        "processes": processes,
+        "process": summarize(process_times),
+        "first_run": summarize(first_runs),
+        "rerun": summarize(rerun_times),
+        "modules_loaded": modules,
+    }
+
+
+def load_collection(size: int, uri: Optional[str], seed: int):
+    db_instance = UniversityDB()
+    database = db_instance.connect_to_database(
+        uri or "", "Benchmark", in_process=not uri
+    )
+    database.drop_collection("Student")
+    collection = database["Student"]
+    db_instance.bulk_load(
+        collection,
+        db_instance.generate_students(size, seed=seed),
+        batch_size=5000,
+        report_every=60,
+    )
+    db_instance.create_indexes(collection)
+    return collection
+
+
+def run_question(collection, llm, question: str, caches: Dict[str, Any]) -> Dict[str, float]:
+    import helper
+    from schema_profiler import default_profiler
+
+    timings = {}
+    start = time.perf_counter()
+    query_dict = helper.process_user_query(
+        question,
+        llm,
+        schema_info="benchmark",
+        cache=caches.get("translation"),
+        profile=default_profiler.profile(collection),
+    )
+    timings["llm"] = time.perf_counter() - start
+
+    stage = time.perf_counter()
+    if helper.is_count(query_dict):
+        helper.count_documents(collection, query_dict.get("filter"), cache=caches.get("count"))
+        results = []
+    else:
+        results = helper.query_mongodb(collection, query_dict, cache=caches.get("result"))
+    timings["mongodb"] = time.perf_counter() - stage
+
+    stage = time.perf_counter()
+    table = helper.ResultTable.from_results(results, query_dict)
+    timings["dataframe"] = time.perf_counter() - stage
+
+    stage = time.perf_counter()
+    helper.display_unified_results(results, query_dict, table)
+    timings["render"] = time.perf_counter() - stage
+
+    timings["total"] = time.perf_counter() - start
+    return timings
+
+
+def run_sessions(collection, llm, sessions: int, rounds: int, caches) -> Dict[str, Any]:
+    questions = list(QUESTIONS)
+
+    def session(index):
+        samples = []
+        for n in range(rounds):
+            question = questions[(index + n) % len(questions)]
+            samples.append(run_question(collection, llm, question, caches))
+        return samples
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        samples = [s for result in pool.map(session, range(sessions)) for s in result]
+    elapsed = time.perf_counter() - started
+
+    report = {
+        "sessions": sessions,
+        "questions": len(samples),
+        "elapsed_s": elapsed,
+        "throughput_qps": len(samples) / elapsed if elapsed else 0.0,
+    }
+    for stage in ("total", "llm", "mongodb", "dataframe", "render"):
+        report[stage] = summarize([s[stage] for s in samples])
+    return report
+
+
+def make_caches(enabled: bool) -> Dict[str, Any]:
+    if not enabled:
+        return {}
+    from query_cache import CountCache, ResultCache, TranslationCache
+
+    return {
+        "translation": TranslationCache(),
+        "count": CountCache(),
+        "result": ResultCache(),
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], max_regression: float):
+    """p95 regressions beyond the allowed ratio, matched by data size and session count"""
+    failures = []
+    if current.get("startup") and baseline.get("startup"):
+        old = baseline["startup"]["first_run"]["p95_ms"]
+        new = current["startup"]["first_run"]["p95_ms"]
+        if old and new > old * (1 + max_regression):
+            failures.append(f"startup: first run p95 {old:.1f}ms -> {new:.1f}ms")
+    previous = {(r["size"], r["sessions"]): r for r in baseline.get("runs", [])}
+    for run in current["runs"]:
+        before = previous.get((run["size"], run["sessions"]))
+        if not before:
+            continue
+        old, new = before["total"]["p95_ms"], run["total"]["p95_ms"]
+        if old and new > old * (1 + max_regression):
+            failures.append(
+                f"size={run['size']} sessions={run['sessions']}: "
+                f"p95 {old:.1f}ms -> {new:.1f}ms"
+            )
+    return failures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="*", default=[1000, 10000])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--rounds", type=int, default=12, help="questions per session")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--uri", default=os.getenv("BENCHMARK_MONGODB_URI"),
+                        help="local mongod to use instead of mongomock")
+    parser.add_argument("--with-caches", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--startup", type=int, default=0, metavar="PROCESSES",
+                        help="also time cold starts and reruns of app.py in fresh processes")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--baseline", help="previous output to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # Streamlit warns about the missing script context on every call in bare mode
+    logging.disable(logging.WARNING)
+    llm = FakeChatModel(latency_ms=args.llm_latency_ms)
+    # The app pre-imports deferred modules at start-up; question timings exclude them
+    import_modules()
+
+    output = {
+        "backend": "mongod" if args.uri else "mongomock",
+        "llm_latency_ms": args.llm_latency_ms,
+        "caches": args.with_caches,
+        "runs": [],
+    }
+    if args.startup:
+        output["startup"] = measure_startup(args.startup)
+        startup = output["startup"]
+        print(
+            f"startup process p50={startup['process']['p50_ms']:.0f}ms "
+            f"first_run p50={startup['first_run']['p50_ms']:.0f}ms "
+            f"rerun p50={startup['rerun']['p50_ms']:.1f}ms "
+            f"modules={startup['modules_loaded']}"
+        )
+    for size in args.sizes:
+        collection = load_collection(size, args.uri, args.seed)
+        for sessions in args.sessions:
+            report = run_sessions(
+                collection, llm, sessions, args.rounds, make_caches(args.with_caches)
+            )
+            report["size"] = size
+            report["peak_rss_mb"] = peak_rss_mb()
+            output["runs"].append(report)
+            print(
+                f"size={size:>8} sessions={sessions:>3} "
+                f"p50={report['total']['p50_ms']:.1f}ms p95={report['total']['p95_ms']:.1f}ms "
+                f"qps={report['throughput_qps']:.1f} "
+                f"dataframe_p95={report['dataframe']['p95_ms']:.1f}ms "
+                f"rss={report['peak_rss_mb']:.0f}MB"
+            )
+
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare(output, json.load(f), args.max_regression)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+from executor import run_concurrently
+from summaries import SUMMARY_PREFIX
+
+
+class DatabaseCatalog:
+    """Schema profiles for every collection of one database.
+
+    Collection names are listed once (and refreshed every few minutes);
+    profiles are only sampled the first time a question needs them, all
+    missing collections in parallel on the shared worker pool, and then
+    served from the profiler's cache.
+    """
+
+    def __init__(self, database, profiler, max_collections: int = 50, names_seconds: float = 300):
+        self.database = database
+        self.profiler = profiler
+        self.max_collections = max_collections
+        self.names_seconds = names_seconds
+        self._names: List[str] = []
+        self._names_at = 0.0
+        self._lock = threading.Lock()
+
+    def names(self) -> List[str]:
+        with self._lock:
+            if self._names and time.time() - self._names_at <= self.names_seconds:
+                return list(self._names)
+        names = sorted(
+            name
+            for name in self.database.list_collection_names()
+            if not name.startswith(("system.", SUMMARY_PREFIX))
+        )[: self.max_collections]
+        with self._lock:
+            self._names, self._names_at = names, time.time()
+        return list(names)
+
+    def collection(self, name: str):
+        return self.database[name]
+
+    def profiles(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Profiles of all collections; collections that fail or time out are left out"""
+        profiles, missing = {}, []
+        for name in self.names():
+            profile = self.profiler.cached(self.database[name])
+            if profile is not None:
+                profiles[name] = profile
+            else:
+                missing.append(name)
+        results = run_concurrently(
+            [(self.profiler.profile, (self.database[name],)) for name in missing], timeout
+        )
+        for name, result in zip(missing, results):
+            if not isinstance(result, Exception) and result.docs_seen:
+                profiles[name] = result
+        return profiles
+
+    def resolve(self, default_collection, query_dict: Dict[str, Any]):
+        """Collection a generated query targets; the sidebar collection unless it names another"""
+        name = query_dict.get("collection")
+        if not name or name == default_collection.name:
+            return default_collection
+        if name not in self.names():
+            raise ValueError(
+                f"Collection '{name}' does not exist in {self.database.name}; "
+                f"available: {', '.join(self.names())}"
+            )
+        return self.database[name]
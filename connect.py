@@ -1,18 +1,89 @@
 import pymongo
 import os
+import argparse
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
 from dotenv import load_dotenv
 import certifi
 
 load_dotenv()
 
+FIRST_NAMES = [
+    "Alice", "Bob", "Charlie", "Diana", "Ethan", "Fiona", "George", "Hannah",
+    "Ian", "Julia", "Kevin", "Laura", "Mohammed", "Nina", "Omar", "Priya",
+    "Quinn", "Rahul", "Sofia", "Tom", "Uma", "Victor", "Wei", "Xena", "Yusuf", "Zoe",
+]
+LAST_NAMES = [
+    "Johnson", "Smith", "Brown", "Prince", "Hunt", "Davis", "Miller", "Lee",
+    "Parker", "Roberts", "Garcia", "Patel", "Nguyen", "Kim", "Müller", "Rossi",
+    "Khan", "Silva", "Chen", "Okafor",
+]
+# Majors and courses are Zipf-skewed so a few values dominate, as in real enrollment data
+MAJORS = [
+    "Computer Science", "Information Technology", "Data Science",
+    "Software Engineering", "Computer Engineering", "Cyber Security",
+    "Artificial Intelligence", "Information Systems",
+]
+COURSES = [
+    ("CSE 201", "Calculus"),
+    ("CSE 301", "Data Structures"),
+    ("CSE 302", "Discrete Mathematics"),
+    ("CSE 303", "Human Computer Interaction"),
+    ("CSE 401", "Machine Learning"),
+    ("CSE 402", "Software Engineering with Agile Practices"),
+    ("CSE 403", "Operating Systems"),
+    ("CSE 404", "Computer Networks"),
+    ("CSE 405", "Databases"),
+    ("CSE 406", "Computer Vision"),
+    ("CSE 407", "Compilers"),
+    ("CSE 408", "Distributed Systems"),
+]
+GRADES = ["A+", "A", "A-", "B+", "B", "B-", "C+", "C", "D", "F"]
+GRADE_WEIGHTS = [4, 14, 12, 14, 16, 10, 9, 10, 6, 5]
+TOTAL_CREDITS = 120
+
+# Indexes serving the app's typical questions: filter by major, range/sort on
+# gpa and credits, year lookups and "who took course X"
+STUDENT_INDEXES = [
+    ([("student_id", pymongo.ASCENDING)], {"unique": True}),
+    ([("major", pymongo.ASCENDING), ("gpa", pymongo.DESCENDING)], {}),
+    ([("gpa", pymongo.DESCENDING)], {}),
+    ([("enrollment_year", pymongo.ASCENDING)], {}),
+    ([("credits_taken", pymongo.DESCENDING)], {}),
+    ([("courses_completed.course_id", pymongo.ASCENDING)], {}),
+]
+
+
+def uses_tls(connection_string: str) -> bool:
+    """SRV URIs default to TLS; others enable it with tls=true or ssl=true"""
+    if connection_string.startswith("mongodb+srv://"):
+        return not re.search(r"[?&](tls|ssl)=false\b", connection_string, re.IGNORECASE)
+    return bool(re.search(r"[?&](tls|ssl)=true\b", connection_string, re.IGNORECASE))
+
+
+def _zipf_weights(n, s=1.1):
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
 
 class UniversityDB:
     def __init__(self):
         self.students = []
 
-    def connect_to_database(self, connection_string):
-        client = pymongo.MongoClient(connection_string, tlsCAFile=certifi.where())
-        db = client["University"]  # Creates database if it doesn't exist
+    def connect_to_database(self, connection_string, database="University", in_process=False):
+        if in_process:
+            # mongomock stands in for a server so scale tests can run offline
+            import mongomock
+
+            client = mongomock.MongoClient()
+        elif uses_tls(connection_string):
+            client = pymongo.MongoClient(connection_string, tlsCAFile=certifi.where())
+        else:
+            # tlsCAFile would switch TLS on for a plain local server
+            client = pymongo.MongoClient(connection_string)
+        db = client[database]  # Creates database if it doesn't exist
         return db
 
     def create_collections(self, mydb):
@@ -23,6 +94,85 @@ class UniversityDB:
         collec3.insert_many(self.students)
         print("Collections:", mydb.list_collection_names())
 
+    def generate_students(self, count, seed=42, start_id=1001):
+        """Stream `count` realistic student documents without holding them in memory"""
+        rng = random.Random(seed)
+        major_weights = _zipf_weights(len(MAJORS))
+        course_weights = _zipf_weights(len(COURSES), s=0.8)
+        current_year = 2025
+
+        for n in range(count):
+            enrollment_year = rng.choices(
+                range(2017, current_year + 1), weights=[1, 2, 4, 6, 8, 9, 9, 8, 7]
+            )[0]
+            years_in = current_year - enrollment_year
+            credits_taken = min(TOTAL_CREDITS + 10, max(0, int(rng.gauss(30 * years_in, 12))))
+            # Long-tailed course history: most students have a handful, a few have many
+            n_courses = min(len(COURSES), 1 + int(rng.expovariate(1 / (0.5 + years_in * 0.6))))
+            course_indexes = set()
+            while len(course_indexes) < n_courses:
+                course_indexes.add(
+                    rng.choices(range(len(COURSES)), weights=course_weights)[0]
+                )
+            yield {
+                "student_id": f"S{start_id + n}",
+                "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                "major": rng.choices(MAJORS, weights=major_weights)[0],
+                "enrollment_year": enrollment_year,
+                "gpa": round(min(4.0, max(0.0, rng.gauss(3.1, 0.45))), 2),
+                "credits_taken": credits_taken,
+                "credits_remaining": max(0, TOTAL_CREDITS - credits_taken),
+                "courses_completed": [
+                    {
+                        "course_id": COURSES[i][0],
+                        "course_name": COURSES[i][1],
+                        "grade": rng.choices(GRADES, weights=GRADE_WEIGHTS)[0],
+                    }
+                    for i in sorted(course_indexes)
+                ],
+            }
+
+    def bulk_load(self, collection, documents, batch_size=5000, workers=1, report_every=5):
+        """Insert documents in unordered batches, optionally from several threads.
+
+        At most `workers * 2` batches are in flight, so memory stays bounded
+        however many documents the generator produces.
+        """
+        inserted, started, last_report = 0, time.perf_counter(), time.perf_counter()
+        documents = iter(documents)
+
+        def insert(batch):
+            collection.insert_many(batch, ordered=False)
+            return len(batch)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            while True:
+                batch = list(islice(documents, batch_size))
+                if batch:
+                    pending.add(pool.submit(insert, batch))
+                if len(pending) >= workers * 2 or (not batch and pending):
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    inserted += sum(future.result() for future in done)
+                if not batch and not pending:
+                    break
+                now = time.perf_counter()
+                if now - last_report >= report_every:
+                    print(f"  {inserted:,} documents, {inserted / (now - started):,.0f} docs/s")
+                    last_report = now
+
+        elapsed = time.perf_counter() - started
+        print(
+            f"Inserted {inserted:,} documents in {elapsed:.1f}s "
+            f"({inserted / elapsed if elapsed else 0:,.0f} docs/s)"
+        )
+        return inserted, elapsed
+
+    def create_indexes(self, collection):
+        for keys, options in STUDENT_INDEXES:
+            collection.create_index(keys, **options)
+        print("Indexes:", sorted(collection.index_information()))
+
     def student_data(self):
         self.students = [
             {
@@ -249,13 +399,56 @@ class UniversityDB:
         ]
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create and load the University database")
+    parser.add_argument(
+        "--count", type=int, default=0,
+        help="generate this many synthetic students instead of the 10 sample records",
+    )
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=1, help="parallel insert threads")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database", default="University")
+    parser.add_argument("--collection", default="Student")
+    parser.add_argument(
+        "--append", action="store_true", help="keep existing documents instead of dropping"
+    )
+    parser.add_argument("--no-indexes", action="store_true")
+    parser.add_argument(
+        "--in-process", action="store_true",
+        help="load into an in-process mongomock database (no server needed)",
+    )
+    return parser.parse_args()
+
+
 def main():
-    connection_string = os.getenv("MONGODB_CONNECTION_STRING")
+    args = parse_args()
+    connection_string = os.getenv("MONGODB_CONNECTION_STRING", "mongodb://localhost:27017")
     db_instance = UniversityDB()
-    db_instance.student_data()
-    database = db_instance.connect_to_database(connection_string)
-    db_instance.create_collections(database)
-    print("Database and collection Student created successfully.")
+    database = db_instance.connect_to_database(
+        connection_string, args.database, in_process=args.in_process
+    )
+
+    if not args.count:
+        db_instance.student_data()
+        db_instance.create_collections(database)
+        print("Database and collection Student created successfully.")
+        return
+
+    collection = database[args.collection]
+    start_id = 1001
+    if args.append:
+        start_id += collection.estimated_document_count()
+    else:
+        database.drop_collection(args.collection)
+    db_instance.bulk_load(
+        collection,
+        db_instance.generate_students(args.count, seed=args.seed, start_id=start_id),
+        batch_size=args.batch_size,
+        workers=args.workers,
+    )
+    if not args.no_indexes:
+        db_instance.create_indexes(collection)
 
 
 if __name__ == "__main__":
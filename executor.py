@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FuturesTimeout
+from typing import Any, Callable, List, Optional, Tuple
+
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", "8"))
+MAX_PENDING_TASKS = int(os.getenv("MAX_PENDING_TASKS", "64"))
+
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+DB_TIMEOUT_SECONDS = float(os.getenv("DB_TIMEOUT_SECONDS", "20"))
+
+
+class StageTimeout(Exception):
+    """A pipeline stage did not finish within its time budget"""
+
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"{stage} timed out after {timeout:.1f}s")
+        self.stage = stage
+        self.timeout = timeout
+
+
+class PoolSaturated(Exception):
+    """Too many tasks are already queued on the shared worker pool"""
+
+
+class WorkerPool:
+    """Process-wide bounded pool shared by every Streamlit session.
+
+    The pool caps concurrent LLM/MongoDB work and the semaphore caps queued
+    work, so a burst of sessions waits briefly or is rejected instead of
+    spawning unbounded threads.
+    """
+
+    def __init__(self, max_workers: int = WORKER_POOL_SIZE, max_pending: int = MAX_PENDING_TASKS):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="mongoquery"
+        )
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable, *args, wait: float = 5.0, **kwargs) -> Future:
+        if not self._slots.acquire(timeout=wait):
+            raise PoolSaturated("Server is busy, please retry in a moment.")
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _future):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool: Optional[WorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> WorkerPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool()
+        return _pool
+
+
+def submit(fn: Callable, *args, **kwargs) -> Future:
+    return get_pool().submit(fn, *args, **kwargs)
+
+
+def wait_stage(future: Future, stage: str, timeout: Optional[float]):
+    """Wait for a submitted stage; on timeout cancel it and raise StageTimeout"""
+    try:
+        return future.result(timeout=timeout)
+    except FuturesTimeout:
+        future.cancel()
+        raise StageTimeout(stage, timeout)
+
+
+def run_stage(stage: str, fn: Callable, *args, timeout: Optional[float] = None, **kwargs):
+    return wait_stage(submit(fn, *args, **kwargs), stage, timeout)
+
+
+def run_concurrently(
+    calls: List[Tuple[Callable, tuple]], timeout: Optional[float] = None
+) -> List[Any]:
+    """Run independent calls in parallel; failed or timed-out calls yield their exception"""
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    futures = [submit(fn, *args) for fn, args in calls]
+    results = []
+    for (fn, _), future in zip(calls, futures):
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        try:
+            results.append(wait_stage(future, fn.__name__, remaining))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def cancel_all(futures):
+    for future in futures:
+        if future is not None:
+            future.cancel()
+
+
+def warm_connection(collection):
+    # A ping checks out (and if needed opens) a pooled connection ahead of the query
+    collection.database.client.admin.command("ping")
+    return True
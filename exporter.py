@@ -0,0 +1,169 @@
+import csv
+import io
+import json
+import os
+import time
+from typing import Dict, Any, Callable, Iterable, List, Optional
+
+from rendering import ResultTable, arrow, flatten_results
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "ndjson": ("application/x-ndjson", ".ndjson"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+}
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+EXPORT_MAX_TIME_MS = int(os.getenv("EXPORT_MAX_TIME_MS", "600000"))
+
+
+def export_query(query_dict: Dict[str, Any], drop_limit: bool = False) -> Dict[str, Any]:
+    """The query to export: same filter/pipeline, export time limit, optionally no row limit"""
+    query_dict = dict(query_dict)
+    if drop_limit:
+        query_dict["limit"] = 0
+    query_dict["max_time_ms"] = EXPORT_MAX_TIME_MS
+    return query_dict
+
+
+class _CountingWriter:
+    """Binary file wrapper that counts bytes written; enough of a file for csv/pyarrow"""
+
+    def __init__(self, out):
+        self.out = out
+        self.bytes = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.out.write(data)
+        self.bytes += len(data)
+        return len(data)
+
+    def flush(self):
+        self.out.flush()
+
+    def tell(self) -> int:
+        return self.bytes
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def readable(self) -> bool:
+        return False
+
+    def close(self):
+        # The caller owns the underlying stream
+        self.closed = True
+
+
+def _castable(value, arrow_type) -> bool:
+    pa, _ = arrow()
+    try:
+        pa.array([value], type=arrow_type)
+        return True
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        return False
+
+
+def _align(rows: List[Dict[str, Any]], schema, dropped: set, nulled: Dict[str, int]):
+    """Build a chunk's table with the schema fixed by the first chunk"""
+    pa, _ = arrow()
+    for row in rows:
+        dropped.update(name for name in row if name not in schema.names)
+    columns = []
+    for field in schema:
+        values = [row.get(field.name) for row in rows]
+        try:
+            columns.append(pa.array(values, type=field.type))
+            continue
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+            pass
+        if field.type == pa.string():
+            values = [None if v is None else str(v) for v in values]
+        else:
+            # e.g. "n/a" in a numeric column: keep the row, null the cell, report it
+            for index, value in enumerate(values):
+                if value is not None and not _castable(value, field.type):
+                    nulled[field.name] = nulled.get(field.name, 0) + 1
+                    values[index] = None
+        columns.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def write_export(
+    chunks: Iterable[List[Dict[str, Any]]],
+    fmt: str,
+    out,
+    query_dict: Optional[Dict[str, Any]] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> Dict[str, Any]:
+    """Write document chunks to a binary stream as CSV, NDJSON or Parquet.
+
+    Only one chunk is held at a time. CSV and Parquet rows are flattened like
+    the result table (sub-documents as dotted columns, arrays as one cell);
+    their columns are fixed by the first chunk, and columns that only appear
+    later are reported in "dropped_columns". Parquet values that don't fit the
+    column type are written as null and counted in "nulled_values". NDJSON
+    keeps documents as-is.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'")
+    pa, pq = arrow() if fmt == "parquet" else (None, None)
+    if fmt == "parquet" and pq is None:
+        raise ValueError("Parquet export needs pyarrow")
+
+    started = time.perf_counter()
+    writer = _CountingWriter(out)
+    rows, dropped, nulled = 0, set(), {}
+    csv_writer = text = parquet_writer = None
+    try:
+        for chunk in chunks:
+            if fmt == "ndjson":
+                writer.write(
+                    "".join(json.dumps(doc, default=str) + "\n" for doc in chunk).encode("utf-8")
+                )
+            elif fmt == "csv":
+                flat = flatten_results(chunk, query_dict)
+                if csv_writer is None:
+                    columns = list(dict.fromkeys(name for row in flat for name in row))
+                    text = io.TextIOWrapper(writer, encoding="utf-8", newline="")
+                    csv_writer = csv.DictWriter(text, fieldnames=columns, extrasaction="ignore")
+                    csv_writer.writeheader()
+                for row in flat:
+                    dropped.update(name for name in row if name not in csv_writer.fieldnames)
+                csv_writer.writerows(flat)
+                text.flush()
+            else:
+                flat = flatten_results(chunk, query_dict)
+                if parquet_writer is None:
+                    schema = ResultTable.from_flat_rows(flat).to_arrow().schema
+                    # All-null columns in the first chunk take whatever comes later as text
+                    schema = pa.schema(
+                        pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f
+                        for f in schema
+                    )
+                    parquet_writer = pq.ParquetWriter(writer, schema, compression="zstd")
+                parquet_writer.write_table(_align(flat, parquet_writer.schema, dropped, nulled))
+            rows += len(chunk)
+            if progress is not None:
+                progress(rows, writer.bytes)
+        if fmt == "parquet" and parquet_writer is None:
+            pq.write_table(pa.table({}), writer)  # no rows: still a valid file
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+        if text is not None:
+            text.flush()
+            text.detach()
+    writer.flush()
+
+    return {
+        "format": fmt,
+        "rows": rows,
+        "bytes": writer.bytes,
+        "seconds": round(time.perf_counter() - started, 3),
+        "dropped_columns": sorted(dropped),
+        "nulled_values": nulled,
+    }
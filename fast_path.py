@@ -0,0 +1,286 @@
+import os
+import re
+import threading
+import weakref
+from typing import Dict, Any, List, Optional, Tuple
+
+from metrics import registry
+
+_WORD_RE = re.compile(r"\d+(?:\.\d+)?|[a-z0-9_.+\-]+|[<>]=?|=")
+
+# Words that carry no query meaning in questions like "show me the students with ..."
+NOISE = {
+    "a", "an", "the", "me", "show", "find", "get", "list", "give", "display",
+    "all", "students", "student", "documents", "document", "records", "record",
+    "rows", "entries", "people", "ones", "with", "who", "whose", "that", "have",
+    "has", "having", "is", "are", "was", "were", "of", "in", "from", "for", "and",
+    "please", "which", "whats", "what", "their", "there", "by", "to", "than", "on",
+}
+
+OPERATORS = {
+    ("greater", "than", "or", "equal", "to"): "$gte",
+    ("less", "than", "or", "equal", "to"): "$lte",
+    ("at", "least"): "$gte",
+    ("at", "most"): "$lte",
+    ("no", "more", "than"): "$lte",
+    ("no", "less", "than"): "$gte",
+    ("more", "than"): "$gt",
+    ("greater", "than"): "$gt",
+    ("higher", "than"): "$gt",
+    ("less", "than"): "$lt",
+    ("fewer", "than"): "$lt",
+    ("lower", "than"): "$lt",
+    ("equal", "to"): "$eq",
+    ("above",): "$gt",
+    ("over",): "$gt",
+    ("exceeding",): "$gt",
+    ("below",): "$lt",
+    ("under",): "$lt",
+    ("equals",): "$eq",
+    (">=",): "$gte",
+    ("<=",): "$lte",
+    (">",): "$gt",
+    ("<",): "$lt",
+    ("=",): "$eq",
+}
+
+SORT_PHRASES = {
+    ("sorted", "by"), ("sort", "by"), ("ordered", "by"), ("order", "by"),
+    ("ranked", "by"), ("sorted", "on"),
+}
+COUNT_PHRASES = {("how", "many"), ("count", "of"), ("number", "of"), ("count",)}
+DESCENDING = {"desc", "descending", "highest", "largest", "most", "best", "top", "max"}
+ASCENDING = {"asc", "ascending", "lowest", "smallest", "least", "worst", "bottom", "min"}
+LIMIT_WORDS = {"top", "first", "limit", "bottom"}
+# "the student with the highest gpa" wants one row; "students with the highest gpa" a ranking
+SINGULAR = {"student", "document", "record", "entry", "person", "one"}
+PLURAL = {"students", "documents", "records", "entries", "people", "ones", "rows"}
+
+
+def _number(text: str):
+    return float(text) if "." in text else int(text)
+
+
+class _Vocabulary:
+    """Phrases the parser understands for one schema profile"""
+
+    def __init__(self, profile):
+        self.phrases: Dict[Tuple[str, ...], Tuple[str, Any]] = {}
+        self.numeric = set()
+        leaf_counts: Dict[str, int] = {}
+        for path in profile.paths():
+            leaf_counts[path.rsplit(".", 1)[-1]] = leaf_counts.get(path.rsplit(".", 1)[-1], 0) + 1
+
+        for path in profile.paths():
+            if profile.dominant_type(path) in ("dict", "list"):
+                continue
+            if profile.dominant_type(path) in ("int", "float"):
+                self.numeric.add(path)
+            aliases = {path, path.replace("_", " ").replace(".", " ")}
+            leaf = path.rsplit(".", 1)[-1]
+            if leaf_counts[leaf] == 1:
+                aliases |= {leaf, leaf.replace("_", " ")}
+            for alias in aliases:
+                self.phrases[tuple(alias.lower().split())] = ("field", path)
+
+            for value in profile.enum_values(path):
+                if not isinstance(value, str):
+                    continue
+                words = tuple(_WORD_RE.findall(value.lower()))
+                # Single letters and filler words ("A", "in") are too ambiguous to match alone
+                if not words or (len(words) == 1 and (len(words[0]) < 2 or words[0] in NOISE)):
+                    continue
+                self.phrases.setdefault(words, ("value", (path, value)))
+
+        for words, op in OPERATORS.items():
+            self.phrases.setdefault(words, ("op", op))
+        for words in SORT_PHRASES:
+            self.phrases.setdefault(words, ("sort", None))
+        for words in COUNT_PHRASES:
+            self.phrases.setdefault(words, ("count", None))
+        self.max_phrase = max(len(words) for words in self.phrases)
+
+    def tokenize(self, question: str) -> List[Tuple[str, Any]]:
+        words = _WORD_RE.findall(question.lower())
+        tokens, i = [], 0
+        while i < len(words):
+            for size in range(min(self.max_phrase, len(words) - i), 0, -1):
+                match = self.phrases.get(tuple(words[i : i + size]))
+                if match:
+                    tokens.append(match)
+                    i += size
+                    break
+            else:
+                word = words[i]
+                if re.fullmatch(r"\d+(?:\.\d+)?", word):
+                    tokens.append(("number", _number(word)))
+                elif word in DESCENDING or word in ASCENDING:
+                    tokens.append(("direction", -1 if word in DESCENDING else 1))
+                elif word in LIMIT_WORDS:
+                    tokens.append(("limit", None))
+                elif word in SINGULAR or word in PLURAL:
+                    tokens.append(("noun", word in PLURAL))
+                elif word in NOISE:
+                    tokens.append(("noise", None))
+                else:
+                    tokens.append(("unknown", word))
+                i += 1
+        return tokens
+
+
+class FastPathParser:
+    """Deterministic parser for simple filter/sort/limit/count questions.
+
+    Every word of the question must be understood; anything else (aggregations,
+    negations, projections, unknown words) falls back to the LLM.
+    """
+
+    def __init__(self):
+        # Profiles are replaced, not modified, on refresh; a vocabulary lives as long as its profile
+        self._vocabularies: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.fallbacks = 0
+        # Follow-ups parsed for the refiner are counted apart from fresh questions
+        self.follow_up_hits = 0
+        self.follow_up_fallbacks = 0
+
+    def _vocabulary(self, profile) -> _Vocabulary:
+        with self._lock:
+            vocabulary = self._vocabularies.get(profile)
+            if vocabulary is None:
+                vocabulary = self._vocabularies[profile] = _Vocabulary(profile)
+            return vocabulary
+
+    def parse(self, question: str, profile, follow_up: bool = False) -> Optional[Dict[str, Any]]:
+        query_dict = None
+        if profile is not None and profile.fields:
+            vocabulary = self._vocabulary(profile)
+            query_dict = self._parse_tokens(vocabulary.tokenize(question), vocabulary)
+        prefix = "follow_up_" if follow_up else ""
+        result = "fallbacks" if query_dict is None else "hits"
+        with self._lock:
+            setattr(self, prefix + result, getattr(self, prefix + result) + 1)
+        registry.inc(
+            "mongoquery_fast_path_total",
+            result="fallback" if query_dict is None else "hit",
+            kind="follow_up" if follow_up else "question",
+        )
+        return query_dict
+
+    def _parse_tokens(self, tokens, vocabulary) -> Optional[Dict[str, Any]]:
+        filter_dict: Dict[str, Any] = {}
+        sort: Dict[str, int] = {}
+        limit = 0
+        counting = False
+        field = op = direction = last_sorted = None
+        sorting = limit_pending = superlative = False
+        singular = plural = False
+
+        for kind, value in tokens:
+            if kind == "unknown":
+                return None
+            if kind == "noise":
+                continue
+            if kind == "noun":
+                plural, singular = plural or value, singular or not value
+                continue
+            if kind == "count":
+                counting = True
+            elif kind == "field":
+                if sorting or direction is not None:
+                    # "sorted by gpa", "highest gpa", "top 5 by credits_taken"
+                    superlative = superlative or direction is not None
+                    sort[value] = direction or 1
+                    last_sorted = value
+                    sorting, direction = False, None
+                    field = None
+                    continue
+                field = value
+            elif kind == "op":
+                if op is not None:
+                    return None
+                op = value
+            elif kind == "direction":
+                if last_sorted is not None:
+                    # "sorted by gpa descending"
+                    sort[last_sorted] = value
+                    last_sorted = None
+                    continue
+                direction = value
+                limit_pending = True
+            elif kind == "sort":
+                sorting = True
+            elif kind == "limit":
+                limit_pending = True
+            elif kind == "value":
+                path, literal = value
+                existing = filter_dict.get(path)
+                if existing is None:
+                    filter_dict[path] = literal
+                elif isinstance(existing, dict) and "$in" in existing:
+                    existing["$in"].append(literal)
+                elif not isinstance(existing, dict):
+                    filter_dict[path] = {"$in": [existing, literal]}
+                else:
+                    return None
+                field = None
+            elif kind == "number":
+                if op is not None:
+                    if field not in vocabulary.numeric:
+                        return None
+                    condition = filter_dict.setdefault(field, {})
+                    if not isinstance(condition, dict):
+                        return None
+                    if op == "$eq":
+                        filter_dict[field] = value
+                    else:
+                        condition[op] = value
+                    op = None
+                elif limit_pending and isinstance(value, int) and not limit:
+                    limit = value
+                    limit_pending = False
+                elif field in vocabulary.numeric and field not in filter_dict:
+                    filter_dict[field] = value
+                else:
+                    return None
+            if kind != "direction":
+                last_sorted = None
+
+        # Dangling operators ("gpa above"), "sorted by" with no field, or a
+        # direction ("highest") that never met a field
+        if op is not None or sorting or direction is not None:
+            return None
+        if counting:
+            if sort or limit:
+                return None
+            return {"operation": "count", "filter": filter_dict}
+        if not (filter_dict or sort or limit):
+            return None
+        if superlative and not limit and not plural:
+            if not singular:
+                return None  # "highest gpa": one row or a ranking? the LLM decides
+            limit = 1
+        return {
+            "filter": filter_dict,
+            "projection": {},
+            "sort": sort,
+            "limit": limit,
+            "skip": 0,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        attempts = self.hits + self.fallbacks
+        return {
+            "hits": self.hits,
+            "fallbacks": self.fallbacks,
+            "hit_rate": self.hits / attempts if attempts else 0.0,
+            "follow_up_hits": self.follow_up_hits,
+            "follow_up_fallbacks": self.follow_up_fallbacks,
+        }
+
+
+def fast_path_from_env() -> Optional[FastPathParser]:
+    if os.getenv("FAST_PATH_ENABLED", "1").lower() in ("0", "false", "no"):
+        return None
+    return FastPathParser()
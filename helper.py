@@ -1,185 +1,105 @@
 import streamlit as st
-import pandas as pd
+import os
+import tempfile
+import time
+import uuid
 from typing import Dict, Any
-from pymongo import MongoClient
-from langchain_community.callbacks.streamlit import StreamlitCallbackHandler
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-
-def apply_custom_css(file_name="./styles.css"):
-    with open(file_name) as f:
-        css = f.read()
-        st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
-    print("Custom CSS applied.")
-
-@st.cache_resource(ttl="2h")
+from mongo_pool import clients
+from exporter import EXPORT_CHUNK_ROWS, EXPORT_FORMATS, export_query, write_export
+from rendering import ResultTable, WINDOW_ROWS, flatten_results
+from metrics import registry, span, query_shape
+# Translation and execution live in querying.py so the service can run without
+# streamlit; they are re-exported here for app.py
+from querying import (
+    ResultPager,
+    count_documents,
+    document_bytes,
+    get_collection_schema,
+    is_aggregate,
+    is_count,
+    process_refinement,
+    process_user_query,
+    remember_translation,
+    stream_mongodb,
+)
+
+
 def configure_mongo(uri, db_name, collection_name):
     try:
-        client = MongoClient(uri, serverSelectionTimeoutMS=5000)
-        db = client[db_name]
-        collection = db[collection_name]
-        client.server_info()
+        # Every db/collection pair shares the URI's pooled client
+        collection = clients.collection(uri, db_name, collection_name)
+        collection.database.client.admin.command("ping")
         return collection
     except Exception as e:
         st.error(f"MongoDB connection error: {e}")
         return None
 
-def get_collection_schema(collection, collection_name):
-    try:
-        sample_docs = list(collection.find().limit(1))
-        if not sample_docs:
-            return "Collection is empty.", []
-        all_keys = set()
-        for doc in sample_docs:
-            all_keys.update(doc.keys())
-        schema = {k: type(sample_docs[0][k]).__name__ for k in all_keys if k != "_id"}
-        schema_info = f"\nCollection: {collection_name}\n\n Sample record:\n"
-        for key, val in schema.items():
-            schema_info += f"- `{key}`: `{val}`\n"
-        return schema_info, sample_docs
-    except Exception as e:
-        return f"Error getting schema: {str(e)}", []
 
-def query_mongodb(collection, query_dict: Dict[str, Any]):
-    """Execute MongoDB query with proper sorting and formatting"""
+def query_mongodb(collection, query_dict: Dict[str, Any], cache=None):
+    """Execute a find or aggregate query with proper sorting and formatting"""
     try:
-        # Start with find operation
-        query = collection.find(
-            query_dict.get("filter", {}), query_dict.get("projection", {})
-        )
-
-        # Apply sort if specified and not empty
-        if query_dict.get("sort"):
-            query = query.sort(query_dict["sort"])
-
-        # Apply skip if specified and > 0
-        if query_dict.get("skip", 0) > 0:
-            query = query.skip(query_dict["skip"])
-
-        # Apply limit if specified and > 0
-        limit = query_dict.get("limit", 0)
-        if limit > 0:
-            query = query.limit(limit)
-        else:
-            # Default limit to prevent huge outputs
-            query = query.limit(100)
-
-        results = list(query)
-
-        # Convert ObjectId to string for JSON serialization
-        for doc in results:
-            if "_id" in doc:
-                doc["_id"] = str(doc["_id"])
-
+        # Default limit to prevent huge outputs
+        if query_dict.get("limit", 0) <= 0:
+            query_dict = {**query_dict, "limit": 100}
+
+        if cache is not None:
+            cache_key = cache.key(collection.full_name, query_dict)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        with span("mongodb", shape=query_shape(query_dict)) as timing:
+            results = []
+            for batch in stream_mongodb(collection, query_dict):
+                results.extend(batch)
+            timing.set(
+                docs=len(results), bytes=sum(document_bytes(d) for d in results)
+            )
+        if cache is not None:
+            cache.put(cache_key, results)
         return results
 
     except Exception as e:
         st.error(f"Error querying MongoDB: {str(e)}")
         return []
 
-def count_documents(collection, filter_dict=None):
-    try:
-        filter_dict = filter_dict or {}
-        return collection.count_documents(filter_dict)
-    except Exception as e:
-        return f"Error counting documents: {str(e)}"
-
-def process_user_query(user_input: str, llm) -> Dict[str, Any]:
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            (
-                "system",
-                """
-        You are an expert MongoDB query generator.
-        You will be given natural language questions about the database collection.
-        Return ONLY a valid JSON object in this flexible format:
-        {{
-            "filter": {{ ... }},
-            "projection": {{ ... }},
-            "sort": {{ ... }},
-            "limit": number,
-            "skip": number
-        }}
-        Rules:
-        - "filter": for query conditions (use {{}} for empty filter)
-        - "projection": for fields to show (use {{}} for all fields)
-        - "sort": field and direction (1 for ascending, -1 for descending) - ONLY include if sorting is needed
-        - "limit": maximum number of documents - ONLY include if limiting is needed  
-        - "skip": number of documents to skip - ONLY include if skipping is needed
-        - Only include fields that are actually needed for the query
-        - For empty values, use empty objects {{}}
-        - Always return valid JSON that can be parsed by json.loads()
-        - Support all MongoDB operators: $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin, $and, $or, $regex, etc.
-
-        Examples:
-        User: "find students with GPA above 3.5"
-        Response: {{"filter": {{"gpa": {{"$gt": 3.5}}}}, "projection": {{}}}}
-
-        User: "get top 5 students by GPA"
-        Response: {{"filter": {{}}, "projection": {{}}, "sort": {{"gpa": -1}}, "limit": 5}}
-
-        User: "show me names and emails of students from CS department"
-        Response: {{"filter": {{"department": "CS"}}, "projection": {{"name": 1, "email": 1}}}}
-
-        User: "find students who failed any course (GPA < 2.0) and sort by name"
-        Response: {{"filter": {{"gpa": {{"$lt": 2.0}}}}, "projection": {{}}, "sort": {{"name": 1}}}}
-
-        User: "get second page of 10 students, skip first 10"
-        Response: {{"filter": {{}}, "projection": {{}}, "skip": 10, "limit": 10}}
-        """,
-            ),
-            ("human", "{input}"),
-        ]
-    )
-
-    chain = prompt | llm | StrOutputParser()
 
-    try:
-        response = chain.invoke({"input": user_input})
-
-        # Clean the response - extract JSON if it's wrapped in markdown or other text
-        json_match = re.search(r"\{.*\}", response, re.DOTALL)
-        if json_match:
-            response = json_match.group()
-
-        # Parse and validate JSON
-        query_dict = json.loads(response)
-
-        # Set default values for missing optional fields
-        default_query = {
-            "filter": {},
-            "projection": {},
-            "sort": {},
-            "limit": 0,
-            "skip": 0,
-        }
-
-        for key in default_query:
-            if key not in query_dict:
-                query_dict[key] = default_query[key]
-
-        return query_dict
+def display_table_window(table: ResultTable, key=None):
+    """Send only the visible window of rows to the browser"""
+    start = 0
+    if table.num_rows > WINDOW_ROWS:
+        col1, col2 = st.columns([1, 3])
+        with col1:
+            start = st.number_input(
+                "Rows from",
+                min_value=1,
+                max_value=table.num_rows,
+                value=1,
+                step=WINDOW_ROWS,
+                key=f"window_{key}",
+            ) - 1
+        with col2:
+            st.caption(
+                f"Showing rows {start + 1}–{min(start + WINDOW_ROWS, table.num_rows)} "
+                f"of {table.summary()}"
+            )
+    st.dataframe(table.window(start, WINDOW_ROWS), use_container_width=True, hide_index=True)
 
-    except Exception as e:
-        return default_query
 
-def display_unified_results(results, query_dict=None):
-    if not results:
+def display_unified_results(results, query_dict=None, table=None, key=None):
+    if not results and table is None:
         st.info("No documents found matching your query.")
         return
     with st.container():
-        if results and isinstance(results[0], dict):
+        if table is not None or isinstance(results[0], dict):
             try:
-                df = pd.DataFrame(results)
-                # Remove _id column if user didn't specifically ask for it
-                if "_id" in df.columns and not (
-                    query_dict
-                    and query_dict.get("projection")
-                    and "_id" in query_dict.get("projection", {})
-                ):
-                    df = df.drop("_id", axis=1)
-                # Display the dataframe
-                st.dataframe(df, use_container_width=True, hide_index=True)
+                with span("render", docs=len(results or [])):
+                    if table is None:
+                        table = ResultTable.from_results(results, query_dict)
+                    if not table.num_rows:
+                        st.info("No documents found matching your query.")
+                        return
+                    display_table_window(table, key)
             except Exception as e:
                 st.warning("Could not display as table. Showing raw data:")
                 st.json(results)
@@ -187,9 +107,188 @@ def display_unified_results(results, query_dict=None):
             st.json(results)
 
 
-def display_compact_query_analysis(query_dict):
+def display_streamed_results(pager: ResultPager, query_dict=None) -> ResultTable:
+    """Render a page into the table as batches arrive instead of after the last one"""
+    placeholder = st.empty()
+    render_seconds = 0.0
+    rows, shown = [], 0
+    try:
+        for page in pager.iter_page():
+            start = time.perf_counter()
+            # Each document is flattened exactly once, as its batch arrives
+            rows.extend(flatten_results(page[len(rows):], query_dict))
+            # Redraw only while the visible window is still filling up
+            if shown < WINDOW_ROWS:
+                import pandas as pd
+
+                placeholder.dataframe(
+                    pd.DataFrame(rows[:WINDOW_ROWS]),
+                    use_container_width=True,
+                    hide_index=True,
+                )
+                shown = min(len(rows), WINDOW_ROWS)
+            render_seconds += time.perf_counter() - start
+        registry.record("render", render_seconds, docs=len(pager.page))
+    except Exception as e:
+        st.error(f"Error querying MongoDB: {str(e)}")
+        pager.has_more = False
+    if not pager.page:
+        placeholder.info("No documents found matching your query.")
+    return ResultTable.from_flat_rows(rows)
+
+
+def display_page_controls(content, message_key):
+    """Cursor-backed paging for a result message that still has a live pager"""
+    pager = st.session_state.get("pagers", {}).get(message_key)
+    if pager is None:
+        return
+    col1, col2 = st.columns([1, 4])
+    with col1:
+        next_clicked = st.button(
+            "Next page", key=f"next_page_{message_key}", disabled=not pager.has_more
+        )
+    with col2:
+        st.caption(f"Page {pager.page_number} · {pager.page_size} rows per page")
+    if next_clicked:
+        content["results"] = pager.next_page()
+        content["table"] = ResultTable.from_results(content["results"], content["query_dict"])
+        store = st.session_state.get("history_store")
+        if store is not None:
+            store.put(message_key, content)
+        st.rerun()
+
+
+def export_to_file(collection, query_dict, fmt, path, progress=None):
+    """Stream a query's full result to a file, one chunk of rows at a time"""
+    with open(path, "wb") as f:
+        with span("export", format=fmt) as timing:
+            summary = write_export(
+                stream_mongodb(collection, query_dict, EXPORT_CHUNK_ROWS),
+                fmt,
+                f,
+                query_dict,
+                progress,
+            )
+            timing.set(docs=summary["rows"], bytes=summary["bytes"])
+    return summary
+
+
+def display_export_controls(content, message_key):
+    """Re-run a result's query without the display cap and offer it as a download"""
+    collection = st.session_state.get("mongo_collection")
+    if collection is None or not content.get("query_dict"):
+        return
+    if content.get("collection"):
+        collection = collection.database[content["collection"]]
+
+    with st.expander("⬇️ Export all rows", expanded=False):
+        fmt = st.selectbox("Format", list(EXPORT_FORMATS), key=f"export_format_{message_key}")
+        if st.button("Prepare export", key=f"export_{message_key}"):
+            status = st.empty()
+
+            def progress(rows, written):
+                status.caption(f"Exported {rows:,} rows ({written / 1024 / 1024:.1f} MiB)…")
+
+            store = st.session_state.get("history_store")
+            directory = os.path.dirname(store.path) if store else tempfile.gettempdir()
+            path = os.path.join(
+                directory, f"mongoquery-export-{uuid.uuid4().hex}{EXPORT_FORMATS[fmt][1]}"
+            )
+            previous = content.pop("export", None)
+            if previous and os.path.exists(previous["path"]):
+                os.remove(previous["path"])
+            # "All documents" carries a display limit; generated limits are the user's own
+            query_dict = export_query(
+                content["query_dict"], drop_limit=content["type"] == "all_documents"
+            )
+            try:
+                summary = export_to_file(collection, query_dict, fmt, path, progress)
+            except Exception as e:
+                st.error(f"Export failed: {str(e)}")
+                return
+            if store is not None:
+                store.track_file(path)
+            content["export"] = {"path": path, **summary}
+            status.empty()
+
+        export = content.get("export")
+        if export and os.path.exists(export["path"]):
+            st.caption(
+                f"{export['rows']:,} rows, {export['bytes'] / 1024 / 1024:.1f} MiB "
+                f"in {export['seconds']:.1f}s"
+            )
+            if export["dropped_columns"]:
+                st.caption(
+                    "Columns missing from the first rows were left out: "
+                    + ", ".join(export["dropped_columns"])
+                )
+            if export["nulled_values"]:
+                st.caption(
+                    "Values that didn't fit their column type were left empty: "
+                    + ", ".join(f"{k} ({v})" for k, v in export["nulled_values"].items())
+                )
+            mime, extension = EXPORT_FORMATS[export["format"]]
+            # Streamlit loads the file into its media store to serve it; the headless
+            # service's /export streams the cursor straight to the client instead
+            with open(export["path"], "rb") as f:
+                st.download_button(
+                    f"Download {export['format'].upper()}",
+                    f,
+                    file_name=f"{collection.name}{extension}",
+                    mime=mime,
+                    key=f"download_{message_key}",
+                )
+
+
+def display_plan_findings(plan):
+    """Explain-based findings from the index advisor, shown under the query analysis"""
+    if not plan:
+        return
+    if plan.get("error"):
+        st.caption(f"Query plan unavailable: {plan['error']}")
+        return
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Scan", "COLLSCAN" if plan.get("collscan") else "Index", delta=None)
+    with col2:
+        st.metric(
+            "Sort", "In memory" if plan.get("blocking_sort") else "Index", delta=None
+        )
+    with col3:
+        if plan.get("docs_examined") is not None:
+            st.metric(
+                "Examined / Returned",
+                f"{plan['docs_examined']} / {plan.get('returned', 0)}",
+                delta=None,
+            )
+        else:
+            st.metric("Indexes", ", ".join(plan.get("indexes_used", [])) or "None", delta=None)
+
+    keys = plan.get("recommended_index")
+    if plan.get("created_index"):
+        st.success(f"Created index `{plan['created_index']}` for this query shape.")
+    elif keys and not plan.get("index_exists"):
+        spec = ", ".join(f'"{field}": {direction}' for field, direction in keys)
+        st.warning(f"No index serves this query. Suggested index: `{{{spec}}}`")
+
+
+def display_compact_query_analysis(query_dict, plan=None):
     with st.container():
         st.markdown("**Query Analysis**")
+        if is_aggregate(query_dict):
+            pipeline = query_dict.get("pipeline", [])
+            col1, col2 = st.columns([1, 3])
+            with col1:
+                st.metric("Pipeline", f"{len(pipeline)} stages", delta=None)
+            with col2:
+                stages = " → ".join(next(iter(stage), "?") for stage in pipeline)
+                st.metric("Stages", stages or "None", delta=None)
+            display_plan_findings(plan)
+            with st.expander("View Query Details", expanded=False):
+                st.json(query_dict)
+            return
+
         col1, col2, col3, col4 = st.columns(4)
 
         with col1:
@@ -217,11 +316,34 @@ def display_compact_query_analysis(query_dict):
             else:
                 st.metric("Paging", "None", delta=None)
 
+        display_plan_findings(plan)
         with st.expander("View Query Details", expanded=False):
             st.json(query_dict)
 
 
-def display_chat_message(role, content, query_dict=None, results=None):
+def display_collapsed_results(content, message_key):
+    """Older results stay a one-line summary until the user expands them"""
+    table = content.get("table")
+    if table is not None:
+        summary = table.summary()
+    else:
+        summary = content.get("summary") or f"{len(content.get('results') or [])} rows"
+    if st.toggle(f"Show results ({summary})", key=f"expand_{message_key}"):
+        if content.get("spilled"):
+            # Spilled to the session's history file; read it back only now
+            store = st.session_state.get("history_store")
+            table = store.load(message_key) if store is not None else None
+            if table is None:
+                st.info("These results are no longer available.")
+                return
+        display_unified_results(
+            content.get("results"), content.get("query_dict"), table, message_key
+        )
+
+
+def display_chat_message(
+    role, content, query_dict=None, results=None, message_key=None, collapsed=False
+):
     if role == "user":
         st.chat_message("user").write(content)
     else:
@@ -231,19 +353,47 @@ def display_chat_message(role, content, query_dict=None, results=None):
                 st.chat_message("assistant").markdown(content["data"])
 
             elif content["type"] == "count":
+                count_filter = (content.get("query_dict") or {}).get("filter")
+                label = "Matching documents" if count_filter else "Total documents"
                 st.chat_message("assistant").markdown(
-                    f"### Total documents: **{content['data']}**"
+                    f"### {label}: **{content['data']}**"
                 )
+                if count_filter:
+                    with st.expander("View Query Details", expanded=False):
+                        st.json(content["query_dict"])
 
             elif content["type"] == "query_results":
                 # Unified display for query results
                 # st.chat_message("assistant").markdown("### Query Results")
-                display_compact_query_analysis(content["query_dict"])
-                display_unified_results(content["results"], content["query_dict"])
+                display_compact_query_analysis(
+                    content["query_dict"], content.get("plan")
+                )
+                if collapsed:
+                    display_collapsed_results(content, message_key)
+                else:
+                    display_unified_results(
+                        content.get("results"),
+                        content["query_dict"],
+                        content.get("table"),
+                        message_key,
+                    )
+                    if message_key is not None:
+                        display_page_controls(content, message_key)
+                        display_export_controls(content, message_key)
 
             elif content["type"] == "all_documents":
                 st.chat_message("assistant").markdown("### 📄 All Documents")
-                display_unified_results(content["results"], content["query_dict"])
+                if collapsed:
+                    display_collapsed_results(content, message_key)
+                else:
+                    display_unified_results(
+                        content.get("results"),
+                        content["query_dict"],
+                        content.get("table"),
+                        message_key,
+                    )
+                    if message_key is not None:
+                        display_export_controls(content, message_key)
 
             elif content["type"] == "error":
                 st.chat_message("assistant").error(f"❌ {content['data']}")
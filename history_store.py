@@ -0,0 +1,202 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from typing import Dict, Any, Optional
+
+from rendering import ResultTable
+
+SESSION_MAX_BYTES = int(float(os.getenv("HISTORY_SESSION_MAX_MB", "16")) * 1024 * 1024)
+GLOBAL_MAX_BYTES = int(float(os.getenv("HISTORY_GLOBAL_MAX_MB", "256")) * 1024 * 1024)
+HISTORY_DIR = os.getenv("HISTORY_DIR") or tempfile.gettempdir()
+
+
+class _GlobalBudget:
+    """Tracks resident result bytes across every session's store"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._stores = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def register(self, store):
+        with self._lock:
+            self._stores.add(store)
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            stores = list(self._stores)
+        return sum(store.resident_bytes for store in stores)
+
+    def enforce(self):
+        # Spill the least recently used results across all sessions until under the cap
+        while self.resident_bytes() > self.max_bytes:
+            with self._lock:
+                stores = list(self._stores)
+            candidates = [
+                (entry["last_access"], store, key)
+                for store in stores
+                for key, entry in store.resident_entries()
+            ]
+            if not candidates:
+                return
+            _, store, key = min(candidates, key=lambda item: item[0])
+            store.spill(key)
+
+
+global_budget = _GlobalBudget(GLOBAL_MAX_BYTES)
+
+
+class HistoryStore:
+    """Per-session store for result tables attached to chat messages.
+
+    Recent results stay in memory; older ones are spilled as compressed
+    Parquet blobs to a per-session SQLite file and reloaded on demand.
+    The newest result is never spilled, so the visible answer is always
+    resident.
+    """
+
+    def __init__(
+        self,
+        session_max_bytes: int = SESSION_MAX_BYTES,
+        budget: _GlobalBudget = global_budget,
+        directory: str = HISTORY_DIR,
+    ):
+        self.session_max_bytes = session_max_bytes
+        self.budget = budget
+        self.path = os.path.join(directory, f"mongoquery-history-{uuid.uuid4().hex}.sqlite")
+        self._conn = None
+        self._entries: Dict[Any, Dict[str, Any]] = {}
+        self._lock = threading.RLock()
+        self.spills = 0
+        self.reloads = 0
+        self._files = [self.path]
+        budget.register(self)
+        weakref.finalize(self, HistoryStore._remove_files, self._files)
+
+    @staticmethod
+    def _remove_files(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def track_file(self, path: str):
+        """Delete a session-owned file (e.g. an export) together with the history"""
+        self._files.append(path)
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, payload BLOB)"
+            )
+        return self._conn
+
+    @property
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(
+                entry["bytes"] for entry in self._entries.values() if entry["resident"]
+            )
+
+    def resident_entries(self):
+        with self._lock:
+            newest = max(self._entries, default=None, key=lambda k: self._entries[k]["added"])
+            return [
+                (key, entry)
+                for key, entry in self._entries.items()
+                if entry["resident"] and key != newest
+            ]
+
+    def put(self, key, content: Dict[str, Any]):
+        """Track a result message; its content dict is updated in place on spill/reload"""
+        table = content.get("table")
+        if table is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._entries[key] = {
+                "content": content,
+                "bytes": table.nbytes,
+                "resident": True,
+                "added": now,
+                "last_access": now,
+            }
+        self._enforce()
+
+    def _enforce(self):
+        while self.resident_bytes > self.session_max_bytes:
+            candidates = self.resident_entries()
+            if not candidates:
+                break
+            key, _ = min(candidates, key=lambda item: item[1]["last_access"])
+            self.spill(key)
+        self.budget.enforce()
+
+    def spill(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or not entry["resident"]:
+                return
+            content = entry["content"]
+            table = content.get("table")
+            if table is not None:
+                self._db().execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?)",
+                    (str(key), table.to_bytes()),
+                )
+                self._db().commit()
+                content["summary"] = table.summary()
+            content["table"] = None
+            content["results"] = None
+            content["spilled"] = True
+            entry["resident"] = False
+            self.spills += 1
+
+    def load(self, key) -> Optional[ResultTable]:
+        """Return the message's table, reading it back from disk if it was spilled"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry["last_access"] = time.time()
+            content = entry["content"]
+            if entry["resident"]:
+                return content.get("table")
+            row = self._db().execute(
+                "SELECT payload FROM results WHERE key = ?", (str(key),)
+            ).fetchone()
+            if row is None:
+                return None
+            table = ResultTable.from_bytes(row[0])
+            content["table"] = table
+            content["spilled"] = False
+            entry["resident"] = True
+            entry["bytes"] = table.nbytes
+            self.reloads += 1
+        self._enforce()
+        return table
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            spilled = sum(1 for entry in self._entries.values() if not entry["resident"])
+        return {
+            "results": len(self._entries),
+            "spilled": spilled,
+            "resident_bytes": self.resident_bytes,
+            "spills": self.spills,
+            "reloads": self.reloads,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._entries.clear()
+        self._remove_files(self._files)
@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
+
+from metrics import query_shape
+
+RANGE_OPERATORS = {"$gt", "$gte", "$lt", "$lte", "$ne", "$nin", "$regex", "$exists"}
+EQUALITY_OPERATORS = {"$eq", "$in"}
+
+
+def _explain_command(collection, query_dict: Dict[str, Any]) -> Dict[str, Any]:
+    if query_dict.get("pipeline"):
+        return {
+            "aggregate": collection.name,
+            "pipeline": query_dict["pipeline"],
+            "cursor": {},
+        }
+    command = {"find": collection.name, "filter": query_dict.get("filter", {})}
+    if query_dict.get("projection"):
+        command["projection"] = query_dict["projection"]
+    if query_dict.get("sort"):
+        command["sort"] = query_dict["sort"]
+    if query_dict.get("skip", 0) > 0:
+        command["skip"] = query_dict["skip"]
+    command["limit"] = query_dict.get("limit") or 100
+    return command
+
+
+def explain_query(collection, query_dict: Dict[str, Any], verbosity: str = "queryPlanner"):
+    return collection.database.command(
+        "explain", _explain_command(collection, query_dict), verbosity=verbosity
+    )
+
+
+def _planner_section(explain: Dict[str, Any]) -> Dict[str, Any]:
+    if "queryPlanner" in explain:
+        return explain
+    # Aggregations nest the find-layer plan under the first $cursor stage
+    for stage in explain.get("stages", []):
+        if "$cursor" in stage:
+            return stage["$cursor"]
+    return explain
+
+
+def _walk_plan(plan: Optional[Dict[str, Any]]):
+    while plan:
+        yield plan
+        children = plan.get("inputStages") or []
+        for child in children[1:]:
+            yield from _walk_plan(child)
+        plan = plan.get("inputStage") or (children[0] if children else None)
+
+
+def analyze_plan(explain: Dict[str, Any]) -> Dict[str, Any]:
+    """Summarize a winning plan: collection scans, blocking sorts, indexes used"""
+    section = _planner_section(explain)
+    planner = section.get("queryPlanner", {})
+    winning = planner.get("winningPlan", {})
+    winning = winning.get("queryPlan", winning)
+
+    stages = [stage.get("stage") for stage in _walk_plan(winning)]
+    indexes = [
+        stage.get("indexName") for stage in _walk_plan(winning) if stage.get("indexName")
+    ]
+    findings = {
+        "stages": stages,
+        "collscan": "COLLSCAN" in stages,
+        "blocking_sort": "SORT" in stages,
+        "indexes_used": indexes,
+    }
+    stats = section.get("executionStats")
+    if stats:
+        findings["docs_examined"] = stats.get("totalDocsExamined")
+        findings["keys_examined"] = stats.get("totalKeysExamined")
+        findings["returned"] = stats.get("nReturned")
+        findings["execution_ms"] = stats.get("executionTimeMillis")
+    return findings
+
+
+def _leading_stages(query_dict: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Filter and sort that can use an index; for pipelines only the leading $match/$sort"""
+    if not query_dict.get("pipeline"):
+        return query_dict.get("filter") or {}, query_dict.get("sort") or {}
+    match, sort = {}, {}
+    for stage in query_dict["pipeline"]:
+        if "$match" in stage and not sort:
+            match.update(stage["$match"])
+        elif "$sort" in stage and not sort:
+            sort = stage["$sort"]
+        else:
+            break
+    return match, sort
+
+
+def recommend_index(query_dict: Dict[str, Any]) -> List[Tuple[str, int]]:
+    """Compound index following the Equality, Sort, Range rule"""
+    filter_dict, sort = _leading_stages(query_dict)
+    equality, ranges = [], []
+    for field, condition in filter_dict.items():
+        if field.startswith("$"):
+            # $and/$or branches are too varied to serve with a single index
+            continue
+        if isinstance(condition, dict) and condition and all(
+            op.startswith("$") for op in condition
+        ):
+            if set(condition) & RANGE_OPERATORS:
+                ranges.append(field)
+            elif set(condition) <= EQUALITY_OPERATORS:
+                equality.append(field)
+        else:
+            equality.append(field)
+
+    keys = [(field, 1) for field in equality]
+    for field, direction in sort.items():
+        if field not in equality:
+            keys.append((field, -1 if direction in (-1, "desc", "descending") else 1))
+    keys += [(field, 1) for field in ranges if field not in dict(keys)]
+    return keys
+
+
+def index_covers(index_information: Dict[str, Any], keys: List[Tuple[str, int]]) -> bool:
+    fields = [field for field, _ in keys]
+    for index in index_information.values():
+        existing = [field for field, _ in index.get("key", [])]
+        if existing[: len(fields)] == fields:
+            return True
+    return False
+
+
+class IndexAdvisor:
+    """Explains generated queries and aggregates recurring shapes into index recommendations.
+
+    Explain results are cached per (collection, query shape) so repeated
+    questions don't pay for another explain round trip.
+    """
+
+    def __init__(
+        self,
+        verbosity: str = "queryPlanner",
+        cache_seconds: float = 300,
+        auto_create_after: int = 0,
+    ):
+        self.verbosity = verbosity
+        self.cache_seconds = cache_seconds
+        # 0 disables index creation; otherwise create once a shape has been seen this often
+        self.auto_create_after = auto_create_after
+        self.shape_counts: Counter = Counter()
+        self.shape_findings: Dict[tuple, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def analyze(self, collection, query_dict: Dict[str, Any]) -> Dict[str, Any]:
+        shape = query_shape(query_dict)
+        key = (collection.full_name, shape)
+        with self._lock:
+            self.shape_counts[key] += 1
+            cached = self.shape_findings.get(key)
+        if cached and time.time() - cached["analyzed_at"] <= self.cache_seconds:
+            findings = cached
+        else:
+            try:
+                findings = analyze_plan(explain_query(collection, query_dict, self.verbosity))
+            except Exception as e:
+                return {"error": str(e)}
+            keys = recommend_index(query_dict)
+            needs_index = findings["collscan"] or findings["blocking_sort"]
+            findings["recommended_index"] = keys if keys and needs_index else []
+            if findings["recommended_index"]:
+                findings["index_exists"] = index_covers(
+                    collection.index_information(), keys
+                )
+            findings["analyzed_at"] = time.time()
+            with self._lock:
+                self.shape_findings[key] = findings
+
+        if (
+            self.auto_create_after
+            and findings.get("recommended_index")
+            and not findings.get("index_exists")
+            and self.shape_counts[key] >= self.auto_create_after
+        ):
+            findings["created_index"] = self.create_index(
+                collection, findings["recommended_index"]
+            )
+            findings["index_exists"] = True
+        return findings
+
+    def create_index(self, collection, keys: List[Tuple[str, int]]) -> str:
+        # Builds only lock briefly since MongoDB 4.2; the old background option is rejected now
+        return collection.create_index(keys)
+
+    def recurring(self, collection=None, top: int = 10) -> List[Dict[str, Any]]:
+        """Most frequent query shapes that still lack a serving index"""
+        report = []
+        with self._lock:
+            items = self.shape_counts.most_common()
+        for (namespace, shape), count in items:
+            if collection is not None and namespace != collection.full_name:
+                continue
+            findings = self.shape_findings.get((namespace, shape), {})
+            if findings.get("recommended_index") and not findings.get("index_exists"):
+                report.append(
+                    {
+                        "namespace": namespace,
+                        "shape": shape,
+                        "count": count,
+                        "recommended_index": findings["recommended_index"],
+                    }
+                )
+            if len(report) >= top:
+                break
+        return report
+
+
+def advisor_from_env() -> IndexAdvisor:
+    return IndexAdvisor(
+        verbosity=os.getenv("INDEX_ADVISOR_VERBOSITY", "queryPlanner"),
+        auto_create_after=int(os.getenv("INDEX_ADVISOR_AUTO_CREATE_AFTER", "0")),
+    )
@@ -0,0 +1,445 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from metrics import registry, llm_token_usage
+from prompt_builder import estimate_tokens
+from stream_parse import JSONObjectScanner
+
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.3-70b-versatile")
+# Completion tokens reserved from a token bucket before the answer's real size is known
+EXPECTED_COMPLETION_TOKENS = 150
+
+# Hedged and fallback attempts run here, not on the app's worker pool that waits on them
+_attempts = ThreadPoolExecutor(
+    max_workers=int(os.getenv("LLM_ROUTER_WORKERS", "16")), thread_name_prefix="llm"
+)
+
+
+class LLMUnavailable(Exception):
+    """No backend produced a usable query; the message lists why each one failed"""
+
+
+class InvalidJSON(ValueError):
+    """The model's answer did not contain a JSON object, even after a correction"""
+
+
+class TokenBucket:
+    """Refills `capacity` units per minute; a capacity of 0 means unlimited"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 if they are now)"""
+        if not self.capacity:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            amount = min(amount, self.capacity)
+            missing = amount - self.tokens
+            return 0.0 if missing <= 0 else missing * 60 / self.capacity
+
+    def take(self, amount: float):
+        if not self.capacity:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= min(amount, self.capacity)
+
+    def drain(self):
+        with self._lock:
+            self.tokens = min(self.tokens, 0)
+            self.updated = time.monotonic()
+
+
+def stream_completion(llm, messages, on_key=None, stop: Optional[threading.Event] = None):
+    """Stream the model's answer and stop reading once the top-level JSON object closes.
+
+    on_key(key, value, completed) is called from this thread as each top-level
+    key of the object finishes, e.g. to prefetch while "sort" is still arriving.
+    Setting `stop` abandons the stream at the next chunk (a hedge won).
+    Returns the full text read, the aggregated message and the scanner.
+    """
+    scanner = JSONObjectScanner()
+    text, message = "", None
+    stream = llm.stream(messages)
+    try:
+        for chunk in stream:
+            message = chunk if message is None else message + chunk
+            content = chunk.content if isinstance(chunk.content, str) else ""
+            text += content
+            for key, value in scanner.feed(content):
+                if on_key is not None:
+                    try:
+                        on_key(key, value, dict(scanner.completed))
+                    except Exception:
+                        pass  # prefetching is best effort
+            if scanner.closed or (stop is not None and stop.is_set()):
+                break
+    finally:
+        # Closing the generator drops the HTTP stream, so trailing prose isn't generated
+        stream.close()
+    return text, message, scanner
+
+
+def parse_query(text: str, scanner: JSONObjectScanner) -> Dict[str, Any]:
+    if scanner.closed:
+        query_dict = scanner.result()
+    else:
+        # Extract the JSON if it's wrapped in markdown or other text
+        match = re.search(r"\{.*\}", text, re.DOTALL)
+        query_dict = json.loads(match.group() if match else text)
+    if not isinstance(query_dict, dict):
+        raise ValueError("the answer is not a JSON object")
+    return query_dict
+
+
+def _retry_after(error) -> Optional[float]:
+    """Seconds a provider asked us to back off for, if the error is a rate limit"""
+    status = getattr(error, "status_code", None) or getattr(
+        getattr(error, "response", None), "status_code", None
+    )
+    if status != 429 and "RateLimit" not in type(error).__name__:
+        return None
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class Backend:
+    """One configured model with its own rate limits, cooldown and latency window"""
+
+    def __init__(
+        self,
+        name: str,
+        llm,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        window: int = 100,
+    ):
+        self.name = name
+        self.llm = llm
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.cooldown_until = 0.0
+        self.consecutive_failures = 0
+        self.latencies = deque(maxlen=window)
+        self.counts = {
+            "calls": 0,
+            "ok": 0,
+            "errors": 0,
+            "rate_limited": 0,
+            "throttled": 0,
+            "invalid_json": 0,
+            "json_retries": 0,
+            "hedges": 0,
+            "cancelled": 0,
+        }
+        self._lock = threading.Lock()
+
+    @property
+    def model_name(self) -> Optional[str]:
+        return getattr(self.llm, "model_name", None) or getattr(self.llm, "model", None)
+
+    def wait_time(self, tokens: int) -> float:
+        cooling = self.cooldown_until - time.monotonic()
+        return max(cooling, self.requests.wait_time(1), self.tokens.wait_time(tokens), 0.0)
+
+    def count(self, result: str, seconds: Optional[float] = None):
+        with self._lock:
+            self.counts[result] += 1
+            if seconds is not None:
+                self.latencies.append(seconds)
+        registry.inc("mongoquery_llm_backend_total", backend=self.name, result=result)
+        if seconds is not None:
+            registry.observe("mongoquery_llm_backend_seconds", seconds, backend=self.name)
+
+    def latency(self, pct: float) -> Optional[float]:
+        with self._lock:
+            ordered = sorted(self.latencies)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        failed = counts["errors"] + counts["invalid_json"] + counts["rate_limited"]
+        finished = counts["ok"] + failed
+        p50, p95 = self.latency(50), self.latency(95)
+        return {
+            **counts,
+            "model": self.model_name,
+            "error_rate": failed / finished if finished else 0.0,
+            "p50_ms": None if p50 is None else p50 * 1000,
+            "p95_ms": None if p95 is None else p95 * 1000,
+            "cooling_down": self.cooldown_until > time.monotonic(),
+        }
+
+
+class LLMRouter:
+    """Sends each translation to the healthiest backend that has rate-limit headroom.
+
+    A request still running after the backend's recent p95 latency (or a fixed
+    hedge delay) is hedged on the next backend; the first valid JSON answer
+    wins and the other streams are abandoned. Failed backends fall through to
+    the next one, rate limits put a backend into cooldown, and an answer that
+    is not JSON is retried once with a correction before moving on.
+    """
+
+    def __init__(
+        self,
+        backends: List[Backend],
+        hedge_after_seconds: float = 0,
+        hedge_floor_seconds: float = 1.0,
+        max_in_flight: int = 2,
+        json_retries: int = 1,
+        max_wait_seconds: float = 5.0,
+        cooldown_seconds: float = 30.0,
+        failures_before_cooldown: int = 3,
+    ):
+        if not backends:
+            raise ValueError("At least one LLM backend is required")
+        self.backends = backends
+        self.hedge_after_seconds = hedge_after_seconds
+        self.hedge_floor_seconds = hedge_floor_seconds
+        self.max_in_flight = max(1, max_in_flight)
+        self.json_retries = json_retries
+        self.max_wait_seconds = max_wait_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.failures_before_cooldown = failures_before_cooldown
+
+    @property
+    def model_name(self) -> Optional[str]:
+        return self.backends[0].model_name
+
+    def _hedge_delay(self, backend: Backend) -> float:
+        if self.hedge_after_seconds:
+            return self.hedge_after_seconds
+        # Adaptive: only the slowest ~5% of requests get a second copy
+        if len(backend.latencies) < 10:
+            return max(self.hedge_floor_seconds, 3 * (backend.latency(50) or 1.0))
+        return max(self.hedge_floor_seconds, backend.latency(95))
+
+    def _next_backend(self, tried, tokens: int, wait_for_capacity: bool) -> Optional[Backend]:
+        """The first untried backend (in configured order) with headroom right now"""
+        candidates = [b for b in self.backends if b not in tried]
+        if not candidates:
+            return None
+        waits = [(b.wait_time(tokens), index, b) for index, b in enumerate(candidates)]
+        for delay, _, backend in waits:
+            if delay == 0:
+                return backend
+            backend.count("throttled")
+        if not wait_for_capacity:
+            return None
+        # Everything is throttled: wait for the soonest bucket if it's worth it
+        delay, _, backend = min(waits, key=lambda item: (item[0], item[1]))
+        if delay > self.max_wait_seconds:
+            return None
+        time.sleep(delay)
+        return backend
+
+    def _failed(self, backend: Backend, error: Exception):
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            backend.count("rate_limited")
+            backend.requests.drain()
+            backend.cooldown_until = time.monotonic() + (retry_after or self.cooldown_seconds)
+            return
+        backend.count("invalid_json" if isinstance(error, InvalidJSON) else "errors")
+        with backend._lock:
+            backend.consecutive_failures += 1
+            failing = backend.consecutive_failures >= self.failures_before_cooldown
+        if failing:
+            backend.cooldown_until = time.monotonic() + self.cooldown_seconds
+
+    def _attempt(self, backend: Backend, messages, on_key, stop: threading.Event):
+        """One backend's answer, with up to json_retries corrections; runs on _attempts"""
+        from langchain_core.messages import AIMessage, HumanMessage
+
+        started = time.perf_counter()
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        try:
+            for retry in range(self.json_retries + 1):
+                text, message, scanner = stream_completion(backend.llm, messages, on_key, stop)
+                used = llm_token_usage(message)
+                # Providers report usage in the final chunk, which an early stop never reads
+                if not used["completion_tokens"]:
+                    used["completion_tokens"] = estimate_tokens(text)
+                used["total_tokens"] = used["prompt_tokens"] + used["completion_tokens"]
+                for key in usage:
+                    usage[key] += used[key]
+                if stop.is_set():
+                    backend.count("cancelled")
+                    return None
+                try:
+                    query_dict = parse_query(text, scanner)
+                    break
+                except ValueError as e:
+                    if retry == self.json_retries:
+                        raise InvalidJSON(f"{backend.name} did not return JSON: {e}")
+                    backend.count("json_retries")
+                    messages = list(messages) + [
+                        AIMessage(content=text),
+                        HumanMessage(
+                            content=f"That was not valid JSON ({e}). "
+                            "Reply with only the JSON object, no other text."
+                        ),
+                    ]
+        except Exception as e:
+            self._failed(backend, e)
+            raise
+        seconds = time.perf_counter() - started
+        backend.count("ok", seconds)
+        with backend._lock:
+            backend.consecutive_failures = 0
+        return query_dict, usage, backend.name, seconds
+
+    def _launch(self, backend: Backend, messages, on_key, stop, tokens: int):
+        backend.requests.take(1)
+        backend.tokens.take(tokens)
+        backend.count("calls")
+        return _attempts.submit(self._attempt, backend, messages, on_key, stop)
+
+    def complete(self, messages, on_key=None) -> Tuple[Dict[str, Any], Dict[str, int], str]:
+        """Return (query_dict, token usage, backend name) or raise LLMUnavailable"""
+        tokens = sum(estimate_tokens(str(m.content)) for m in messages)
+        tokens += EXPECTED_COMPLETION_TOKENS
+        stop = threading.Event()
+        tried, errors, in_flight = [], [], {}
+        hedging = True
+        try:
+            while True:
+                if not in_flight:
+                    backend = self._next_backend(tried, tokens, wait_for_capacity=True)
+                    if backend is None:
+                        break
+                    tried.append(backend)
+                    in_flight[self._launch(backend, messages, on_key, stop, tokens)] = backend
+
+                oldest = next(iter(in_flight.values()))
+                can_hedge = (
+                    hedging
+                    and len(in_flight) < self.max_in_flight
+                    and len(tried) < len(self.backends)
+                )
+                done, _ = wait(
+                    in_flight,
+                    timeout=self._hedge_delay(oldest) if can_hedge else None,
+                    return_when=FIRST_COMPLETED,
+                )
+                if not done:
+                    # Slow, not failed: race a copy on the next backend with headroom
+                    backend = self._next_backend(tried, tokens, wait_for_capacity=False)
+                    if backend is None:
+                        hedging = False
+                        continue
+                    tried.append(backend)
+                    backend.count("hedges")
+                    in_flight[self._launch(backend, messages, on_key, stop, tokens)] = backend
+                for future in done:
+                    backend = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        errors.append(f"{backend.name}: {e}")
+                        continue
+                    if result is not None:
+                        query_dict, usage, name, _ = result
+                        return query_dict, usage, name
+        finally:
+            # Losing or abandoned streams stop at their next chunk
+            stop.set()
+
+        throttled = [b.name for b in self.backends if b not in tried]
+        if throttled:
+            errors.append(f"rate limited: {', '.join(throttled)}")
+        raise LLMUnavailable("No LLM backend produced a query (" + "; ".join(errors) + ")")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {backend.name: backend.stats() for backend in self.backends}
+
+
+def make_llm(provider: str, model: str, api_key: Optional[str] = None, **options):
+    """A streaming chat model; provider packages are only imported when used"""
+    if provider == "groq":
+        from langchain_groq import ChatGroq
+
+        return ChatGroq(
+            groq_api_key=api_key or os.environ["GROQ_KEY"], model_name=model, streaming=True
+        )
+    if provider == "openai":
+        # Also covers OpenAI-compatible servers (vLLM, Ollama, ...) via OPENAI_BASE_URL
+        try:
+            from langchain_openai import ChatOpenAI
+        except ImportError:
+            raise ValueError("The openai backend needs the langchain-openai package")
+        return ChatOpenAI(
+            model=model,
+            api_key=os.getenv("OPENAI_API_KEY", "unused"),
+            base_url=os.getenv("OPENAI_BASE_URL") or None,
+            streaming=True,
+        )
+    if provider == "local":
+        from local_llm import LocalChatModel
+
+        answers = {}
+        if os.getenv("LLM_LOCAL_ANSWERS"):
+            with open(os.environ["LLM_LOCAL_ANSWERS"]) as f:
+                answers = json.load(f)
+        return LocalChatModel(
+            answers=answers,
+            latency_ms=float(options.get("latency_ms", 0)),
+            failure_rate=float(options.get("failure_rate", 0)),
+            invalid_json_rate=float(options.get("invalid_json_rate", 0)),
+            seed=int(options.get("seed", random.randrange(2**31))),
+        )
+    raise ValueError(f"Unknown LLM provider '{provider}'")
+
+
+def parse_backends(spec: str, api_key: Optional[str] = None) -> List[Backend]:
+    """Backends from e.g. "groq:llama-3.3-70b-versatile?rpm=30&tpm=12000,local?latency_ms=50" """
+    backends = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        target, _, query = entry.partition("?")
+        options = dict(parse_qsl(query))
+        provider, _, model = target.partition(":")
+        llm = make_llm(provider, model or LLM_MODEL, api_key, **options)
+        backends.append(
+            Backend(
+                options.get("name", target),
+                llm,
+                requests_per_minute=float(options.get("rpm", 0)),
+                tokens_per_minute=float(options.get("tpm", 0)),
+            )
+        )
+    return backends
+
+
+def router_from_env(api_key: Optional[str] = None) -> LLMRouter:
+    return LLMRouter(
+        parse_backends(os.getenv("LLM_BACKENDS") or f"groq:{LLM_MODEL}", api_key),
+        hedge_after_seconds=float(os.getenv("LLM_HEDGE_AFTER_MS", "0")) / 1000,
+        max_in_flight=int(os.getenv("LLM_MAX_IN_FLIGHT", "2")),
+        json_retries=int(os.getenv("LLM_JSON_RETRIES", "1")),
+        max_wait_seconds=float(os.getenv("LLM_MAX_WAIT_SECONDS", "5")),
+        cooldown_seconds=float(os.getenv("LLM_COOLDOWN_SECONDS", "30")),
+    )
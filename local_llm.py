@@ -0,0 +1,74 @@
+import json
+import random
+import time
+from typing import Dict, Any, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.pydantic_v1 import PrivateAttr
+
+
+class LocalChatModel(BaseChatModel):
+    """Offline stand-in for a hosted model: canned answers, simulated latency and faults.
+
+    Answers are looked up by the lower-cased question (the first human
+    message); unknown questions get `default_answer`. failure_rate and
+    invalid_json_rate make it behave like a degraded provider, which is how
+    the router's fallback, hedging and JSON retries are exercised offline.
+    """
+
+    answers: Dict[str, Any] = {}
+    default_answer: Dict[str, Any] = {"filter": {}, "limit": 20}
+    latency_ms: float = 0.0
+    failure_rate: float = 0.0
+    invalid_json_rate: float = 0.0
+    # Chatty models keep explaining after the JSON; streaming stops before this
+    trailer: str = ""
+    chunk_chars: int = 8
+    seed: Optional[int] = None
+    model_name: str = "local"
+
+    _random: Any = PrivateAttr(default=None)
+
+    @property
+    def _llm_type(self) -> str:
+        return "local"
+
+    def _roll(self) -> float:
+        if self._random is None:
+            self._random = random.Random(self.seed)
+        return self._random.random()
+
+    def _answer(self, messages) -> str:
+        question = next((m for m in messages if m.type == "human"), messages[-1])
+        if self.failure_rate and self._roll() < self.failure_rate:
+            raise RuntimeError("local model failure (simulated)")
+        # Corrections after a bad answer ("That was not valid JSON ...") are always answered
+        if self.invalid_json_rate and messages[-1] is question and self._roll() < self.invalid_json_rate:
+            return "Sure! Here is the query you asked for."
+        answer = self.answers.get(str(question.content).strip().lower(), self.default_answer)
+        return json.dumps(answer) + self.trailer
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        content = self._answer(messages)
+        message = AIMessage(
+            content=content,
+            response_metadata={
+                "token_usage": {
+                    "prompt_tokens": sum(len(str(m.content)) for m in messages) // 4,
+                    "completion_tokens": len(content) // 4,
+                }
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self._answer(messages)
+        pieces = [text[i : i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)]
+        for piece in pieces:
+            if self.latency_ms:
+                time.sleep(self.latency_ms / 1000 / len(pieces))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
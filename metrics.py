@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Optional
+
+# Seconds; spans from sub-millisecond cache hits up to slow LLM calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000)
+
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH")
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.total += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    """In-process histograms and counters, rendered in Prometheus text format"""
+
+    def __init__(self, trace_path: Optional[str] = None):
+        self._lock = threading.Lock()
+        self._histograms: Dict[tuple, Histogram] = {}
+        self._counters: Dict[tuple, float] = {}
+        self._trace_path = trace_path
+        self._trace_lock = threading.Lock()
+
+    def observe(self, name: str, value: float, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def record(self, stage: str, seconds: float, error: bool = False, **attrs):
+        """Record one finished span: latency, payload size and LLM token usage"""
+        self.observe("mongoquery_stage_seconds", seconds, stage=stage)
+        if error:
+            self.inc("mongoquery_stage_errors_total", stage=stage)
+        if attrs.get("docs") is not None:
+            self.observe("mongoquery_stage_documents", attrs["docs"], SIZE_BUCKETS, stage=stage)
+        if attrs.get("bytes"):
+            self.inc("mongoquery_stage_bytes_total", attrs["bytes"], stage=stage)
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if attrs.get(kind):
+                self.inc("mongoquery_llm_tokens_total", attrs[kind], kind=kind)
+        if self._trace_path:
+            self._trace(stage, seconds, error, attrs)
+
+    def _trace(self, stage, seconds, error, attrs):
+        event = {
+            "ts": time.time(),
+            "stage": stage,
+            "seconds": round(seconds, 6),
+            "error": error,
+            **attrs,
+        }
+        line = json.dumps(event, default=str)
+        with self._trace_lock:
+            with open(self._trace_path, "a") as f:
+                f.write(line + "\n")
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        seen = set()
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                lines.append(f"# TYPE {name} histogram")
+                seen.add(name)
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f"{name}_bucket{_labels(labels, le=bound)} {count}")
+            lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {histogram.total}')
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.total}")
+
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+def _labels(labels, **extra) -> str:
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+registry = MetricsRegistry(trace_path=TRACE_LOG_PATH)
+
+
+class Span:
+    def __init__(self, stage: str, attrs: Dict[str, Any]):
+        self.stage = stage
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+@contextmanager
+def span(stage: str, **attrs):
+    """Time a pipeline stage; attributes can be added while it runs via span.set()"""
+    current = Span(stage, attrs)
+    start = time.perf_counter()
+    error = False
+    try:
+        yield current
+    except BaseException:
+        error = True
+        raise
+    finally:
+        registry.record(stage, time.perf_counter() - start, error=error, **current.attrs)
+
+
+def query_shape(query_dict: Optional[Dict[str, Any]]):
+    """The query with literal values replaced, so recurring shapes group together"""
+
+    def strip(value):
+        if isinstance(value, dict):
+            return {k: strip(v) for k, v in sorted(value.items())}
+        if isinstance(value, list):
+            return [strip(v) for v in value[:1]] if value and isinstance(value[0], dict) else "?"
+        return "?"
+
+    if not query_dict:
+        return None
+    shape = {}
+    for key in ("operation", "filter", "sort", "projection", "pipeline"):
+        if query_dict.get(key):
+            if key in ("sort", "projection"):
+                shape[key] = sorted(query_dict[key])
+            elif key == "pipeline":
+                shape[key] = [strip(stage) for stage in query_dict[key]]
+            else:
+                shape[key] = strip(query_dict[key])
+    return json.dumps(shape, sort_keys=True)
+
+
+def llm_token_usage(message) -> Dict[str, int]:
+    """Prompt/completion token counts from a LangChain AI message, when the provider reports them"""
+    usage = getattr(message, "usage_metadata", None) or {}
+    if usage:
+        return {
+            "prompt_tokens": usage.get("input_tokens", 0),
+            "completion_tokens": usage.get("output_tokens", 0),
+        }
+    metadata = getattr(message, "response_metadata", None) or {}
+    usage = metadata.get("token_usage") or metadata.get("usage") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+    }
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0"):
+    """Serve /metrics from a daemon thread next to the Streamlit server"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,151 @@
+import atexit
+import os
+import threading
+from typing import Dict, Any
+
+from pymongo import MongoClient, monitoring
+
+from metrics import registry
+
+MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Tracks open/checked-out connections and checkout wait time for one client"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open = max(self.open - 1, 0)
+
+    def connection_checked_out(self, event):
+        # pymongo reports how long the checkout waited, including connection setup
+        wait = getattr(event, "duration", None) or 0.0
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+        registry.observe("mongoquery_pool_checkout_seconds", wait)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out = max(self.checked_out - 1, 0)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+        registry.inc("mongoquery_pool_checkout_failures_total")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "avg_wait_ms": 1000 * self.wait_seconds_total / self.checkouts
+                if self.checkouts
+                else 0.0,
+                "max_wait_ms": 1000 * self.wait_seconds_max,
+            }
+
+
+class ClientRegistry:
+    """One MongoClient (and so one connection pool) per URI for the whole process.
+
+    Database and collection handles are cheap views over the shared client,
+    so switching db/collection never opens another pool. Idle connections are
+    reaped by the driver after maxIdleTimeMS.
+    """
+
+    def __init__(
+        self,
+        max_pool_size: int = MAX_POOL_SIZE,
+        min_pool_size: int = MIN_POOL_SIZE,
+        max_idle_time_ms: int = MAX_IDLE_TIME_MS,
+        wait_queue_timeout_ms: int = WAIT_QUEUE_TIMEOUT_MS,
+    ):
+        self.options = {
+            "maxPoolSize": max_pool_size,
+            "minPoolSize": min_pool_size,
+            "maxIdleTimeMS": max_idle_time_ms,
+            "waitQueueTimeoutMS": wait_queue_timeout_ms,
+            "serverSelectionTimeoutMS": 5000,
+        }
+        self._clients: Dict[str, MongoClient] = {}
+        self._listeners: Dict[str, PoolStatsListener] = {}
+        self._lock = threading.Lock()
+
+    def client(self, uri: str) -> MongoClient:
+        with self._lock:
+            client = self._clients.get(uri)
+            if client is None:
+                listener = PoolStatsListener()
+                client = MongoClient(uri, event_listeners=[listener], **self.options)
+                self._clients[uri] = client
+                self._listeners[uri] = listener
+            return client
+
+    def collection(self, uri: str, db_name: str, collection_name: str):
+        return self.client(uri)[db_name][collection_name]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            listeners = list(self._listeners.items())
+        report = {}
+        for index, (uri, listener) in enumerate(listeners):
+            snapshot = listener.snapshot()
+            snapshot["max_pool_size"] = self.options["maxPoolSize"]
+            snapshot["utilization"] = (
+                snapshot["checked_out"] / self.options["maxPoolSize"]
+                if self.options["maxPoolSize"]
+                else 0.0
+            )
+            # Never surface credentials embedded in the connection string
+            report[f"client-{index}"] = snapshot
+        return report
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+            self._listeners.clear()
+
+
+clients = ClientRegistry()
+atexit.register(clients.close)
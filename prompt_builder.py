@@ -0,0 +1,387 @@
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Tuple
+
+from query_cache import normalize_question
+
+RULES = """You are an expert MongoDB query generator.
+Return ONLY one valid JSON object in one of these formats:
+- find: {"filter": {...}, "projection": {...}, "sort": {...}, "limit": n, "skip": n}
+- count: {"operation": "count", "filter": {...}}
+- aggregate: {"operation": "aggregate", "pipeline": [{"$match": {...}}, {"$group": {...}}, ...]}
+
+Rules:
+- Use ONLY the field paths listed under Fields; never invent field names
+- Include sort, limit and skip only when the question asks for them; {} means no filter / all fields
+- Sort direction is 1 for ascending, -1 for descending
+- Use "count" when only the number of matching documents is wanted ("how many", "count")
+- Use "aggregate" for computed values (average, sum, min, max, per-group totals)
+- Pipelines may use $match, $group, $unwind, $project, $sort, $limit and $count; put $match first
+- $unwind arrays such as "courses_completed" before grouping on their sub-fields"""
+
+MULTI_COLLECTION_RULES = """Collections:
+- Queries run on the {default} collection unless you add "collection": "<name>" to the JSON
+- To combine collections use an aggregate with {{"$lookup": {{"from": "<name>", "localField": ..., "foreignField": ..., "as": ...}}}} so the join runs inside MongoDB"""
+
+REFINE_RULES = """You are an expert MongoDB query generator refining the previous query.
+Previous question: {question}
+Previous query: {query}
+
+If the new message narrows, re-sorts or trims that result, return ONLY the change:
+{{"operation": "refine", "filter": {{...added conditions...}}, "sort": {{...}}, "limit": n, "projection": {{...}}, "count": true}}
+- Include only the keys that change; "filter" holds just the new conditions
+- Filter and sort on these fields of the previous result: {fields}
+- Use "count": true when the message asks how many
+If it is a different question, return a complete query instead:
+- find: {{"filter": {{...}}, "projection": {{...}}, "sort": {{...}}, "limit": n, "skip": n}}
+- count: {{"operation": "count", "filter": {{...}}}}
+- aggregate: {{"operation": "aggregate", "pipeline": [...]}}"""
+
+# Seed examples for the student collection, used until real queries are recorded
+SEED_EXAMPLES = [
+    ("find students with GPA above 3.5", {"filter": {"gpa": {"$gt": 3.5}}}),
+    ("get top 5 students by GPA", {"filter": {}, "sort": {"gpa": -1}, "limit": 5}),
+    (
+        "show me names and student ids of computer science students",
+        {"filter": {"major": "Computer Science"}, "projection": {"name": 1, "student_id": 1}},
+    ),
+    (
+        "find students who failed any course (GPA < 2.0) and sort by name",
+        {"filter": {"gpa": {"$lt": 2.0}}, "sort": {"name": 1}},
+    ),
+    ("get second page of 10 students, skip first 10", {"filter": {}, "skip": 10, "limit": 10}),
+    (
+        "average GPA per major",
+        {
+            "operation": "aggregate",
+            "pipeline": [
+                {"$group": {"_id": "$major", "avg_gpa": {"$avg": "$gpa"}}},
+                {"$sort": {"avg_gpa": -1}},
+            ],
+        },
+    ),
+    (
+        "how many students took CSE 401",
+        {"operation": "count", "filter": {"courses_completed.course_id": "CSE 401"}},
+    ),
+    ("how many documents are there", {"operation": "count", "filter": {}}),
+    (
+        "number of A grades per course",
+        {
+            "operation": "aggregate",
+            "pipeline": [
+                {"$unwind": "$courses_completed"},
+                {"$match": {"courses_completed.grade": "A"}},
+                {"$group": {"_id": "$courses_completed.course_name", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}},
+            ],
+        },
+    ),
+]
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English and JSON; close enough for budgeting
+    return len(text) // 4 + 1
+
+
+def _words(text: str) -> set:
+    return {_stem(w) for w in _WORD_RE.findall(str(text).lower())}
+
+
+def _stem(word: str) -> str:
+    return word[:-1] if len(word) > 3 and word.endswith("s") else word
+
+
+def _trigrams(word: str) -> set:
+    padded = f" {word} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def _word_similarity(a: str, b: str) -> float:
+    if a == b:
+        return 1.0
+    if len(a) >= 4 and len(b) >= 4 and (a.startswith(b) or b.startswith(a)):
+        return 0.8
+    ta, tb = _trigrams(a), _trigrams(b)
+    return len(ta & tb) / len(ta | tb)
+
+
+# Stages after which documents carry fields the profile can't know about
+RESHAPING_STAGES = {
+    "$group", "$project", "$replaceRoot", "$replaceWith", "$count", "$addFields",
+    "$set", "$unset", "$bucket", "$bucketAuto", "$facet", "$sortByCount",
+}
+
+
+def referenced_paths(query_dict: Dict[str, Any]) -> set:
+    """Document field paths a generated query reads"""
+    paths = set()
+
+    def keys(condition):
+        if isinstance(condition, dict):
+            for key, value in condition.items():
+                if key.startswith("$"):
+                    keys(value)
+                else:
+                    paths.add(key)
+        elif isinstance(condition, list):
+            for item in condition:
+                keys(item)
+
+    def refs(value):
+        if isinstance(value, str) and value.startswith("$") and not value.startswith("$$"):
+            paths.add(value[1:])
+        elif isinstance(value, dict):
+            for item in value.values():
+                refs(item)
+        elif isinstance(value, list):
+            for item in value:
+                refs(item)
+
+    for section in ("filter", "projection", "sort"):
+        keys(query_dict.get(section) or {})
+    reshaped = False
+    joined = set()
+    for stage in query_dict.get("pipeline") or []:
+        if not isinstance(stage, dict):
+            continue
+        for name, body in stage.items():
+            if name == "$lookup" and isinstance(body, dict):
+                # Only localField belongs to this collection; "as" names joined documents
+                if not reshaped and isinstance(body.get("localField"), str):
+                    paths.add(body["localField"])
+                if isinstance(body.get("as"), str):
+                    joined.add(body["as"])
+                continue
+            # After $group/$project documents have new fields the profile can't know
+            if name in ("$match", "$sort") and not reshaped:
+                keys(body)
+            if not reshaped:
+                refs(body)
+            if name in RESHAPING_STAGES or (
+                name == "$unwind" and isinstance(body, dict) and body.get("includeArrayIndex")
+            ):
+                reshaped = True
+    return {path for path in paths if path.split(".", 1)[0] not in joined}
+
+
+def target_profile(query_dict: Dict[str, Any], profile, related=None):
+    """Profile of the collection a query runs on; None when it names an unknown one"""
+    name = query_dict.get("collection")
+    if not name or (profile is not None and name == profile.collection_name):
+        return profile
+    return (related or {}).get(name)
+
+
+def unknown_paths(query_dict: Dict[str, Any], profile) -> List[str]:
+    if profile is None or not profile.fields:
+        return []
+    known = set(profile.fields)
+    return sorted(
+        path
+        for path in referenced_paths(query_dict)
+        if path != "_id"
+        and path not in known
+        and not any(k.startswith(path + ".") for k in known)
+    )
+
+
+class PromptBuilder:
+    """Builds a compact, question-specific system prompt within a token budget.
+
+    The prompt carries the rules, every field path (names only), detailed
+    type/value lines for the paths most similar to the question, and the
+    closest few-shot examples taken from previously successful translations.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 900,
+        max_examples: int = 4,
+        max_detailed_paths: int = 12,
+        max_recorded: int = 200,
+    ):
+        self.token_budget = token_budget
+        self.max_examples = max_examples
+        self.max_detailed_paths = max_detailed_paths
+        self.max_recorded = max_recorded
+        self._examples: "OrderedDict[str, Tuple[str, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        for question, query_dict in SEED_EXAMPLES:
+            self._examples[normalize_question(question)] = (question, query_dict)
+        self.builds = 0
+        self.prompt_tokens_total = 0
+
+    def rank_paths(self, question: str, profile) -> List[Tuple[float, str]]:
+        """Profile paths ordered by similarity to the question's words and values"""
+        words = _words(question)
+        lowered = question.lower()
+        ranked = []
+        for path in profile.paths():
+            parts = _words(path.replace("_", " ").replace(".", " "))
+            score = (
+                sum(max(_word_similarity(p, w) for w in words) for p in parts) / len(parts)
+                if words and parts
+                else 0.0
+            )
+            for value in profile.enum_values(path):
+                if isinstance(value, str) and len(value) > 1 and value.lower() in lowered:
+                    score = max(score, 1.0)
+            if score >= 0.3:
+                ranked.append((score + profile.presence(path) / 10, path))
+        ranked.sort(key=lambda item: (-item[0], item[1]))
+        return ranked
+
+    def _collection_score(self, question: str, name: str, profile) -> float:
+        words = _words(question)
+        named = max((_word_similarity(_stem(name.lower()), w) for w in words), default=0.0)
+        return 2 * named + sum(score for score, _ in self.rank_paths(question, profile))
+
+    def select_examples(
+        self, question: str, profile=None, related=None
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        words = set(normalize_question(question).split())
+        with self._lock:
+            examples = list(self._examples.values())
+        scored = []
+        for example_question, query_dict in examples:
+            example_profile = target_profile(query_dict, profile, related)
+            if example_profile is None and query_dict.get("collection"):
+                continue
+            if unknown_paths(query_dict, example_profile):
+                continue
+            other = set(normalize_question(example_question).split())
+            overlap = len(words & other) / len(words | other) if words | other else 0.0
+            scored.append((overlap, example_question, query_dict))
+        scored.sort(key=lambda item: -item[0])
+        return [(q, d) for _, q, d in scored[: self.max_examples]]
+
+    def build(self, question: str, profile=None, related=None) -> List[Any]:
+        budget = self.token_budget - estimate_tokens(RULES) - estimate_tokens(question)
+        sections = [RULES]
+
+        if profile is not None and profile.fields:
+            names = "Fields: " + ", ".join(profile.paths())
+            if estimate_tokens(names) <= budget:
+                sections.append(names)
+                budget -= estimate_tokens(names)
+            details = []
+            for _, path in self.rank_paths(question, profile)[: self.max_detailed_paths]:
+                line = "- " + profile.describe_path(path)
+                if estimate_tokens(line) > budget:
+                    break
+                details.append(line)
+                budget -= estimate_tokens(line)
+            if details:
+                sections.append("Relevant fields:\n" + "\n".join(details))
+
+        others = {
+            name: other
+            for name, other in (related or {}).items()
+            if profile is None or name != profile.collection_name
+        }
+        if others and profile is not None:
+            rules = MULTI_COLLECTION_RULES.format(default=profile.collection_name)
+            lines = []
+            # Collections whose name or fields resemble the question come first
+            ranked = sorted(
+                others.items(),
+                key=lambda item: -self._collection_score(question, item[0], item[1]),
+            )
+            budget -= estimate_tokens(rules)
+            for name, other in ranked:
+                line = f"- {name}: " + ", ".join(other.paths())
+                if estimate_tokens(line) > budget:
+                    break
+                lines.append(line)
+                budget -= estimate_tokens(line)
+            if lines:
+                sections.append(rules + "\n" + "\n".join(lines))
+            else:
+                budget += estimate_tokens(rules)
+
+        examples = []
+        for example_question, query_dict in self.select_examples(question, profile, related):
+            text = f'User: "{example_question}"\nResponse: {json.dumps(query_dict)}'
+            if estimate_tokens(text) > budget:
+                break
+            examples.append(text)
+            budget -= estimate_tokens(text)
+        if examples:
+            sections.append("Examples:\n" + "\n\n".join(examples))
+
+        system = "\n\n".join(sections)
+        with self._lock:
+            self.builds += 1
+            self.prompt_tokens_total += estimate_tokens(system) + estimate_tokens(question)
+        # Imported on first use; langchain_core is a large part of a cold start
+        from langchain_core.messages import HumanMessage, SystemMessage
+
+        return [SystemMessage(content=system), HumanMessage(content=question)]
+
+    def build_refinement(
+        self, question: str, previous_question: str, previous_query: Dict[str, Any], fields
+    ) -> List[Any]:
+        """A short prompt for a follow-up: the previous query plus field names, no examples"""
+        compact = {
+            k: v
+            for k, v in previous_query.items()
+            if v or k not in ("projection", "sort", "limit", "skip")
+        }
+        system = REFINE_RULES.format(
+            question=previous_question,
+            query=json.dumps(compact, default=str),
+            fields=", ".join(fields) or "unknown",
+        )
+        with self._lock:
+            self.builds += 1
+            self.prompt_tokens_total += estimate_tokens(system) + estimate_tokens(question)
+        from langchain_core.messages import HumanMessage, SystemMessage
+
+        return [SystemMessage(content=system), HumanMessage(content=question)]
+
+    def record(self, question: str, query_dict: Dict[str, Any], profile=None, related=None) -> bool:
+        """Keep a successful translation as a future few-shot example"""
+        query_profile = target_profile(query_dict, profile, related)
+        if query_profile is None and query_dict.get("collection"):
+            return False
+        if unknown_paths(query_dict, query_profile):
+            return False
+        key = normalize_question(question)
+        compact = {
+            k: v
+            for k, v in query_dict.items()
+            if v or k not in ("projection", "sort", "limit", "skip")
+        }
+        with self._lock:
+            self._examples[key] = (question, compact)
+            self._examples.move_to_end(key)
+            while len(self._examples) > self.max_recorded:
+                self._examples.popitem(last=False)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "builds": self.builds,
+                "examples": len(self._examples),
+                "avg_prompt_tokens": self.prompt_tokens_total / self.builds
+                if self.builds
+                else 0.0,
+            }
+
+
+def prompt_builder_from_env() -> PromptBuilder:
+    return PromptBuilder(
+        token_budget=int(os.getenv("PROMPT_TOKEN_BUDGET", "900")),
+        max_examples=int(os.getenv("PROMPT_MAX_EXAMPLES", "4")),
+    )
+
+
+default_prompt_builder = prompt_builder_from_env()
@@ -0,0 +1,427 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from difflib import SequenceMatcher
+from typing import Dict, Any, Optional
+
+# Words that carry no meaning for query translation; dropping them lets
+# "show me students with gpa above 3.5" and "students with gpa above 3.5" share an entry
+STOP_WORDS = {
+    "a", "an", "the", "me", "please", "show", "give", "get", "find", "list",
+    "display", "all", "of", "for", "can", "you", "i", "want", "to", "see",
+    "what", "are", "is", "which", "who",
+}
+
+# Wording that may differ between near-duplicate questions; every other token
+# (values, negations, sort directions, comparisons) must match exactly
+FILLER_WORDS = {
+    "with", "whose", "that", "have", "has", "having", "by", "in", "on", "from",
+    "and", "there", "their", "student", "students", "document", "documents",
+    "record", "records", "rows", "entries", "people",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9_.$]+")
+
+
+def normalize_question(text: str) -> str:
+    tokens = _TOKEN_RE.findall(text.lower())
+    return " ".join(t for t in tokens if t not in STOP_WORDS)
+
+
+def schema_fingerprint(schema_info) -> str:
+    if not isinstance(schema_info, str):
+        schema_info = json.dumps(schema_info, sort_keys=True, default=str)
+    return hashlib.sha1(schema_info.encode("utf-8")).hexdigest()[:16]
+
+
+def _literals(normalized: str):
+    # Only filler wording may differ for a near-duplicate hit; otherwise "gpa above 3.5"
+    # would get the query for "above 3.6", "descending" the one for "ascending",
+    # "not Mathematics" the one for "Mathematics" and "Physic" the one for "Physics"
+    return sorted(t for t in normalized.split() if t not in FILLER_WORDS)
+
+
+class _SQLiteBackend:
+    """Persistent key/value store so cached translations survive restarts"""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "key TEXT PRIMARY KEY, fingerprint TEXT, question TEXT, "
+            "query TEXT, created REAL)"
+        )
+        self._conn.commit()
+
+    def load(self, max_entries: int):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, fingerprint, question, query, created FROM translations "
+                "ORDER BY created DESC LIMIT ?",
+                (max_entries,),
+            ).fetchall()
+        return list(reversed(rows))
+
+    def put(self, key, fingerprint, question, query_dict, created):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?)",
+                (key, fingerprint, question, json.dumps(query_dict), created),
+            )
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM translations WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM translations")
+            self._conn.commit()
+
+
+class TranslationCache:
+    """LRU/TTL cache of natural language question -> query_dict translations.
+
+    Entries are keyed on the normalized question plus a fingerprint of the
+    collection schema, so a schema change never serves a stale translation.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl_seconds: float = 3600,
+        similarity_threshold: float = 0.92,
+        disk_path: Optional[str] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._backend = _SQLiteBackend(disk_path) if disk_path else None
+        if self._backend:
+            for key, fingerprint, question, query, created in self._backend.load(
+                max_entries
+            ):
+                self._entries[key] = {
+                    "fingerprint": fingerprint,
+                    "question": question,
+                    "query_dict": json.loads(query),
+                    "created": created,
+                }
+
+    @staticmethod
+    def _key(normalized: str, fingerprint: str) -> str:
+        return f"{fingerprint}:{normalized}"
+
+    def _expired(self, entry, now) -> bool:
+        return self.ttl_seconds and now - entry["created"] > self.ttl_seconds
+
+    def _evict(self, key):
+        self._entries.pop(key, None)
+        if self._backend:
+            self._backend.delete(key)
+
+    def get(self, question: str, schema_info) -> Optional[Dict[str, Any]]:
+        normalized = normalize_question(question)
+        fingerprint = schema_fingerprint(schema_info)
+        key = self._key(normalized, fingerprint)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and self._expired(entry, now):
+                self._evict(key)
+                entry = None
+            if entry:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(json.dumps(entry["query_dict"]))
+
+            # Near-duplicate lookup: same schema, same meaningful tokens, similar wording
+            literals = _literals(normalized)
+            best_key, best_ratio = None, 0.0
+            for other_key, other in list(self._entries.items()):
+                if other["fingerprint"] != fingerprint:
+                    continue
+                if self._expired(other, now):
+                    self._evict(other_key)
+                    continue
+                if _literals(other["question"]) != literals:
+                    continue
+                ratio = SequenceMatcher(None, normalized, other["question"]).ratio()
+                if ratio > best_ratio:
+                    best_key, best_ratio = other_key, ratio
+
+            if best_key and best_ratio >= self.similarity_threshold:
+                self._entries.move_to_end(best_key)
+                self.near_hits += 1
+                return json.loads(json.dumps(self._entries[best_key]["query_dict"]))
+
+            self.misses += 1
+            return None
+
+    def put(self, question: str, schema_info, query_dict: Dict[str, Any]):
+        normalized = normalize_question(question)
+        fingerprint = schema_fingerprint(schema_info)
+        key = self._key(normalized, fingerprint)
+        created = time.time()
+
+        with self._lock:
+            self._entries[key] = {
+                "fingerprint": fingerprint,
+                "question": normalized,
+                # A copy, so the caller changing its query later can't alter the entry
+                "query_dict": json.loads(json.dumps(query_dict)),
+                "created": created,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                oldest, _ = self._entries.popitem(last=False)
+                if self._backend:
+                    self._backend.delete(oldest)
+            if self._backend:
+                self._backend.put(key, fingerprint, normalized, query_dict, created)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._backend:
+                self._backend.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.near_hits) / lookups if lookups else 0.0,
+        }
+
+
+def cache_from_env() -> TranslationCache:
+    return TranslationCache(
+        max_entries=int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1000")),
+        ttl_seconds=float(os.getenv("QUERY_CACHE_TTL_SECONDS", "3600")),
+        similarity_threshold=float(os.getenv("QUERY_CACHE_SIMILARITY", "0.92")),
+        disk_path=os.getenv("QUERY_CACHE_PATH") or None,
+    )
+
+
+class CountCache:
+    """Short-TTL cache of filtered counts so hot "how many" questions skip the scan"""
+
+    def __init__(self, ttl_seconds: float = 30, max_entries: int = 500):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(namespace: str, filter_dict) -> str:
+        return namespace + ":" + json.dumps(filter_dict, sort_keys=True, default=str)
+
+    def get(self, namespace: str, filter_dict):
+        key = self._key(namespace, filter_dict)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry[1] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def put(self, namespace: str, filter_dict, count: int):
+        key = self._key(namespace, filter_dict)
+        with self._lock:
+            self._entries[key] = (count, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def count_cache_from_env() -> CountCache:
+    return CountCache(ttl_seconds=float(os.getenv("COUNT_CACHE_TTL_SECONDS", "30")))
+
+
+def _canonical_value(value):
+    if isinstance(value, dict):
+        if set(value) == {"$eq"}:
+            return _canonical_value(value["$eq"])
+        if set(value) == {"$in"} and isinstance(value["$in"], list) and len(value["$in"]) == 1:
+            return _canonical_value(value["$in"][0])
+        return {k: _canonical_value(v) for k, v in sorted(value.items())}
+    if isinstance(value, list):
+        return [_canonical_value(v) for v in value]
+    return value
+
+
+def _canonical_filter(filter_dict):
+    filter_dict = dict(filter_dict or {})
+    # A single-clause $and is the same as the clause itself
+    if set(filter_dict) == {"$and"} and len(filter_dict["$and"]) == 1:
+        filter_dict = dict(filter_dict["$and"][0])
+    return _canonical_value(filter_dict)
+
+
+def canonical_query(query_dict: Dict[str, Any]) -> str:
+    """Stable key for a query_dict: sorted keys, normalized operators, defaults dropped"""
+    canonical = {"operation": query_dict.get("operation") or "find"}
+    if query_dict.get("pipeline"):
+        canonical["operation"] = "aggregate"
+        canonical["pipeline"] = [
+            {name: _canonical_value(body) for name, body in stage.items()}
+            for stage in query_dict["pipeline"]
+        ]
+    else:
+        canonical["filter"] = _canonical_filter(query_dict.get("filter"))
+        if query_dict.get("projection"):
+            canonical["projection"] = dict(sorted(query_dict["projection"].items()))
+        if query_dict.get("sort"):
+            # Sort key order is significant, so it is kept as given
+            canonical["sort"] = list(query_dict["sort"].items())
+    if query_dict.get("skip", 0) > 0:
+        canonical["skip"] = query_dict["skip"]
+    if query_dict.get("limit", 0) > 0:
+        canonical["limit"] = query_dict["limit"]
+    return json.dumps(canonical, sort_keys=True, default=str)
+
+
+class ResultCache:
+    """Byte-bounded LRU cache of executed query results with per-collection TTLs"""
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        default_ttl: float = 60,
+        collection_ttls: Optional[Dict[str, float]] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.collection_ttls = collection_ttls or {}
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _ttl(self, namespace: str) -> float:
+        name = namespace.split(".", 1)[-1]
+        return self.collection_ttls.get(namespace, self.collection_ttls.get(name, self.default_ttl))
+
+    @staticmethod
+    def key(namespace: str, query_dict: Dict[str, Any], *extra) -> str:
+        return "|".join([namespace, canonical_query(query_dict), *map(str, extra)])
+
+    def get(self, key: str):
+        namespace = key.split("|", 1)[0]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry[1] <= self._ttl(namespace):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry:
+                self._drop(key)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value):
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, time.time(), size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def invalidate(self, namespace: Optional[str] = None):
+        with self._lock:
+            for key in [k for k in self._entries if namespace is None or k.startswith(namespace + "|")]:
+                self._drop(key)
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+
+class ChangeStreamInvalidator:
+    """Drops a collection's cached results whenever a change stream reports a write.
+
+    Change streams need a replica set or sharded cluster; on a standalone
+    server the watcher stops and entries simply expire by TTL.
+    """
+
+    def __init__(self, cache: ResultCache, collection):
+        self.cache = cache
+        self.collection = collection
+        self.error = None
+        self._stream = None
+        self._thread = threading.Thread(
+            target=self._run, name=f"invalidate-{collection.full_name}", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        try:
+            with self.collection.watch() as stream:
+                self._stream = stream
+                for _ in stream:
+                    self.cache.invalidate(self.collection.full_name)
+        except Exception as e:
+            self.error = str(e)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+
+
+def _parse_ttls(value: str) -> Dict[str, float]:
+    # "Student=30,Course=600"
+    ttls = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, seconds = item.partition("=")
+        ttls[name.strip()] = float(seconds)
+    return ttls
+
+
+def result_cache_from_env() -> ResultCache:
+    return ResultCache(
+        max_bytes=int(os.getenv("RESULT_CACHE_MAX_MB", "64")) * 1024 * 1024,
+        default_ttl=float(os.getenv("RESULT_CACHE_TTL_SECONDS", "60")),
+        collection_ttls=_parse_ttls(os.getenv("RESULT_CACHE_COLLECTION_TTLS", "")),
+    )
@@ -0,0 +1,265 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+from index_advisor import _leading_stages
+from metrics import registry
+from prompt_builder import unknown_paths
+
+# Server-side JavaScript and write stages are never run on behalf of a chat question
+FORBIDDEN_OPERATORS = {"$where", "$function", "$accumulator", "$out", "$merge"}
+
+
+class QueryRejected(Exception):
+    """A generated query was refused by the guard; the message says why"""
+
+
+def _operators(value, found=None):
+    found = set() if found is None else found
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key.startswith("$"):
+                found.add(key)
+            _operators(item, found)
+    elif isinstance(value, list):
+        for item in value:
+            _operators(item, found)
+    return found
+
+
+def _unanchored_regexes(value, found=None):
+    found = [] if found is None else found
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == "$regex" and isinstance(item, str) and not item.startswith("^"):
+                found.append(item)
+            else:
+                _unanchored_regexes(item, found)
+    elif isinstance(value, list):
+        for item in value:
+            _unanchored_regexes(item, found)
+    return found
+
+
+def _joined_collections(value, found=None):
+    found = set() if found is None else found
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in ("$lookup", "$graphLookup") and isinstance(item, dict):
+                found.add(item.get("from"))
+            elif key == "$unionWith":
+                found.add(item.get("coll") if isinstance(item, dict) else item)
+            _joined_collections(item, found)
+    elif isinstance(value, list):
+        for item in value:
+            _joined_collections(item, found)
+    return found
+
+
+def _index_usable(index_information: Dict[str, Any], filter_dict, sort) -> bool:
+    # Good enough for costing: some index leads with a filtered or sorted field
+    fields = {f for f in filter_dict if not f.startswith("$")} | set(sort or {})
+    for index in index_information.values():
+        keys = index.get("key", [])
+        if keys and keys[0][0] in fields and keys[0][0] != "_id":
+            return True
+        if keys and keys[0][0] == "_id" and "_id" in fields:
+            return True
+    return False
+
+
+class _UserBudget:
+    """Sliding one-minute window of estimated documents examined per user"""
+
+    def __init__(self, docs_per_minute: int):
+        self.docs_per_minute = docs_per_minute
+        self._spent: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def charge(self, user: str, cost: int) -> Optional[float]:
+        """Record the cost, or return the seconds to wait if it would exceed the budget"""
+        if not self.docs_per_minute or user is None:
+            return None
+        now = time.time()
+        with self._lock:
+            window = self._spent.setdefault(user, deque())
+            while window and now - window[0][0] > 60:
+                window.popleft()
+            spent = sum(c for _, c in window)
+            if window and spent + cost > self.docs_per_minute:
+                return 60 - (now - window[0][0])
+            window.append((now, cost))
+        return None
+
+    def spent(self, user: str) -> int:
+        now = time.time()
+        with self._lock:
+            return sum(c for t, c in self._spent.get(user, ()) if now - t <= 60)
+
+
+class QueryGuard:
+    """Validates and costs a generated query before it reaches MongoDB.
+
+    Server-side JavaScript, write stages and large skips are rejected;
+    field paths the sampled profile hasn't seen only produce a warning.
+    Limits are capped, every query gets a maxTimeMS, and unindexed work on
+    large collections is charged against a per-user budget of documents
+    examined per minute.
+    """
+
+    def __init__(
+        self,
+        max_time_ms: int = 5000,
+        max_limit: int = 1000,
+        max_skip: int = 1000,
+        max_pipeline_stages: int = 20,
+        allow_disk_use: bool = False,
+        large_collection_docs: int = 100_000,
+        user_docs_per_minute: int = 5_000_000,
+        stats_seconds: float = 60,
+    ):
+        self.max_time_ms = max_time_ms
+        self.max_limit = max_limit
+        self.max_skip = max_skip
+        self.max_pipeline_stages = max_pipeline_stages
+        self.allow_disk_use = allow_disk_use
+        self.large_collection_docs = large_collection_docs
+        self.budget = _UserBudget(user_docs_per_minute)
+        self.stats_seconds = stats_seconds
+        self._collection_stats: Dict[str, Tuple[float, int, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.rewritten = 0
+
+    def _stats(self, collection) -> Tuple[int, Dict[str, Any]]:
+        key = collection.full_name
+        with self._lock:
+            cached = self._collection_stats.get(key)
+        if cached and time.time() - cached[0] <= self.stats_seconds:
+            return cached[1], cached[2]
+        docs = collection.estimated_document_count()
+        indexes = collection.index_information()
+        with self._lock:
+            self._collection_stats[key] = (time.time(), docs, indexes)
+        return docs, indexes
+
+    def prefetch(self, collection):
+        """Load collection size and indexes ahead of check(), e.g. while the LLM streams"""
+        self._stats(collection)
+
+    def _reject(self, reason: str):
+        with self._lock:
+            self.rejected += 1
+        registry.inc("mongoquery_guard_total", result="rejected")
+        raise QueryRejected(reason)
+
+    def check(
+        self,
+        collection,
+        query_dict: Dict[str, Any],
+        profile=None,
+        user: str = None,
+        collections: Optional[List[str]] = None,
+    ) -> Tuple[Dict[str, Any], List[str]]:
+        """Return the query to run and notes on any rewrites; raise QueryRejected"""
+        query_dict = dict(query_dict)
+        notes = []
+
+        if not isinstance(query_dict.get("filter", {}), dict):
+            self._reject("The generated filter is not a JSON object.")
+        pipeline = query_dict.get("pipeline") or []
+        if not isinstance(pipeline, list):
+            self._reject("The generated pipeline is not a list of stages.")
+        if len(pipeline) > self.max_pipeline_stages:
+            self._reject(f"The pipeline has {len(pipeline)} stages (max {self.max_pipeline_stages}).")
+
+        forbidden = _operators(query_dict) & FORBIDDEN_OPERATORS
+        if forbidden:
+            self._reject(f"{', '.join(sorted(forbidden))} is not allowed in chat queries.")
+
+        if collections is not None:
+            missing = _joined_collections(pipeline) - set(collections)
+            if missing:
+                self._reject(
+                    f"Unknown collection(s) {', '.join(sorted(map(str, missing)))} in join; "
+                    f"available: {', '.join(collections)}"
+                )
+
+        # The profile is a sample (and may be truncated), so a path it hasn't seen
+        # can still exist; the query runs with a warning instead of being refused
+        warnings = []
+        unknown = unknown_paths(query_dict, profile)
+        if unknown:
+            warnings.append(
+                f"Field(s) {', '.join(unknown)} not seen in the sampled documents; "
+                "the query may match nothing."
+            )
+
+        docs, indexes = self._stats(collection)
+        filter_dict, sort = _leading_stages(query_dict)
+        indexed = _index_usable(indexes, filter_dict, sort)
+        large = docs >= self.large_collection_docs
+
+        if _unanchored_regexes(query_dict) and large:
+            self._reject(
+                "Unanchored $regex would scan the whole collection; "
+                "match from the start of the value (e.g. ^Smith) instead."
+            )
+
+        if query_dict.get("limit", 0) > self.max_limit:
+            query_dict["limit"] = self.max_limit
+            notes.append(f"Limit capped at {self.max_limit} rows.")
+
+        if query_dict.get("skip", 0) > self.max_skip:
+            # The server walks every skipped row; narrow with a filter on the sort key instead
+            self._reject(
+                f"Skipping more than {self.max_skip} rows is not allowed; "
+                "filter on the sorted field to start further along."
+            )
+
+        if sort and not indexed and large and not query_dict.get("limit"):
+            query_dict["limit"] = self.max_limit
+            notes.append(f"Unindexed sort limited to the top {self.max_limit} rows.")
+
+        query_dict["max_time_ms"] = self.max_time_ms
+        # The disk-use policy is for find sorts; pipelines always spilled to disk,
+        # and large $group/$sort stages fail at the 100MB limit without it
+        aggregate = bool(pipeline) or query_dict.get("operation") == "aggregate"
+        query_dict["allow_disk_use"] = True if aggregate else self.allow_disk_use
+
+        if query_dict.get("operation") == "count" and not filter_dict:
+            cost = 0  # answered from collection metadata
+        elif indexed:
+            returned = (query_dict.get("limit") or 0) + query_dict.get("skip", 0)
+            cost = min(docs, max(returned, docs // 100))
+        else:
+            cost = docs
+        wait = self.budget.charge(user, cost)
+        if wait is not None:
+            self._reject(
+                f"Query budget for this session is used up; try again in {wait:.0f}s "
+                "or narrow the question to indexed fields."
+            )
+
+        if notes:
+            with self._lock:
+                self.rewritten += 1
+        registry.inc("mongoquery_guard_total", result="rewritten" if notes else "passed")
+        return query_dict, notes + warnings
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"rejected": self.rejected, "rewritten": self.rewritten}
+
+
+def guard_from_env() -> QueryGuard:
+    return QueryGuard(
+        max_time_ms=int(os.getenv("QUERY_MAX_TIME_MS", "5000")),
+        max_limit=int(os.getenv("QUERY_MAX_LIMIT", "1000")),
+        max_skip=int(os.getenv("QUERY_MAX_SKIP", "1000")),
+        allow_disk_use=os.getenv("QUERY_ALLOW_DISK_USE", "0").lower() in ("1", "true", "yes"),
+        large_collection_docs=int(os.getenv("QUERY_LARGE_COLLECTION_DOCS", "100000")),
+        user_docs_per_minute=int(os.getenv("QUERY_BUDGET_DOCS_PER_MINUTE", "5000000")),
+    )
@@ -0,0 +1,371 @@
+"""Query translation and execution shared by the Streamlit app and the headless service.
+
+Nothing here imports streamlit; UI code lives in helper.py.
+"""
+import os
+import time
+from typing import Dict, Any
+from pymongo.errors import CursorNotFound
+import bson
+from bson import ObjectId
+from schema_profiler import default_profiler
+from prompt_builder import default_prompt_builder
+from llm_router import Backend, LLMRouter
+from rendering import flatten_results
+from metrics import registry, span, query_shape
+
+
+def get_collection_schema(collection, collection_name, profiler=None):
+    try:
+        profiler = profiler or default_profiler
+        with span("schema", collection=collection_name) as timing:
+            profile = profiler.profile(collection)
+            timing.set(docs=profile.docs_seen, paths=len(profile.fields))
+        if not profile.docs_seen:
+            return "Collection is empty.", []
+        profile.collection_name = collection_name
+        return profile.describe(), profile.sample_docs
+    except Exception as e:
+        return f"Error getting schema: {str(e)}", []
+
+
+DEFAULT_BATCH_SIZE = int(os.getenv("MONGO_BATCH_SIZE", "50"))
+DEFAULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "100"))
+
+
+def document_bytes(doc) -> int:
+    try:
+        return len(bson.encode(doc))
+    except Exception:
+        return 0
+
+
+def serialize_id(doc):
+    # Only ObjectIds need converting; grouped _id values from $group stay as they are
+    if isinstance(doc.get("_id"), ObjectId):
+        doc["_id"] = str(doc["_id"])
+    return doc
+
+
+def is_aggregate(query_dict: Dict[str, Any]) -> bool:
+    return bool(query_dict.get("pipeline")) or query_dict.get("operation") == "aggregate"
+
+
+def build_find_cursor(collection, query_dict: Dict[str, Any], batch_size=None):
+    """Build a find cursor from a query_dict without fetching any documents"""
+    query = collection.find(
+        query_dict.get("filter", {}), query_dict.get("projection", {})
+    )
+
+    # Apply sort if specified and not empty
+    if query_dict.get("sort"):
+        query = query.sort(query_dict["sort"])
+
+    # Apply skip if specified and > 0
+    if query_dict.get("skip", 0) > 0:
+        query = query.skip(query_dict["skip"])
+
+    # Apply limit if specified and > 0
+    if query_dict.get("limit", 0) > 0:
+        query = query.limit(query_dict["limit"])
+
+    if batch_size:
+        query = query.batch_size(batch_size)
+
+    # Execution policies set by the query guard
+    if query_dict.get("max_time_ms"):
+        query = query.max_time_ms(query_dict["max_time_ms"])
+    if query_dict.get("allow_disk_use"):
+        query = query.allow_disk_use(True)
+
+    return query
+
+
+def build_aggregate_cursor(collection, query_dict: Dict[str, Any], batch_size=None):
+    """Run the pipeline server-side; skip/limit become trailing stages"""
+    pipeline = list(query_dict.get("pipeline", []))
+    if query_dict.get("skip", 0) > 0:
+        pipeline.append({"$skip": query_dict["skip"]})
+    if query_dict.get("limit", 0) > 0:
+        pipeline.append({"$limit": query_dict["limit"]})
+
+    options = {"allowDiskUse": query_dict.get("allow_disk_use", True)}
+    if batch_size:
+        options["batchSize"] = batch_size
+    if query_dict.get("max_time_ms"):
+        options["maxTimeMS"] = query_dict["max_time_ms"]
+    return collection.aggregate(pipeline, **options)
+
+
+def build_cursor(collection, query_dict: Dict[str, Any], batch_size=None):
+    if is_aggregate(query_dict):
+        return build_aggregate_cursor(collection, query_dict, batch_size)
+    return build_find_cursor(collection, query_dict, batch_size)
+
+
+def stream_mongodb(
+    collection, query_dict: Dict[str, Any], batch_size: int = DEFAULT_BATCH_SIZE
+):
+    """Yield query results in batches, converting ObjectId to string on the fly"""
+    cursor = build_cursor(collection, query_dict, batch_size)
+    try:
+        batch = []
+        for doc in cursor:
+            batch.append(serialize_id(doc))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        cursor.close()
+
+
+class ResultPager:
+    """Keeps one live cursor per result and holds only the current page in memory"""
+
+    def __init__(
+        self,
+        collection,
+        query_dict: Dict[str, Any],
+        page_size: int = DEFAULT_PAGE_SIZE,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        cache=None,
+    ):
+        self.collection = collection
+        self.cache = cache
+        self.query_dict = query_dict
+        self.page_size = page_size
+        self.batch_size = min(batch_size, page_size)
+        self.page_number = 0
+        self.page = []
+        self.has_more = True
+        self._consumed = 0
+        self._cursor = None
+
+    def _open_cursor(self):
+        # Reopen past the rows already shown if the server-side cursor timed out
+        query_dict = dict(self.query_dict)
+        query_dict["skip"] = query_dict.get("skip", 0) + self._consumed
+        if query_dict.get("limit", 0) > 0:
+            query_dict["limit"] = max(query_dict["limit"] - self._consumed, 0)
+            if query_dict["limit"] == 0:
+                self.has_more = False
+                return None
+        return build_cursor(self.collection, query_dict, self.batch_size)
+
+    def iter_page(self):
+        """Fetch the next page, yielding the growing page after every batch"""
+        self.page = []
+        self.page_number += 1
+
+        # A cached page is only usable before a cursor is open; afterwards the
+        # cursor position must stay in step with the rows already served
+        cache_key = None
+        if self.cache is not None and self._cursor is None:
+            cache_key = self.cache.key(
+                self.collection.full_name,
+                self.query_dict,
+                self.page_number,
+                self.page_size,
+            )
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.page, self.has_more = list(cached["page"]), cached["has_more"]
+                self._consumed += len(self.page)
+                yield self.page
+                return
+
+        if self._cursor is None:
+            self._cursor = self._open_cursor()
+        if self._cursor is None:
+            return
+
+        # Only time spent waiting on the cursor is attributed to MongoDB; the
+        # caller renders between yields
+        fetch_seconds, page_bytes = 0.0, 0
+        while len(self.page) < self.page_size:
+            start = time.perf_counter()
+            try:
+                doc = next(self._cursor, None)
+            except CursorNotFound:
+                # Cursor expired between pages; resume from the last consumed row
+                self._cursor = self._open_cursor()
+                if self._cursor is None:
+                    break
+                continue
+            finally:
+                fetch_seconds += time.perf_counter() - start
+            if doc is None:
+                self.has_more = False
+                break
+            page_bytes += document_bytes(doc)
+            self.page.append(serialize_id(doc))
+            self._consumed += 1
+            if len(self.page) % self.batch_size == 0:
+                yield self.page
+
+        registry.record(
+            "mongodb",
+            fetch_seconds,
+            shape=query_shape(self.query_dict),
+            docs=len(self.page),
+            bytes=page_bytes,
+            page=self.page_number,
+        )
+        if cache_key is not None:
+            self.cache.put(cache_key, {"page": list(self.page), "has_more": self.has_more})
+        if self.page and len(self.page) % self.batch_size:
+            yield self.page
+        if not self.has_more:
+            self.close()
+
+    def next_page(self):
+        for _ in self.iter_page():
+            pass
+        return self.page
+
+    def close(self):
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+
+
+def is_count(query_dict: Dict[str, Any]) -> bool:
+    return query_dict.get("operation") == "count"
+
+
+def count_documents(collection, filter_dict=None, cache=None, max_time_ms=None, summaries=None):
+    try:
+        filter_dict = filter_dict or {}
+        # No condition: collection metadata answers instantly instead of a full scan
+        if not filter_dict:
+            with span("count", shape="estimated"):
+                return collection.estimated_document_count()
+
+        if cache is not None:
+            cached = cache.get(collection.full_name, filter_dict)
+            if cached is not None:
+                return cached
+
+        # Counts filtered only on a summarized group key are read from the summary
+        if summaries is not None:
+            with span("count", shape="summary"):
+                count = summaries.count(collection, filter_dict)
+            if count is not None:
+                return count
+
+        with span("count", shape=query_shape({"filter": filter_dict})):
+            options = {"maxTimeMS": max_time_ms} if max_time_ms else {}
+            count = collection.count_documents(filter_dict, **options)
+        if cache is not None:
+            cache.put(collection.full_name, filter_dict, count)
+        return count
+    except Exception as e:
+        return f"Error counting documents: {str(e)}"
+
+
+def process_user_query(
+    user_input: str,
+    llm,
+    schema_info=None,
+    cache=None,
+    profile=None,
+    prompt_builder=None,
+    related=None,
+    on_key=None,
+) -> Dict[str, Any]:
+    # Set default values for missing optional fields
+    default_query = {
+        "filter": {},
+        "projection": {},
+        "sort": {},
+        "limit": 0,
+        "skip": 0,
+    }
+
+    # Repeated (or near-identical) questions against the same schema skip the LLM.
+    # Only the schema's structure keys the cache: sampled counts and ranges
+    # change with every profile and would make every entry miss
+    cache_schema = profile.structure() if profile is not None else schema_info or ""
+    if cache is not None:
+        cached = cache.get(user_input, cache_schema)
+        registry.inc(
+            "mongoquery_translation_cache_total",
+            result="miss" if cached is None else "hit",
+        )
+        if cached is not None:
+            return cached
+
+    builder = prompt_builder or default_prompt_builder
+    messages = builder.build(user_input, profile, related)
+
+    # A bare chat model is routed like a single backend; failures raise
+    # LLMUnavailable instead of falling back to a match-everything query
+    router = llm if isinstance(llm, LLMRouter) else LLMRouter([Backend("default", llm)])
+    with span("llm", model=router.model_name) as timing:
+        query_dict, usage, backend = router.complete(messages, on_key)
+        timing.set(backend=backend, **usage)
+
+    for key in default_query:
+        if key not in query_dict:
+            query_dict[key] = default_query[key]
+
+    if cache is not None:
+        cache.put(user_input, cache_schema, query_dict)
+
+    return query_dict
+
+
+def remember_translation(
+    question: str, query_dict: Dict[str, Any], result, profile=None, related=None, prompt_builder=None
+) -> bool:
+    """Keep an LLM translation as a few-shot example once the guard passed it and it found something.
+
+    `result` is the rows or count it returned; no rows, a zero count or an
+    error message keeps it out of future prompts.
+    """
+    if not result or isinstance(result, str):
+        return False
+    builder = prompt_builder or default_prompt_builder
+    return builder.record(question, query_dict, profile, related)
+
+
+def process_refinement(
+    user_input: str,
+    llm,
+    previous: Dict[str, Any],
+    profile=None,
+    prompt_builder=None,
+) -> Dict[str, Any]:
+    """Translate a follow-up into a delta on the previous query (or a new query).
+
+    The translation cache and few-shot examples are skipped: the same words
+    mean something else after a different previous answer.
+    """
+    previous_query = previous["query_dict"]
+    if is_aggregate(previous_query) or profile is None:
+        # Later stages filter the previous output rows, so those are the fields
+        table = previous.get("table")
+        fields = table.columns if table is not None else list(
+            dict.fromkeys(
+                name
+                for row in flatten_results(previous.get("results") or [], previous_query)
+                for name in row
+            )
+        )
+    else:
+        fields = profile.paths()
+
+    builder = prompt_builder or default_prompt_builder
+    messages = builder.build_refinement(
+        user_input, previous.get("question", ""), previous_query, fields
+    )
+    router = llm if isinstance(llm, LLMRouter) else LLMRouter([Backend("default", llm)])
+    with span("llm", model=router.model_name, kind="refine") as timing:
+        query_dict, usage, backend = router.complete(messages)
+        timing.set(backend=backend, **usage)
+
+    if query_dict.get("operation") not in ("refine", "count", "aggregate"):
+        query_dict = {"filter": {}, "projection": {}, "sort": {}, "limit": 0, "skip": 0, **query_dict}
+    return query_dict
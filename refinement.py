@@ -0,0 +1,399 @@
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+from metrics import registry
+from prompt_builder import referenced_paths, unknown_paths
+
+# "now only ...", "sort those by ...", "how many of them" refer back to the last answer
+FOLLOW_UP_RE = re.compile(
+    r"^\s*(now|then|and|also|but|just|only|instead|of\s+(those|these|them))\b"
+    r"|\b(those|these|them|ones|same|previous|above\s+results?)\b",
+    re.IGNORECASE,
+)
+# Stripped before the fast path reads a follow-up as a standalone question
+REFERENCE_WORDS = {
+    "now", "then", "also", "but", "just", "only", "instead", "those", "these",
+    "them", "same", "previous", "again", "among", "out",
+}
+_WORD_RE = re.compile(r"\S+")
+
+# Keys the guard sets per run; a refined query is checked again from scratch
+_GUARD_KEYS = ("max_time_ms", "allow_disk_use")
+
+
+class _Unsupported(Exception):
+    """The condition can't be evaluated exactly outside MongoDB"""
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _candidates(value, parts):
+    """Values a dotted path reaches, descending into arrays like MongoDB does"""
+    if not parts:
+        yield value
+        if isinstance(value, list):
+            yield from value
+        return
+    if isinstance(value, dict):
+        if parts[0] in value:
+            yield from _candidates(value[parts[0]], parts[1:])
+    elif isinstance(value, list):
+        if parts[0].isdigit():
+            raise _Unsupported("array index in path")
+        for item in value:
+            yield from _candidates(item, parts)
+
+
+def _equal(a, b) -> bool:
+    if isinstance(a, bool) != isinstance(b, bool):
+        return False
+    return a == b
+
+
+def _bracket(value):
+    # Comparisons only match values of the same type, as in MongoDB
+    if _is_number(value):
+        return "number"
+    for kind in (str, datetime, bool):
+        if isinstance(value, kind):
+            return kind.__name__
+    raise _Unsupported(f"comparison on {type(value).__name__}")
+
+
+def _compare(op: str, value, operand) -> bool:
+    if value is None or _bracket(value) != _bracket(operand):
+        return False
+    if op == "$gt":
+        return value > operand
+    if op == "$gte":
+        return value >= operand
+    if op == "$lt":
+        return value < operand
+    return value <= operand
+
+
+def _regex(operand, options: str = ""):
+    flags = 0
+    for letter, flag in (("i", re.IGNORECASE), ("m", re.MULTILINE), ("s", re.DOTALL), ("x", re.VERBOSE)):
+        if letter in options:
+            flags |= flag
+    return re.compile(operand, flags)
+
+
+def _matches_value(values: List[Any], condition) -> bool:
+    """One field condition against the values its path reaches"""
+    if not (isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition)):
+        if condition is None:
+            return not values or any(v is None for v in values)
+        return any(_equal(v, condition) for v in values)
+
+    for op, operand in condition.items():
+        if op == "$eq":
+            ok = _matches_value(values, operand)
+        elif op == "$ne":
+            ok = not _matches_value(values, operand)
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            ok = any(_compare(op, v, operand) for v in values)
+        elif op == "$in":
+            ok = any(_matches_value(values, item) for item in operand)
+        elif op == "$nin":
+            ok = not any(_matches_value(values, item) for item in operand)
+        elif op == "$exists":
+            ok = bool(values) == bool(operand)
+        elif op == "$regex":
+            pattern = _regex(operand, condition.get("$options", ""))
+            ok = any(isinstance(v, str) and pattern.search(v) for v in values)
+        elif op == "$options":
+            continue
+        elif op == "$not":
+            ok = not _matches_value(values, operand)
+        else:
+            raise _Unsupported(op)
+        if not ok:
+            return False
+    return True
+
+
+def matches(doc: Dict[str, Any], filter_dict: Dict[str, Any]) -> bool:
+    """Evaluate a find filter on one document; raises _Unsupported when unsure"""
+    for key, condition in filter_dict.items():
+        if key == "$and":
+            ok = all(matches(doc, part) for part in condition)
+        elif key == "$or":
+            ok = any(matches(doc, part) for part in condition)
+        elif key == "$nor":
+            ok = not any(matches(doc, part) for part in condition)
+        elif key.startswith("$"):
+            raise _Unsupported(key)
+        else:
+            ok = _matches_value(list(_candidates(doc, key.split("."))), condition)
+        if not ok:
+            return False
+    return True
+
+
+# MongoDB's order across types: null/missing, numbers, strings, ..., booleans, dates
+_SORT_RANK = {"number": 1, "str": 2, "bool": 8, "datetime": 9}
+
+
+def _sort_key(doc, path: str):
+    values = list(_candidates(doc, path.split(".")))
+    if not values or values[0] is None:
+        return (0, 0)
+    if len(values) > 1 or isinstance(values[0], list):
+        raise _Unsupported("sort on an array")
+    return (_SORT_RANK[_bracket(values[0])], values[0])
+
+
+def _project(doc: Dict[str, Any], projection: Dict[str, Any]) -> Dict[str, Any]:
+    included = [key for key, value in projection.items() if value and key != "_id"]
+    if not included:
+        return {k: v for k, v in doc.items() if k not in projection}
+    projected = {key: doc[key] for key in included if key in doc}
+    if projection.get("_id", 1) and "_id" in doc:
+        projected = {"_id": doc["_id"], **projected}
+    return projected
+
+
+def _tightens(current: Dict[str, Any], condition: Dict[str, Any]) -> bool:
+    """Shared range operators only move inward ("gpa above 3.5" after "above 3")"""
+    for op in set(current) & set(condition):
+        old, new = current[op], condition[op]
+        if op not in ("$gt", "$gte", "$lt", "$lte") or not (_is_number(old) and _is_number(new)):
+            return False
+        if (new < old) if op in ("$gt", "$gte") else (new > old):
+            return False
+    return True
+
+
+def merge_filters(previous: Dict[str, Any], added: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+    """Combine the previous filter with a follow-up's conditions.
+
+    New fields, new operators on a field and tighter bounds are AND-ed in (a
+    strict narrowing); a different condition on an already filtered field
+    replaces it, as in "now the Computer Science ones" after a Mathematics filter.
+    """
+    merged = dict(previous or {})
+    narrowing = True
+    for key, condition in (added or {}).items():
+        current = merged.get(key)
+        if key not in merged or _equal(current, condition):
+            merged[key] = condition
+        elif key.startswith("$"):
+            # A second $or/$and must hold as well
+            merged["$and"] = list(merged.get("$and", [])) + [{key: condition}]
+        elif (
+            isinstance(current, dict)
+            and isinstance(condition, dict)
+            and all(k.startswith("$") for k in (*current, *condition))
+            and _tightens(current, condition)
+        ):
+            merged[key] = {**current, **condition}
+        else:
+            merged[key] = condition
+            narrowing = False
+    return merged, narrowing
+
+
+def _paths(delta: Dict[str, Any]) -> List[str]:
+    return sorted(referenced_paths({k: delta.get(k) for k in ("filter", "sort", "projection")}))
+
+
+def _projection_narrows(previous: Dict[str, Any], projection: Dict[str, Any]) -> bool:
+    """A follow-up projection that only keeps fields the previous rows have"""
+    if any(not value for key, value in projection.items() if key != "_id"):
+        return False
+    if any("." in key for key in projection):
+        return False
+    return not previous or all(not _projected_away(previous, key) for key in projection)
+
+
+def _projected_away(projection: Dict[str, Any], path: str) -> bool:
+    top = path.split(".")[0]
+    included = {k.split(".")[0] for k, v in projection.items() if v and k != "_id"}
+    if included:
+        return top not in included and top != "_id"
+    return any(not v and (k == path or path.startswith(k + ".")) for k, v in projection.items())
+
+
+def _is_aggregate(query_dict: Dict[str, Any]) -> bool:
+    return bool(query_dict.get("pipeline")) or query_dict.get("operation") == "aggregate"
+
+
+def _is_count(query_dict: Dict[str, Any]) -> bool:
+    return query_dict.get("operation") == "count"
+
+
+class Refiner:
+    """Applies follow-up questions as a delta on the previous query.
+
+    A delta is {"operation": "refine", "filter", "sort", "limit", "skip",
+    "projection", "count"} with only the keys that change; "filter" holds the
+    added conditions. When the delta only narrows a result that was fetched
+    in full, it is evaluated on those rows instead of querying MongoDB.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.follow_ups = 0
+        self.fast = 0
+        self.local = 0
+        self.mongodb = 0
+        self.new_questions = 0
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+        registry.inc("mongoquery_refinement_total", result=name)
+
+    def is_follow_up(self, question: str) -> bool:
+        return bool(FOLLOW_UP_RE.search(question))
+
+    def fast_delta(self, question: str, previous: Dict[str, Any], fast_path, profile):
+        """Parse a follow-up without the LLM when the rest reads as a simple question"""
+        if fast_path is None or _is_aggregate(previous["query_dict"]):
+            return None
+        words = [
+            w for w in _WORD_RE.findall(question) if w.strip(",.;:!?").lower() not in REFERENCE_WORDS
+        ]
+        parsed = fast_path.parse(" ".join(words), profile, follow_up=True)
+        if parsed is None:
+            return None
+        self._count("fast")
+        delta = {"operation": "refine", "filter": parsed.get("filter") or {}}
+        if parsed.get("operation") == "count":
+            delta["count"] = True
+        for key in ("sort", "limit"):
+            if parsed.get(key):
+                delta[key] = parsed[key]
+        return delta
+
+    def apply(self, previous_query: Dict[str, Any], delta: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """The refined query and whether it only narrows the previous result"""
+        base = {k: v for k, v in previous_query.items() if k not in _GUARD_KEYS}
+        added = delta.get("filter") or {}
+
+        if _is_aggregate(base):
+            # The delta describes the previous output rows, so it follows the whole pipeline
+            pipeline = list(base.get("pipeline") or [])
+            if base.get("skip", 0) > 0:
+                pipeline.append({"$skip": base["skip"]})
+            if base.get("limit", 0) > 0:
+                pipeline.append({"$limit": base["limit"]})
+            if added:
+                pipeline.append({"$match": added})
+            if delta.get("sort"):
+                pipeline.append({"$sort": delta["sort"]})
+            if delta.get("projection"):
+                pipeline.append({"$project": delta["projection"]})
+            if delta.get("count"):
+                pipeline.append({"$count": "count"})
+            query_dict = {
+                **base,
+                "operation": "aggregate",
+                "pipeline": pipeline,
+                "skip": delta.get("skip", 0),
+                "limit": delta.get("limit", 0),
+            }
+            return query_dict, True
+
+        filter_dict, narrowing = merge_filters(base.get("filter"), added)
+        if delta.get("count"):
+            query_dict = {"operation": "count", "filter": filter_dict}
+            if base.get("collection"):
+                query_dict["collection"] = base["collection"]
+            return query_dict, narrowing
+
+        query_dict = {
+            **base,
+            "filter": filter_dict,
+            "projection": delta.get("projection") or base.get("projection") or {},
+            "sort": delta.get("sort") or base.get("sort") or {},
+            "limit": delta.get("limit", base.get("limit", 0)),
+            "skip": delta.get("skip", base.get("skip", 0)),
+        }
+        query_dict.pop("operation", None)  # a refined count lists the documents
+        if delta.get("projection") and not _projection_narrows(
+            base.get("projection") or {}, delta["projection"]
+        ):
+            narrowing = False
+        return query_dict, narrowing
+
+    def _evaluate(self, previous, delta, profile):
+        """Rows (or a count) for the delta from the previous rows; None to ask MongoDB"""
+        results = previous.get("results")
+        query = previous["query_dict"]
+        if not previous.get("complete") or results is None or _is_count(query):
+            return None
+        if delta.get("skip") or query.get("skip"):
+            return None
+
+        paths = _paths(delta)
+        if not _is_aggregate(query):
+            # ObjectIds were turned into strings for display; unknown or
+            # projected-away fields are left to MongoDB and the guard
+            if any(p.split(".")[0] == "_id" for p in paths) or unknown_paths(delta, profile):
+                return None
+            projection = query.get("projection") or {}
+            if any(_projected_away(projection, p) for p in paths):
+                return None
+
+        try:
+            rows = [doc for doc in results if matches(doc, delta.get("filter") or {})]
+            if delta.get("count"):
+                return len(rows)
+            for path, direction in reversed(list((delta.get("sort") or {}).items())):
+                rows.sort(key=lambda doc, path=path: _sort_key(doc, path), reverse=direction < 0)
+            if delta.get("limit", 0) > 0:
+                rows = rows[: delta["limit"]]
+            if delta.get("projection"):
+                rows = [_project(doc, delta["projection"]) for doc in rows]
+        except (_Unsupported, TypeError, re.error):
+            return None
+        return rows
+
+    def refine(
+        self, previous: Dict[str, Any], delta: Dict[str, Any], profile=None
+    ) -> Tuple[Dict[str, Any], Optional[Any]]:
+        """Return (query_dict, local) where local is the answer when no query is needed.
+
+        A delta that isn't a refinement (the model judged it a new question)
+        comes back unchanged with no local answer.
+        """
+        self._count("follow_ups")
+        if delta.get("operation") != "refine":
+            self._count("new_questions")
+            return delta, None
+        query_dict, narrowing = self.apply(previous["query_dict"], delta)
+        local = self._evaluate(previous, delta, profile) if narrowing else None
+        self._count("mongodb" if local is None else "local")
+        return query_dict, local
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "follow_ups": self.follow_ups,
+                "fast_deltas": self.fast,
+                "new_questions": self.new_questions,
+                "answered_locally": self.local,
+                "sent_to_mongodb": self.mongodb,
+            }
+
+
+def fully_fetched(query_dict: Dict[str, Any], rows: int, has_more: bool) -> bool:
+    """Whether rows already shown are the query's whole result"""
+    if has_more or query_dict.get("skip", 0) > 0:
+        return False
+    limit = query_dict.get("limit", 0)
+    return limit <= 0 or rows < limit
+
+
+def refiner_from_env() -> Optional[Refiner]:
+    if os.getenv("REFINEMENT_ENABLED", "1").lower() in ("0", "false", "no"):
+        return None
+    return Refiner()
@@ -0,0 +1,153 @@
+import io
+import os
+import pickle
+from typing import TYPE_CHECKING, Dict, Any, List, Optional
+
+_arrow_modules = None
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+WINDOW_ROWS = int(os.getenv("RESULT_WINDOW_ROWS", "50"))
+
+
+def arrow():
+    """(pyarrow, pyarrow.parquet), imported on first use; (None, None) without pyarrow"""
+    global _arrow_modules
+    if _arrow_modules is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:  # pragma: no cover - streamlit normally ships pyarrow
+            _arrow_modules = (None, None)
+        else:
+            _arrow_modules = (pyarrow, pyarrow.parquet)
+    return _arrow_modules
+
+
+def keep_id(query_dict: Optional[Dict[str, Any]]) -> bool:
+    # In aggregate results _id is the group key; otherwise only when projected
+    if not query_dict:
+        return False
+    if query_dict.get("pipeline") or query_dict.get("operation") == "aggregate":
+        return True
+    return "_id" in (query_dict.get("projection") or {})
+
+
+def _flat_value(value):
+    if isinstance(value, list):
+        if value and all(isinstance(item, dict) for item in value):
+            # e.g. courses_completed -> "CSE 201, Calculus, A; CSE 301, ..."
+            return "; ".join(
+                ", ".join(str(v) for v in item.values()) for item in value
+            )
+        return ", ".join(str(item) for item in value)
+    if isinstance(value, dict):
+        return str(value)
+    return value
+
+
+def flatten_document(doc: Dict[str, Any], prefix: str = "", out=None) -> Dict[str, Any]:
+    """Nested sub-documents become dotted columns; arrays become one readable cell"""
+    out = {} if out is None else out
+    for key, value in doc.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and value:
+            flatten_document(value, name + ".", out)
+        else:
+            out[name] = _flat_value(value)
+    return out
+
+
+def flatten_results(results: List[Dict[str, Any]], query_dict=None) -> List[Dict[str, Any]]:
+    drop_id = not keep_id(query_dict)
+    rows = []
+    for doc in results:
+        row = flatten_document(doc)
+        if drop_id:
+            row.pop("_id", None)
+        rows.append(row)
+    return rows
+
+
+def _arrow_column(values):
+    pa, _ = arrow()
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        # Mixed types in one column (int and str, say) are rendered as text
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+
+class ResultTable:
+    """Flattened result set kept as a compact columnar buffer.
+
+    Rows are flattened once when the table is built; rendering only ever
+    materializes the visible window as a DataFrame.
+    """
+
+    def __init__(self, columns: List[str], data):
+        self.columns = columns
+        self._data = data  # pyarrow.Table, or a DataFrame when pyarrow is unavailable
+
+    @classmethod
+    def from_flat_rows(cls, rows: List[Dict[str, Any]]) -> "ResultTable":
+        columns = []
+        seen = set()
+        for row in rows:
+            for name in row:
+                if name not in seen:
+                    seen.add(name)
+                    columns.append(name)
+        pa, _ = arrow()
+        if pa is None:
+            import pandas as pd
+
+            return cls(columns, pd.DataFrame(rows, columns=columns))
+        arrays = [_arrow_column([row.get(name) for row in rows]) for name in columns]
+        return cls(columns, pa.Table.from_arrays(arrays, names=columns))
+
+    @classmethod
+    def from_results(cls, results: List[Dict[str, Any]], query_dict=None) -> "ResultTable":
+        return cls.from_flat_rows(flatten_results(results, query_dict))
+
+    @property
+    def num_rows(self) -> int:
+        return len(self._data) if arrow()[0] is None else self._data.num_rows
+
+    @property
+    def nbytes(self) -> int:
+        if arrow()[0] is not None:
+            return self._data.nbytes
+        return int(self._data.memory_usage(deep=True).sum())
+
+    def window(self, start: int = 0, size: int = WINDOW_ROWS) -> "pd.DataFrame":
+        if arrow()[0] is not None:
+            return self._data.slice(start, size).to_pandas()
+        return self._data.iloc[start : start + size]
+
+    def to_arrow(self):
+        return self._data
+
+    def to_bytes(self) -> bytes:
+        """Compressed Parquet bytes (pickled DataFrame without pyarrow)"""
+        buffer = io.BytesIO()
+        _, pq = arrow()
+        if pq is None:
+            pickle.dump(self._data, buffer)
+        else:
+            pq.write_table(self._data, buffer, compression="zstd")
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, payload: bytes) -> "ResultTable":
+        buffer = io.BytesIO(payload)
+        _, pq = arrow()
+        if pq is None:
+            data = pickle.load(buffer)
+            return cls(list(data.columns), data)
+        data = pq.read_table(buffer)
+        return cls(data.column_names, data)
+
+    def summary(self) -> str:
+        return f"{self.num_rows} rows × {len(self.columns)} columns"
@@ -0,0 +1,281 @@
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, Any, Optional
+
+from bson import ObjectId
+
+
+class FieldStats:
+    """Running statistics for one dotted field path"""
+
+    __slots__ = ("count", "types", "values", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.types = Counter()
+        # Distinct scalar values while the field is low-cardinality, None once it is not
+        self.values = set()
+        self.min = None
+        self.max = None
+
+    def add(self, value, max_distinct):
+        self.types[type(value).__name__] += 1
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+        if self.values is None or isinstance(value, (dict, list)):
+            return
+        if isinstance(value, str) and len(value) > 64:
+            self.values = None
+            return
+        if isinstance(value, (str, int, float, bool)):
+            self.values.add(value)
+            if len(self.values) > max_distinct:
+                self.values = None
+
+
+class SchemaProfile:
+    """Per-path type distributions, presence ratios and value sets of a collection"""
+
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+        self.fields: Dict[str, FieldStats] = {}
+        self.docs_seen = 0
+        self.sample_docs = []
+        self.last_id = None
+        self.updated_at = 0.0
+        self.truncated = False
+
+    def presence(self, path: str) -> float:
+        stats = self.fields.get(path)
+        if not stats or not self.docs_seen:
+            return 0.0
+        return min(stats.count / self.docs_seen, 1.0)
+
+    def dominant_type(self, path: str) -> Optional[str]:
+        stats = self.fields.get(path)
+        if not stats or not stats.types:
+            return None
+        return stats.types.most_common(1)[0][0]
+
+    def enum_values(self, path: str):
+        stats = self.fields.get(path)
+        if not stats or not stats.values:
+            return []
+        # A value set only counts as an enumeration once values repeat in the
+        # sample; wide numeric sets are better described by their range
+        if len(stats.values) >= sum(stats.types.values()):
+            return []
+        if stats.min is not None and len(stats.values) > 6:
+            return []
+        return sorted(stats.values, key=str)
+
+    def paths(self):
+        return sorted(self.fields)
+
+    def structure(self) -> Dict[str, Any]:
+        """Paths and their dominant types; unlike describe(), stable across samples"""
+        return {
+            "collection": self.collection_name,
+            "fields": {path: self.dominant_type(path) for path in self.paths()},
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            path: {
+                "types": dict(stats.types),
+                "presence": round(self.presence(path), 3),
+                "values": self.enum_values(path),
+                "min": stats.min,
+                "max": stats.max,
+            }
+            for path, stats in sorted(self.fields.items())
+        }
+
+    def describe_path(self, path: str) -> str:
+        stats = self.fields[path]
+        types = "|".join(t for t, _ in stats.types.most_common())
+        line = f"`{path}`: `{types}` ({self.presence(path):.0%})"
+        values = self.enum_values(path)
+        if values:
+            line += " values: " + ", ".join(str(v) for v in values)
+        elif stats.min is not None:
+            line += f" range: {stats.min} – {stats.max}"
+        return line
+
+    def describe(self) -> str:
+        """Markdown summary used both in the UI and as LLM context"""
+        info = f"\nCollection: {self.collection_name}\n\n"
+        info += f" Profiled from {self.docs_seen} sampled documents:\n"
+        for path in self.paths():
+            info += "- " + self.describe_path(path) + "\n"
+        if self.truncated:
+            info += "\n_Schema truncated to the most common paths._\n"
+        return info
+
+
+class SchemaProfiler:
+    """Samples collections with $sample and keeps a cached, periodically refreshed profile.
+
+    Cached profiles are never modified; a refresh builds a new one and
+    replaces it, so threads reading a profile never see it change. A refresh
+    (at most every refresh_seconds) is a bounded re-sample, not a merge: a new
+    $sample of sample_size documents plus up to max_new_documents inserted
+    since the last profile.
+
+    Work is bounded by the sample size, nesting depth, number of tracked paths,
+    distinct values per path and a server-side time limit, so profiling a
+    multi-million document collection costs about as much as a small one.
+    """
+
+    def __init__(
+        self,
+        sample_size: int = 200,
+        max_new_documents: int = 50,
+        refresh_seconds: float = 600,
+        max_depth: int = 5,
+        max_paths: int = 300,
+        max_distinct: int = 12,
+        max_time_ms: int = 2000,
+        keep_samples: int = 3,
+    ):
+        self.sample_size = sample_size
+        self.max_new_documents = max_new_documents
+        self.refresh_seconds = refresh_seconds
+        self.max_depth = max_depth
+        self.max_paths = max_paths
+        self.max_distinct = max_distinct
+        self.max_time_ms = max_time_ms
+        self.keep_samples = keep_samples
+        self._profiles: Dict[str, SchemaProfile] = {}
+        self._lock = threading.Lock()
+
+    def _sample(self, collection, size):
+        try:
+            return list(
+                collection.aggregate(
+                    [{"$sample": {"size": size}}], maxTimeMS=self.max_time_ms
+                )
+            )
+        except Exception:
+            # $sample unavailable (old server, views, stand-ins): fall back to a plain scan
+            return list(collection.find().limit(size).max_time_ms(self.max_time_ms))
+
+    def _new_documents(self, collection, last_id, size):
+        # Documents inserted since the last profile; only meaningful for ObjectId keys
+        if not isinstance(last_id, ObjectId):
+            return []
+        try:
+            cursor = (
+                collection.find({"_id": {"$gt": last_id}})
+                .sort("_id", 1)
+                .limit(size)
+                .max_time_ms(self.max_time_ms)
+            )
+            return list(cursor)
+        except Exception:
+            return []
+
+    def _walk(self, profile, value, path, depth, seen):
+        if depth > self.max_depth:
+            return
+        if isinstance(value, dict):
+            for key, child in value.items():
+                if not path and key == "_id":
+                    continue
+                self._walk(profile, child, f"{path}.{key}" if path else key, depth + 1, seen)
+            if not path:
+                return
+
+        stats = profile.fields.get(path)
+        if stats is None:
+            if len(profile.fields) >= self.max_paths:
+                profile.truncated = True
+                return
+            stats = profile.fields[path] = FieldStats()
+        if path not in seen:
+            stats.count += 1
+            seen.add(path)
+        stats.add(value, self.max_distinct)
+
+        # Array elements are profiled under the array's own path, the way MongoDB
+        # resolves "courses_completed.grade" against an array of sub-documents
+        if isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    for key, child in item.items():
+                        self._walk(profile, child, f"{path}.{key}", depth + 1, seen)
+                else:
+                    stats.add(item, self.max_distinct)
+
+    def _merge(self, profile, docs):
+        for doc in docs:
+            self._walk(profile, doc, "", 0, set())
+            profile.docs_seen += 1
+            doc_id = doc.get("_id")
+            if isinstance(doc_id, ObjectId) and (
+                profile.last_id is None or doc_id > profile.last_id
+            ):
+                profile.last_id = doc_id
+        if len(profile.sample_docs) < self.keep_samples:
+            for doc in docs[: self.keep_samples - len(profile.sample_docs)]:
+                sample = dict(doc)
+                if "_id" in sample:
+                    sample["_id"] = str(sample["_id"])
+                profile.sample_docs.append(sample)
+        profile.updated_at = time.time()
+
+    def profile(self, collection, force: bool = False) -> SchemaProfile:
+        key = collection.full_name
+        with self._lock:
+            current = self._profiles.get(key)
+
+        if current is not None and not force:
+            if time.time() - current.updated_at <= self.refresh_seconds:
+                return current
+            # Refresh: a fresh sample plus the newest inserts, so removed fields
+            # drop out; documents in both are counted once
+            docs = self._new_documents(collection, current.last_id, self.max_new_documents)
+            ids = {doc.get("_id") for doc in docs}
+            docs += [
+                doc
+                for doc in self._sample(collection, self.sample_size)
+                if doc.get("_id") not in ids
+            ]
+        else:
+            docs = self._sample(collection, self.sample_size)
+
+        # Built aside and swapped in: other threads keep reading the profile they hold
+        profile = SchemaProfile(collection.name)
+        self._merge(profile, docs)
+        if current is not None and current.last_id is not None and (
+            profile.last_id is None or current.last_id > profile.last_id
+        ):
+            profile.last_id = current.last_id
+        with self._lock:
+            self._profiles[key] = profile
+        return profile
+
+    def cached(self, collection) -> Optional[SchemaProfile]:
+        with self._lock:
+            return self._profiles.get(collection.full_name)
+
+    def invalidate(self, collection=None):
+        with self._lock:
+            if collection is None:
+                self._profiles.clear()
+            else:
+                self._profiles.pop(collection.full_name, None)
+
+
+def profiler_from_env() -> SchemaProfiler:
+    return SchemaProfiler(
+        sample_size=int(os.getenv("SCHEMA_SAMPLE_SIZE", "200")),
+        refresh_seconds=float(os.getenv("SCHEMA_REFRESH_SECONDS", "600")),
+        max_time_ms=int(os.getenv("SCHEMA_MAX_TIME_MS", "2000")),
+    )
+
+
+default_profiler = profiler_from_env()
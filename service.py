@@ -0,0 +1,445 @@
+"""Headless NL-to-MongoDB service: the same engine as the Streamlit app, without a browser.
+
+    python service.py --database University --collection Student serve --port 8600
+    python service.py --database University --collection Student batch questions.txt > out.ndjson
+
+HTTP endpoints (JSON in, JSON/NDJSON/Arrow out):
+
+    GET  /health
+    GET  /schema?collection=Student
+    POST /translate  {"question": "..."}
+    POST /query      {"question": "..."} or {"query": {...}}, optional "collection",
+                     "limit" and "format": "json" | "ndjson" | "arrow"
+    POST /count      {"filter": {...}, "collection": "..."}
+    POST /batch      {"questions": [...], "concurrency": 8} -> NDJSON, one line per
+                     question in completion order, each tagged with its "index"
+    POST /export     {"question": "..."} or {"query": {...}}, "format": "csv" | "ndjson" |
+                     "parquet"; the full result streamed from the cursor, no row limit
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Iterable, Iterator, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from dotenv import load_dotenv
+
+from catalog import DatabaseCatalog
+from executor import DB_TIMEOUT_SECONDS
+from fast_path import fast_path_from_env
+from exporter import EXPORT_CHUNK_ROWS, EXPORT_FORMATS, export_query, write_export
+from querying import (
+    DEFAULT_BATCH_SIZE,
+    count_documents,
+    is_count,
+    process_user_query,
+    remember_translation,
+    stream_mongodb,
+)
+from llm_router import router_from_env
+from metrics import registry, span, query_shape
+from mongo_pool import clients
+from query_cache import cache_from_env, count_cache_from_env, result_cache_from_env
+from query_guard import guard_from_env
+from rendering import ResultTable, arrow
+from schema_profiler import default_profiler
+from summaries import summaries_from_env
+
+DEFAULT_LIMIT = int(os.getenv("SERVICE_DEFAULT_LIMIT", "100"))
+BATCH_CONCURRENCY = int(os.getenv("SERVICE_BATCH_CONCURRENCY", "8"))
+
+
+def default_llm():
+    return router_from_env(os.getenv("GROQ_KEY"))
+
+
+def _dumps(value) -> str:
+    # ObjectIds and datetimes are sent as strings
+    return json.dumps(value, default=str)
+
+
+def batch_concurrency(value) -> Optional[int]:
+    """A client's requested /batch concurrency clamped to 1..BATCH_CONCURRENCY, None if not an integer"""
+    if value is None:
+        return BATCH_CONCURRENCY
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        return None
+    try:
+        return min(max(1, int(value)), BATCH_CONCURRENCY)
+    except ValueError:
+        return None
+
+
+class QueryService:
+    """Question -> query -> results, with the app's caches, guard and pools shared by all callers"""
+
+    def __init__(self, uri: str, database: str, collection: str, llm=None):
+        self.uri = uri
+        self.database_name = database
+        self.default_collection = collection
+        self.llm = llm
+        self.profiler = default_profiler
+        self.translation_cache = cache_from_env()
+        self.count_cache = count_cache_from_env()
+        self.result_cache = result_cache_from_env()
+        self.fast_path = fast_path_from_env()
+        self.guard = guard_from_env()
+        self.catalog = DatabaseCatalog(clients.client(uri)[database], self.profiler)
+        self.summaries = summaries_from_env(on_update=self.result_cache.invalidate)
+
+    def collection(self, name: Optional[str] = None):
+        return clients.collection(self.uri, self.database_name, name or self.default_collection)
+
+    def schema(self, name: Optional[str] = None) -> Dict[str, Any]:
+        collection = self.collection(name)
+        profile = self.profiler.profile(collection)
+        return {
+            "collection": collection.name,
+            "documents_sampled": profile.docs_seen,
+            "fields": profile.to_dict(),
+            "collections": self.catalog.names(),
+        }
+
+    def translate(self, question: str, name: Optional[str] = None) -> Dict[str, Any]:
+        return self._translate(question, name)[0]
+
+    def _translate(self, question: str, name: Optional[str] = None):
+        """The query, plus remember_translation's arguments when the LLM wrote it"""
+        collection = self.collection(name)
+        profile = self.profiler.profile(collection)
+        if self.fast_path is not None:
+            query_dict = self.fast_path.parse(question, profile)
+            if query_dict is not None:
+                return query_dict, None
+        if self.llm is None:
+            raise RuntimeError("No LLM configured for questions the fast path can't answer")
+        related = self.catalog.profiles(timeout=DB_TIMEOUT_SECONDS)
+        query_dict = process_user_query(
+            question,
+            self.llm,
+            schema_info=profile.describe(),
+            cache=self.translation_cache,
+            profile=profile,
+            related=related,
+        )
+        return query_dict, {"query_dict": query_dict, "profile": profile, "related": related}
+
+    def count(self, filter_dict=None, name: Optional[str] = None, user=None) -> Dict[str, Any]:
+        return self.execute({"operation": "count", "filter": filter_dict or {}}, name, user)
+
+    def _plan(self, query_dict: Dict[str, Any], name: Optional[str], user):
+        """Target collection, guarded query and notes; summaries are tried before the guard"""
+        collection = self.catalog.resolve(self.collection(name), query_dict)
+        profile, notes = self.profiler.profile(collection), []
+        self.summaries.observe(collection, query_dict)
+        routed = self.summaries.route(collection, query_dict)
+        if routed is not None:
+            collection, query_dict, note = routed
+            profile = None  # the rewrite only reads summarized fields
+            notes.append(note)
+        query_dict, guard_notes = self.guard.check(
+            collection,
+            query_dict,
+            profile=profile,
+            user=user,
+            collections=self.catalog.names(),
+        )
+        return collection, query_dict, notes + guard_notes
+
+    def execute(
+        self, query_dict: Dict[str, Any], name: Optional[str] = None, user=None, limit=None
+    ) -> Dict[str, Any]:
+        collection, query_dict, notes = self._plan(query_dict, name, user)
+        response = {"collection": collection.name, "query": query_dict, "notes": notes}
+        if is_count(query_dict):
+            count = count_documents(
+                collection,
+                query_dict.get("filter"),
+                cache=self.count_cache,
+                max_time_ms=query_dict.get("max_time_ms"),
+                summaries=self.summaries,
+            )
+            if isinstance(count, str):
+                raise RuntimeError(count)
+            response.update(type="count", count=count)
+            return response
+
+        if query_dict.get("limit", 0) <= 0:
+            query_dict = {**query_dict, "limit": limit or DEFAULT_LIMIT}
+            response["query"] = query_dict
+        response.update(type="results", results=self.fetch(collection, query_dict))
+        return response
+
+    def fetch(self, collection, query_dict: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # Same cache keys as query_mongodb, so the UI and the service warm each other
+        cache_key = self.result_cache.key(collection.full_name, query_dict)
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        with span("mongodb", shape=query_shape(query_dict)) as timing:
+            results = [
+                doc
+                for batch in stream_mongodb(collection, query_dict, DEFAULT_BATCH_SIZE)
+                for doc in batch
+            ]
+            timing.set(docs=len(results))
+        self.result_cache.put(cache_key, results)
+        return results
+
+    def plan_export(
+        self,
+        question: Optional[str] = None,
+        query_dict: Optional[Dict[str, Any]] = None,
+        name: Optional[str] = None,
+        user=None,
+    ):
+        """Translate and guard an export; returns the collection and query to stream"""
+        if query_dict is None:
+            query_dict = self.translate(question, name)
+        collection, query_dict, _ = self._plan(query_dict, name, user)
+        if is_count(query_dict):
+            raise ValueError("Count questions have nothing to export")
+        return collection, export_query(query_dict)
+
+    def export(self, collection, query_dict: Dict[str, Any], fmt: str, out) -> Dict[str, Any]:
+        """Stream every matching row to a binary stream without holding the result in memory"""
+        with span("export", format=fmt) as timing:
+            summary = write_export(
+                stream_mongodb(collection, query_dict, EXPORT_CHUNK_ROWS), fmt, out, query_dict
+            )
+            timing.set(docs=summary["rows"], bytes=summary["bytes"])
+        return summary
+
+    def answer(
+        self, question: str, name: Optional[str] = None, user=None, limit=None
+    ) -> Dict[str, Any]:
+        """Translate and run one question; errors are reported in the result, not raised"""
+        started = time.perf_counter()
+        result = {"question": question}
+        try:
+            query_dict, translated = self._translate(question, name)
+            result.update(self.execute(query_dict, name, user, limit))
+            if translated is not None:
+                found = result["count"] if result["type"] == "count" else result["results"]
+                remember_translation(question, result=found, **translated)
+        except Exception as e:
+            result["error"] = str(e)
+        result["seconds"] = round(time.perf_counter() - started, 4)
+        registry.inc("mongoquery_service_questions_total", error=str("error" in result).lower())
+        return result
+
+    def answer_many(
+        self,
+        questions: Iterable[str],
+        name: Optional[str] = None,
+        user=None,
+        limit=None,
+        concurrency: int = BATCH_CONCURRENCY,
+    ) -> Iterator[Dict[str, Any]]:
+        """Answer questions concurrently, yielding each result as soon as it is ready"""
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            futures = {
+                pool.submit(self.answer, question, name, user, limit): index
+                for index, question in enumerate(questions)
+            }
+            for future in as_completed(futures):
+                yield {"index": futures[future], **future.result()}
+
+
+def arrow_stream(results: List[Dict[str, Any]], query_dict=None) -> bytes:
+    """Results as an Arrow IPC stream, flattened the same way as the UI table"""
+    pa, _ = arrow()
+    table = ResultTable.from_results(results, query_dict).to_arrow()
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+class _ServiceHandler(BaseHTTPRequestHandler):
+    service: QueryService = None
+
+    def _user(self):
+        # Query budgets are charged per caller
+        return self.headers.get("X-User") or self.client_address[0]
+
+    def _send(self, status: int, body: bytes, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status: int, value):
+        self._send(status, _dumps(value).encode("utf-8"))
+
+    def _stream_ndjson(self, rows: Iterable[Dict[str, Any]]):
+        # No Content-Length: lines are flushed as they are produced and the
+        # connection closes at the end (HTTP/1.0)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for row in rows:
+            self.wfile.write((_dumps(row) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            if url.path == "/health":
+                self._json(200, {"ok": True})
+            elif url.path == "/schema":
+                self._json(200, self.service.schema(params.get("collection")))
+            else:
+                self._json(404, {"error": f"Unknown endpoint {url.path}"})
+        except Exception as e:
+            self._json(500, {"error": str(e)})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._json(400, {"error": "Request body must be JSON"})
+            return
+
+        service, user = self.service, self._user()
+        name, limit = body.get("collection"), body.get("limit")
+        try:
+            if path == "/translate":
+                self._json(200, {"query": service.translate(body["question"], name)})
+            elif path == "/count":
+                self._json(200, service.count(body.get("filter"), name, user))
+            elif path == "/batch":
+                self._batch(body, name, user, limit)
+            elif path == "/query":
+                self._query(body, name, user, limit)
+            elif path == "/export":
+                self._export(body, name, user)
+            else:
+                self._json(404, {"error": f"Unknown endpoint {path}"})
+        except KeyError as e:
+            self._json(400, {"error": f"Missing field {e}"})
+        except Exception as e:
+            self._json(500, {"error": str(e)})
+
+    def _batch(self, body, name, user, limit):
+        questions = body["questions"]
+        if not isinstance(questions, list) or not all(isinstance(q, str) for q in questions):
+            self._json(400, {"error": "questions must be a list of strings"})
+            return
+        concurrency = batch_concurrency(body.get("concurrency"))
+        if concurrency is None:
+            self._json(400, {"error": "concurrency must be an integer"})
+            return
+        self._stream_ndjson(
+            self.service.answer_many(questions, name, user, limit, concurrency=concurrency)
+        )
+
+    def _query(self, body, name, user, limit):
+        if "query" in body:
+            response = self.service.execute(body["query"], name, user, limit)
+        else:
+            response = self.service.answer(body["question"], name, user, limit)
+            if "error" in response:
+                self._json(422, response)
+                return
+
+        output = body.get("format", "json")
+        if output == "ndjson" and response["type"] == "results":
+            self._stream_ndjson(response["results"])
+        elif output == "arrow" and response["type"] == "results":
+            if arrow()[0] is None:
+                self._json(406, {"error": "pyarrow is not installed"})
+                return
+            self._send(
+                200,
+                arrow_stream(response["results"], response["query"]),
+                "application/vnd.apache.arrow.stream",
+            )
+        else:
+            self._json(200, response)
+
+    def _export(self, body, name, user):
+        fmt = body.get("format", "ndjson")
+        if fmt not in EXPORT_FORMATS:
+            self._json(400, {"error": f"Unknown export format '{fmt}'"})
+            return
+        collection, query_dict = self.service.plan_export(
+            body.get("question"), body.get("query"), name, user
+        )
+        # Streamed as it is read from the cursor; the connection closes at the end.
+        # Errors after the first byte can only be signalled by a truncated body.
+        self.send_response(200)
+        self.send_header("Content-Type", EXPORT_FORMATS[fmt][0])
+        self.end_headers()
+        self.service.export(collection, query_dict, fmt, self.wfile)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(service: QueryService, host: str = "127.0.0.1", port: int = 8600):
+    handler = type("ServiceHandler", (_ServiceHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def serve_in_thread(service: QueryService, host: str = "127.0.0.1", port: int = 8600):
+    server = make_server(service, host, port)
+    thread = threading.Thread(target=server.serve_forever, name="service", daemon=True)
+    thread.start()
+    return server
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uri", default=os.getenv("MONGODB_CONNECTION_STRING"))
+    parser.add_argument("--database", required=True)
+    parser.add_argument("--collection", required=True)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="run the HTTP API")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8600)
+
+    batch = commands.add_parser("batch", help="answer questions from a file, one per line")
+    batch.add_argument("input", help="question file, or - for stdin")
+    batch.add_argument("--output", default="-", help="NDJSON output file, or - for stdout")
+    batch.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    batch.add_argument("--limit", type=int, default=None)
+    return parser.parse_args()
+
+
+def main():
+    load_dotenv()
+    args = parse_args()
+    service = QueryService(args.uri, args.database, args.collection, llm=default_llm())
+
+    if args.command == "serve":
+        server = make_server(service, args.host, args.port)
+        print(f"Serving on http://{args.host}:{args.port}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    source = sys.stdin if args.input == "-" else open(args.input)
+    with source:
+        questions = [line.strip() for line in source if line.strip()]
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    with out:
+        for row in service.answer_many(questions, limit=args.limit, concurrency=args.concurrency):
+            out.write(_dumps(row) + "\n")
+            out.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import json
+from typing import Dict, Any, List, Tuple
+
+
+class JSONObjectScanner:
+    """Incrementally scans streamed text for the first top-level JSON object.
+
+    feed() returns each top-level key/value pair as soon as its value is
+    complete, so callers can act on "filter" before the model has finished
+    writing "sort" or "limit". Once the object closes, `closed` is set and
+    any further text (explanations, markdown fences) is ignored.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.closed = False
+        self.completed: Dict[str, Any] = {}
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._pair_start = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        pairs = []
+        for char in chunk:
+            if self.closed:
+                break
+            if self._pair_start is None:
+                # Skip anything before the object, e.g. "```json" or "Here is the query:"
+                if char == "{":
+                    self.text = "{"
+                    self._depth = 1
+                    self._pair_start = 1
+                continue
+
+            self.text += char
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete_pair(len(self.text) - 1, pairs)
+                    self.closed = True
+            elif char == "," and self._depth == 1:
+                self._complete_pair(len(self.text) - 1, pairs)
+        return pairs
+
+    def _complete_pair(self, end: int, pairs):
+        raw = self.text[self._pair_start : end].strip()
+        self._pair_start = end + 1
+        if not raw:
+            return
+        try:
+            pair = json.loads("{" + raw + "}")
+        except ValueError:
+            return
+        for key, value in pair.items():
+            self.completed[key] = value
+            pairs.append((key, value))
+
+    def result(self) -> Dict[str, Any]:
+        """The parsed object; raises ValueError if it never closed or is not valid JSON"""
+        if not self.closed:
+            raise ValueError("JSON object was not closed")
+        return json.loads(self.text)
@@ -0,0 +1,633 @@
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, Any, List, Optional
+
+from bson import ObjectId
+
+from metrics import registry, span
+
+# Summary collections live next to their source and are hidden from the catalog
+SUMMARY_PREFIX = "summary."
+ACCUMULATORS = ("$sum", "$avg", "$min", "$max")
+
+
+def summary_name(collection_name: str, group_by: str) -> str:
+    return f"{SUMMARY_PREFIX}{collection_name}.{group_by}"
+
+
+def _key(field: str) -> str:
+    # Output names can't contain dots; "grades.score" is stored as "grades__score_sum"
+    return field.replace(".", "__")
+
+
+def _get_path(doc, path: str):
+    for part in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _group_stage(group_by: str, fields: List[str]) -> Dict[str, Any]:
+    group = {"_id": f"${group_by}", "count": {"$sum": 1}}
+    for field in fields:
+        key = _key(field)
+        group[f"{key}_sum"] = {"$sum": f"${field}"}
+        group[f"{key}_n"] = {"$sum": {"$cond": [{"$isNumber": f"${field}"}, 1, 0]}}
+        group[f"{key}_min"] = {"$min": f"${field}"}
+        group[f"{key}_max"] = {"$max": f"${field}"}
+    return {"$group": group}
+
+
+def _grouped_field(stage) -> Optional[str]:
+    # Only single-field groups ("_id": "$major") can be served from a summary
+    group = stage.get("$group") if isinstance(stage, dict) else None
+    if not isinstance(group, dict):
+        return None
+    group_id = group.get("_id")
+    if isinstance(group_id, str) and group_id.startswith("$") and not group_id.startswith("$$"):
+        return group_id[1:]
+    return None
+
+
+def _accumulated_fields(group: Dict[str, Any]) -> Optional[List[str]]:
+    """Fields a $group accumulates, or None if it uses anything a summary can't rebuild"""
+    fields = []
+    for name, accumulator in group.items():
+        if name == "_id":
+            continue
+        if accumulator in ({"$sum": 1}, {"$count": {}}):
+            continue
+        if not isinstance(accumulator, dict) or len(accumulator) != 1:
+            return None
+        (operator, argument), = accumulator.items()
+        if operator not in ACCUMULATORS or not isinstance(argument, str) or not argument.startswith("$"):
+            return None
+        fields.append(argument[1:])
+    return fields
+
+
+def _expression(accumulator) -> Any:
+    """The summary-document expression equal to one $group accumulator"""
+    if accumulator in ({"$sum": 1}, {"$count": {}}):
+        return "$count"
+    (operator, argument), = accumulator.items()
+    key = _key(argument[1:])
+    if operator == "$avg":
+        # $avg ignores non-numeric values and is null when there are none
+        return {
+            "$cond": [
+                {"$gt": [f"${key}_n", 0]},
+                {"$divide": [f"${key}_sum", f"${key}_n"]},
+                None,
+            ]
+        }
+    return f"${key}_{operator[1:]}"
+
+
+def _group_condition(filter_dict: Dict[str, Any], group_by: str):
+    """The condition on the group key if the filter only constrains the group key"""
+    if set(filter_dict) != {group_by}:
+        return None
+    condition = filter_dict[group_by]
+    if isinstance(condition, dict):
+        if not set(condition) <= {"$eq", "$in", "$ne", "$nin"}:
+            return None
+    return condition
+
+
+class MaterializedSummary:
+    """Count, sum, numeric count, min and max per value of one field, kept in a collection.
+
+    rebuild() recomputes everything server-side with $group + $out. Inserts
+    are folded in with $inc/$min/$max; other writes recompute only the groups
+    they touch. A write whose old group is unknown (a delete without
+    pre-images) marks the summary stale until the next rebuild.
+
+    Change events are ordered against built_operation_time, the server's
+    operation time for the $out, never against the local clock.
+    """
+
+    def __init__(self, source, group_by: str, fields: List[str]):
+        self.source = source
+        self.group_by = group_by
+        self.fields = list(dict.fromkeys(fields))
+        self.name = summary_name(source.name, group_by)
+        self.target = source.database[self.name]
+        self.built_at = None
+        self.built_operation_time = None
+        self.updated_at = None
+        self.last_id = None
+        self.stale = False
+        self.error = None
+        self.hits = 0
+        self.dirty = set()
+        # (estimated source count, summary total, summary total - exact source count)
+        # when the summary was last known to match; see check_drift()
+        self._counts = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.built_at is not None
+
+    def _latest_id(self):
+        latest = next(self.source.find({}, {"_id": 1}).sort("_id", -1).limit(1), None)
+        return latest["_id"] if latest else None
+
+    def _aggregate_out(self):
+        """Run the $group + $out; returns its server operation time (None if unknown)"""
+        pipeline = [_group_stage(self.group_by, self.fields), {"$out": self.name}]
+        try:
+            session = self.source.database.client.start_session()
+        except Exception:  # stand-ins without sessions
+            self.source.aggregate(pipeline, allowDiskUse=True)
+            return None
+        with session:
+            self.source.aggregate(pipeline, allowDiskUse=True, session=session)
+            return session.operation_time
+
+    def rebuild(self):
+        with span("summary", summary=self.name, step="rebuild"):
+            before = self._latest_id()
+            operation_time = self._aggregate_out()
+        with self._lock:
+            self.built_at = self.updated_at = time.time()
+            self.built_operation_time = operation_time
+            self.last_id = before
+            self.stale = False
+            self.error = None
+            self._counts = None
+        # Inserted while $out ran: maybe counted already, so recompute rather than $inc
+        if isinstance(before, ObjectId):
+            late = list(self.source.find({"_id": {"$gt": before}}, {self.group_by: 1}))
+            if late:
+                self.refresh_groups({_get_path(doc, self.group_by) for doc in late})
+                self.last_id = max(doc["_id"] for doc in late)
+
+    def refresh_groups(self, values):
+        """Recompute the given groups from the source; idempotent, so safe to repeat"""
+        values = list(values)
+        if not values:
+            return
+        with span("summary", summary=self.name, step="refresh", groups=len(values)):
+            rows = {
+                row["_id"]: row
+                for row in self.source.aggregate(
+                    [
+                        {"$match": {self.group_by: {"$in": values}}},
+                        _group_stage(self.group_by, self.fields),
+                    ]
+                )
+            }
+            for value in values:
+                if value in rows:
+                    self.target.replace_one({"_id": value}, rows[value], upsert=True)
+                else:
+                    self.target.delete_one({"_id": value})
+        self.updated_at = time.time()
+
+    def apply_inserts(self, docs):
+        """Fold new documents in with $inc/$min/$max, aggregated per group first"""
+        updates: Dict[Any, Dict[str, Dict[str, Any]]] = {}
+        for doc in docs:
+            group = _get_path(doc, self.group_by)
+            if isinstance(group, (dict, list)):
+                self.stale = True  # array/document group keys: left to the next rebuild
+                continue
+            update = updates.setdefault(group, {"$inc": {"count": 0}, "$min": {}, "$max": {}})
+            update["$inc"]["count"] += 1
+            for field in self.fields:
+                key, value = _key(field), _get_path(doc, field)
+                numeric = _is_number(value)
+                update["$inc"][f"{key}_sum"] = update["$inc"].get(f"{key}_sum", 0) + (value if numeric else 0)
+                update["$inc"][f"{key}_n"] = update["$inc"].get(f"{key}_n", 0) + (1 if numeric else 0)
+                if value is not None:
+                    for bound, better in (("min", min), ("max", max)):
+                        current = update[f"${bound}"].get(f"{key}_{bound}")
+                        try:
+                            update[f"${bound}"][f"{key}_{bound}"] = (
+                                value if current is None else better(current, value)
+                            )
+                        except TypeError:
+                            # Mixed types compare in BSON order; let the server decide
+                            self.dirty.add(group)
+        if not updates:
+            return
+        # One upsert per group touched; a batch rarely touches more than a handful
+        with span("summary", summary=self.name, step="apply", docs=len(docs)):
+            for group, update in updates.items():
+                self.target.update_one(
+                    {"_id": group}, {op: body for op, body in update.items() if body}, upsert=True
+                )
+        self.updated_at = time.time()
+
+    def delta_scan(self, batch_size: int = 5000) -> int:
+        """Fold in documents inserted since the last scan (ObjectId keys only)"""
+        if not isinstance(self.last_id, ObjectId):
+            return 0
+        docs = list(
+            self.source.find({"_id": {"$gt": self.last_id}}).sort("_id", 1).limit(batch_size)
+        )
+        if docs:
+            self.apply_inserts(docs)
+            self.last_id = docs[-1]["_id"]
+        self.flush()
+        return len(docs)
+
+    def _total(self) -> int:
+        rows = list(self.target.aggregate([{"$group": {"_id": None, "n": {"$sum": "$count"}}}]))
+        return rows[0]["n"] if rows else 0
+
+    def _exact_count(self) -> int:
+        # Documents up to the last folded-in _id; later inserts are the next scan's
+        if isinstance(self.last_id, ObjectId):
+            return self.source.count_documents({"_id": {"$lte": self.last_id}})
+        return self.source.count_documents({})
+
+    def check_drift(self) -> bool:
+        """Mark the summary stale if the source lost documents the scans can't see.
+
+        A delta scan only sees inserts with ObjectId keys. The cheap check is
+        the estimated count, which is approximate and can lag. If it moved by
+        anything other than what the scans folded in, an exact count of the
+        documents up to the last scanned _id decides. The first call after a
+        rebuild records the baseline.
+        """
+        estimated, total = self.source.estimated_document_count(), self._total()
+        if self._counts is None:
+            self._counts = (estimated, total, total - self._exact_count())
+            return self.stale
+        last_estimated, last_total, offset = self._counts
+        if estimated - last_estimated == total - last_total:
+            return self.stale
+        if total - self._exact_count() != offset:
+            self.stale = True
+        else:
+            # New inserts not scanned yet, or a lagging estimate: still in step
+            self._counts = (estimated, total, offset)
+        return self.stale
+
+    def is_live(self, event: Dict[str, Any]) -> bool:
+        """True if the event happened after the last rebuild's $out, so it isn't counted yet"""
+        event_time = event.get("clusterTime")
+        if self.built_operation_time is None or event_time is None:
+            return False  # unknown order: recompute the groups instead of $inc
+        return event_time > self.built_operation_time
+
+    def touches(self, fields, watched=None) -> bool:
+        watched = watched or [self.group_by, *self.fields]
+        return any(
+            f == w or f.startswith(w + ".") or w.startswith(f + ".") for f in fields for w in watched
+        )
+
+    def apply_change(self, event: Dict[str, Any], live: bool = True):
+        """Apply one change-stream event; `live` is False for events the last rebuild may include"""
+        operation = event.get("operationType")
+        after = event.get("fullDocument")
+        before = event.get("fullDocumentBeforeChange")
+        if operation == "insert" and after is not None:
+            if live:
+                self.apply_inserts([after])
+            else:
+                self.dirty.add(_get_path(after, self.group_by))
+            return
+        if operation in ("update", "replace", "delete"):
+            moved = True  # a replace or delete may take the document out of its group
+            if operation == "update":
+                description = event.get("updateDescription") or {}
+                changed = list(description.get("updatedFields", {})) + list(
+                    description.get("removedFields", [])
+                )
+                if not self.touches(changed):
+                    return
+                moved = self.touches(changed, [self.group_by])
+            if after is not None:
+                self.dirty.add(_get_path(after, self.group_by))
+            if before is not None:
+                self.dirty.add(_get_path(before, self.group_by))
+            elif moved:
+                # Without pre-images the group the document left is unknown
+                self.stale = True
+            return
+        if operation in ("drop", "rename", "dropDatabase", "invalidate"):
+            self.stale = True
+
+    def flush(self):
+        with self._lock:
+            dirty, self.dirty = self.dirty, set()
+        self.refresh_groups(dirty)
+
+    def answer_pipeline(self, pipeline: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        """The same pipeline over the summary collection, or None if it needs the raw documents"""
+        stages = list(pipeline)
+        condition = None
+        if stages and "$match" in stages[0]:
+            condition = _group_condition(stages[0]["$match"], self.group_by)
+            if condition is None:
+                return None
+            stages = stages[1:]
+        if not stages or _grouped_field(stages[0]) != self.group_by:
+            return None
+        group = stages[0]["$group"]
+        fields = _accumulated_fields(group)
+        if fields is None or not set(fields) <= set(self.fields):
+            return None
+        projection = {"_id": 1}
+        projection.update({name: _expression(acc) for name, acc in group.items() if name != "_id"})
+        rewritten = [{"$project": projection}, *stages[1:]]
+        if condition is not None:
+            rewritten.insert(0, {"$match": {"_id": condition}})
+        return rewritten
+
+    def count(self, filter_dict: Dict[str, Any]) -> Optional[int]:
+        condition = _group_condition(filter_dict, self.group_by)
+        if condition is None:
+            return None
+        rows = list(
+            self.target.aggregate(
+                [{"$match": {"_id": condition}}, {"$group": {"_id": None, "n": {"$sum": "$count"}}}]
+            )
+        )
+        return rows[0]["n"] if rows else 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "group_by": self.group_by,
+            "fields": self.fields,
+            "groups": self.target.estimated_document_count() if self.ready else 0,
+            "ready": self.ready,
+            "stale": self.stale,
+            "updated_seconds_ago": None if self.updated_at is None else time.time() - self.updated_at,
+            "hits": self.hits,
+            "error": self.error,
+        }
+
+
+class SummaryMaintainer:
+    """Keeps one source collection's summaries current in a background thread.
+
+    Uses a change stream when the server supports it (replica set or
+    sharded cluster); otherwise scans for new _ids every delta_seconds and
+    rebuilds every rebuild_seconds to pick up updates. A scan that finds
+    the document count off (deletes, non-ObjectId inserts) marks the
+    summary stale, so queries go to the source until it is rebuilt.
+    """
+
+    def __init__(self, source, delta_seconds: float = 30, rebuild_seconds: float = 3600, on_update=None):
+        self.source = source
+        self.delta_seconds = delta_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self.on_update = on_update
+        self.summaries: Dict[str, MaterializedSummary] = {}
+        self.mode = "starting"
+        self.error = None
+        self._closed = threading.Event()
+        self._added = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name=f"summaries-{source.full_name}", daemon=True
+        )
+        self._thread.start()
+
+    def add(self, summary: MaterializedSummary):
+        with self._lock:
+            self.summaries[summary.group_by] = summary
+        self._added.set()
+
+    def _current(self) -> List[MaterializedSummary]:
+        with self._lock:
+            return list(self.summaries.values())
+
+    def _rebuild(self, summary: MaterializedSummary):
+        try:
+            summary.rebuild()
+        except Exception as e:
+            summary.error = str(e)
+        self._updated(summary)
+
+    def _updated(self, summary: MaterializedSummary):
+        if self.on_update is not None:
+            self.on_update(summary.target.full_name)
+
+    def _run(self):
+        try:
+            self._watch()
+        except Exception as e:
+            # Standalone servers and stand-ins have no change streams
+            self.error = str(e)
+        if not self._closed.is_set():
+            self._poll()
+
+    def _watch(self):
+        options = {"full_document": "updateLookup", "max_await_time_ms": 1000}
+        try:
+            stream = self.source.watch(full_document_before_change="whenAvailable", **options)
+        except TypeError:
+            stream = self.source.watch(**options)  # pymongo without pre-image support
+        with stream:
+            self.mode = "change stream"
+            built = {}
+            while not self._closed.is_set():
+                for summary in self._current():
+                    # New summaries are built once; stale ones at most every delta_seconds
+                    if built.get(summary.group_by) is not summary or (
+                        summary.stale and time.time() - (summary.built_at or 0) >= self.delta_seconds
+                    ):
+                        self._rebuild(summary)
+                        built[summary.group_by] = summary
+                event = stream.try_next()
+                if event is not None:
+                    for summary in self._current():
+                        # Events from before the rebuild finished may already be counted
+                        live = summary.is_live(event)
+                        summary.apply_change(event, live=live)
+                        if live and event.get("operationType") == "insert":
+                            self._updated(summary)
+                    continue
+                for summary in self._current():
+                    if summary.dirty:
+                        summary.flush()
+                        self._updated(summary)
+
+    def _poll(self):
+        self.mode = "delta scan"
+        while not self._closed.is_set():
+            for summary in self._current():
+                if (
+                    not summary.ready
+                    or summary.stale
+                    or time.time() - summary.built_at >= self.rebuild_seconds
+                ):
+                    self._rebuild(summary)
+                    try:
+                        summary.check_drift()  # the baseline later scans compare with
+                    except Exception as e:
+                        summary.error = str(e)
+                    continue
+                try:
+                    if summary.delta_scan():
+                        self._updated(summary)
+                    summary.check_drift()
+                except Exception as e:
+                    summary.error = str(e)
+                    summary.stale = True
+            self._added.wait(self.delta_seconds)
+            self._added.clear()
+
+    def close(self):
+        self._closed.set()
+        self._added.set()
+
+
+class SummaryStore:
+    """Materialized group-by summaries and the router that answers matching queries from them.
+
+    Summaries come from SUMMARY_SPECS or, with auto_create_after, from
+    $group shapes that keep recurring. route() rewrites a matching
+    aggregate to read the summary collection; count() answers counts
+    filtered only on a summarized group key.
+    """
+
+    def __init__(
+        self,
+        specs: Optional[Dict[str, Dict[str, List[str]]]] = None,
+        auto_create_after: int = 0,
+        delta_seconds: float = 30,
+        rebuild_seconds: float = 3600,
+        on_update=None,
+    ):
+        self.specs = specs or {}
+        self.auto_create_after = auto_create_after
+        self.delta_seconds = delta_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self.on_update = on_update
+        self.shape_counts: Counter = Counter()
+        self._maintainers: Dict[str, SummaryMaintainer] = {}
+        self._lock = threading.Lock()
+
+    def _maintainer(self, collection) -> SummaryMaintainer:
+        with self._lock:
+            maintainer = self._maintainers.get(collection.full_name)
+            if maintainer is None:
+                maintainer = SummaryMaintainer(
+                    collection, self.delta_seconds, self.rebuild_seconds, self.on_update
+                )
+                self._maintainers[collection.full_name] = maintainer
+        return maintainer
+
+    def attach(self, collection):
+        """Start maintaining the configured summaries of a collection (idempotent)"""
+        for group_by, fields in self.specs.get(collection.name, {}).items():
+            self.ensure(collection, group_by, fields)
+
+    def ensure(self, collection, group_by: str, fields: List[str]) -> MaterializedSummary:
+        maintainer = self._maintainer(collection)
+        existing = maintainer.summaries.get(group_by)
+        if existing is not None and set(fields) <= set(existing.fields):
+            return existing
+        # A wider summary replaces the old one; it is rebuilt in the background
+        summary = MaterializedSummary(collection, group_by, (existing.fields if existing else []) + list(fields))
+        maintainer.add(summary)
+        return summary
+
+    def _summaries(self, collection) -> List[MaterializedSummary]:
+        with self._lock:
+            maintainer = self._maintainers.get(collection.full_name)
+        return [s for s in maintainer._current() if s.ready] if maintainer else []
+
+    def observe(self, collection, query_dict: Dict[str, Any]):
+        """Count recurring $group shapes; create a summary once one recurs often enough"""
+        if not self.auto_create_after or collection.name.startswith(SUMMARY_PREFIX):
+            return
+        stages = [s for s in query_dict.get("pipeline") or [] if isinstance(s, dict)]
+        if stages and "$match" in stages[0]:
+            stages = stages[1:]
+        group_by = _grouped_field(stages[0]) if stages else None
+        fields = _accumulated_fields(stages[0]["$group"]) if group_by else None
+        if fields is None:
+            return
+        key = (collection.full_name, group_by, tuple(sorted(set(fields))))
+        with self._lock:
+            self.shape_counts[key] += 1
+            due = self.shape_counts[key] == self.auto_create_after
+        if due:
+            self.ensure(collection, group_by, sorted(set(fields)))
+
+    def route(self, collection, query_dict: Dict[str, Any]):
+        """(summary collection, rewritten query, note) if a summary can answer, else None"""
+        self.attach(collection)
+        if not query_dict.get("pipeline"):
+            return None
+        for summary in self._summaries(collection):
+            if summary.stale:
+                continue
+            pipeline = summary.answer_pipeline(query_dict["pipeline"])
+            if pipeline is None:
+                continue
+            summary.hits += 1
+            registry.inc("mongoquery_summary_total", summary=summary.name, result="hit")
+            routed = {key: value for key, value in query_dict.items() if key != "collection"}
+            routed.update(operation="aggregate", pipeline=pipeline, collection=summary.name)
+            age = time.time() - summary.updated_at
+            note = f"Answered from summary `{summary.name}` (updated {age:.0f}s ago)."
+            if self._maintainers[collection.full_name].mode == "delta scan":
+                # Without a change stream, edits to existing documents wait for a rebuild
+                rebuilt = time.time() - summary.built_at
+                note += f" Edits made since the last full rebuild ({rebuilt:.0f}s ago) are not included."
+            return summary.target, routed, note
+        return None
+
+    def count(self, collection, filter_dict: Dict[str, Any]) -> Optional[int]:
+        self.attach(collection)
+        for summary in self._summaries(collection):
+            if summary.stale:
+                continue
+            count = summary.count(filter_dict or {})
+            if count is not None:
+                summary.hits += 1
+                registry.inc("mongoquery_summary_total", summary=summary.name, result="hit")
+                return count
+        return None
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            maintainers = list(self._maintainers.values())
+        return {
+            summary.name: {**summary.stats(), "mode": maintainer.mode}
+            for maintainer in maintainers
+            for summary in maintainer._current()
+        }
+
+    def close(self):
+        with self._lock:
+            for maintainer in self._maintainers.values():
+                maintainer.close()
+
+
+def _parse_specs(value: str) -> Dict[str, Dict[str, List[str]]]:
+    # "Student:major=gpa,credits_taken;Student:enrollment_year"
+    specs: Dict[str, Dict[str, List[str]]] = {}
+    for item in filter(None, (part.strip() for part in value.split(";"))):
+        target, _, fields = item.partition("=")
+        collection, _, group_by = target.partition(":")
+        specs.setdefault(collection.strip(), {})[group_by.strip()] = [
+            f.strip() for f in fields.split(",") if f.strip()
+        ]
+    return specs
+
+
+def summaries_from_env(on_update=None) -> SummaryStore:
+    return SummaryStore(
+        specs=_parse_specs(os.getenv("SUMMARY_SPECS", "")),
+        auto_create_after=int(os.getenv("SUMMARY_AUTO_CREATE_AFTER", "0")),
+        delta_seconds=float(os.getenv("SUMMARY_DELTA_SECONDS", "30")),
+        rebuild_seconds=float(os.getenv("SUMMARY_REBUILD_SECONDS", "3600")),
+        on_update=on_update,
+    )
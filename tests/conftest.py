@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules live flat at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGODB_CONNECTION_STRING", "mongodb://localhost:1/?serverSelectionTimeoutMS=1")
+os.environ.setdefault("GROQ_KEY", "test")
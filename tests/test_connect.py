@@ -0,0 +1,18 @@
+import pytest
+
+from connect import uses_tls
+
+
+@pytest.mark.parametrize(
+    "uri, expected",
+    [
+        ("mongodb+srv://u:p@cluster0.example.net/", True),
+        ("mongodb+srv://u:p@cluster0.example.net/?tls=false", False),
+        ("mongodb://db1.example.net:27017,db2.example.net:27017/?replicaSet=rs0&tls=true", True),
+        ("mongodb://db1.example.net:27017/?ssl=true", True),
+        ("mongodb://localhost:27017", False),
+        ("mongodb://localhost:27017/?retryWrites=true", False),
+    ],
+)
+def test_uses_tls(uri, expected):
+    assert uses_tls(uri) is expected
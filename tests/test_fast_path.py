@@ -0,0 +1,67 @@
+import mongomock
+import pytest
+
+from fast_path import FastPathParser
+from schema_profiler import SchemaProfiler
+
+MAJORS = ["Computer Science", "Mathematics", "Physics"]
+
+
+@pytest.fixture(scope="module")
+def profile():
+    collection = mongomock.MongoClient()["University"]["Student"]
+    collection.insert_many(
+        [
+            {"name": f"s{i}", "gpa": round(2 + (i % 20) / 10, 1), "major": MAJORS[i % 3]}
+            for i in range(60)
+        ]
+    )
+    return SchemaProfiler().profile(collection)
+
+
+@pytest.fixture
+def parser():
+    return FastPathParser()
+
+
+@pytest.mark.parametrize(
+    "question", ["the student with the highest gpa", "which student has the highest gpa"]
+)
+def test_singular_superlative_returns_one_row(parser, profile, question):
+    query_dict = parser.parse(question, profile)
+    assert query_dict["sort"] == {"gpa": -1}
+    assert query_dict["limit"] == 1
+
+
+def test_plural_superlative_ranks_all(parser, profile):
+    query_dict = parser.parse("students with the lowest gpa", profile)
+    assert query_dict["sort"] == {"gpa": 1}
+    assert query_dict["limit"] == 0
+
+
+def test_explicit_limit_wins(parser, profile):
+    assert parser.parse("top 5 students by gpa", profile)["limit"] == 5
+
+
+def test_bare_superlative_falls_back(parser, profile):
+    assert parser.parse("highest gpa", profile) is None
+
+
+def test_filters_and_counts(parser, profile):
+    assert parser.parse("students with gpa above 3.5", profile)["filter"] == {
+        "gpa": {"$gt": 3.5}
+    }
+    assert parser.parse("how many Physics students", profile) == {
+        "operation": "count",
+        "filter": {"major": "Physics"},
+    }
+    assert parser.parse("students whose major is not Physics", profile) is None
+
+
+def test_follow_ups_are_counted_apart(parser, profile):
+    parser.parse("students with gpa above 3.5", profile)
+    parser.parse("the Physics ones", profile, follow_up=True)
+    parser.parse("whatever that means", profile, follow_up=True)
+    stats = parser.stats()
+    assert (stats["hits"], stats["fallbacks"]) == (1, 0)
+    assert (stats["follow_up_hits"], stats["follow_up_fallbacks"]) == (1, 1)
@@ -0,0 +1,41 @@
+from langchain_core.messages import AIMessageChunk, HumanMessage, SystemMessage
+from langchain_core.outputs import ChatGenerationChunk
+
+from llm_router import Backend, LLMRouter
+from local_llm import LocalChatModel
+
+MESSAGES = [SystemMessage(content="Return a MongoDB query."), HumanMessage(content="top students")]
+ANSWER = {"filter": {}, "sort": {"gpa": -1}, "limit": 5}
+
+
+class UsageReportingModel(LocalChatModel):
+    """Reports token usage on its last chunk, as langchain-groq does when streaming"""
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        chunks = list(super()._stream(messages, stop, run_manager, **kwargs))
+        for chunk in chunks[:-1]:
+            yield chunk
+        yield ChatGenerationChunk(
+            message=AIMessageChunk(
+                content=chunks[-1].message.content,
+                response_metadata={"token_usage": {"prompt_tokens": 40, "completion_tokens": 10}},
+            )
+        )
+
+
+def test_reported_usage_is_summed():
+    backend = Backend("groq", UsageReportingModel(default_answer=ANSWER))
+    query_dict, usage, name = LLMRouter([backend]).complete(MESSAGES)
+    assert query_dict == ANSWER and name == "groq"
+    assert usage == {"prompt_tokens": 40, "completion_tokens": 10, "total_tokens": 50}
+    assert backend.stats()["errors"] == 0
+
+
+def test_invalid_json_is_retried_with_reported_usage():
+    model = UsageReportingModel(default_answer=ANSWER, invalid_json_rate=1.0)
+    backend = Backend("groq", model)
+    query_dict, usage, _ = LLMRouter([backend], json_retries=1).complete(MESSAGES)
+    assert query_dict == ANSWER
+    # Both the rejected answer and the correction are counted
+    assert usage == {"prompt_tokens": 80, "completion_tokens": 20, "total_tokens": 100}
+    assert backend.stats()["json_retries"] == 1
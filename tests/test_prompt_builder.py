@@ -0,0 +1,48 @@
+import mongomock
+import pytest
+
+from connect import UniversityDB
+from local_llm import LocalChatModel
+from prompt_builder import SEED_EXAMPLES, PromptBuilder, unknown_paths
+from querying import process_user_query, remember_translation
+from schema_profiler import SchemaProfiler
+
+QUESTION = "students with credits_taken above 100"
+ANSWER = {"filter": {"credits_taken": {"$gt": 100}}}
+
+
+@pytest.fixture(scope="module")
+def profile():
+    collection = mongomock.MongoClient()["University"]["Student"]
+    collection.insert_many(list(UniversityDB().generate_students(50, seed=1)))
+    return SchemaProfiler(sample_size=50).profile(collection)
+
+
+@pytest.mark.parametrize("question, query_dict", SEED_EXAMPLES)
+def test_seed_examples_use_real_student_fields(profile, question, query_dict):
+    assert unknown_paths(query_dict, profile) == []
+
+
+def recorded(builder):
+    return [q for q, _ in builder.select_examples(QUESTION)]
+
+
+def test_translation_is_not_an_example_until_it_ran(profile):
+    builder = PromptBuilder(max_examples=50)
+    query_dict = process_user_query(
+        QUESTION, LocalChatModel(default_answer=ANSWER), profile=profile, prompt_builder=builder
+    )
+    assert QUESTION not in recorded(builder)
+
+    for result in ([], 0, "Error counting documents: timeout"):
+        assert not remember_translation(QUESTION, query_dict, result, profile, prompt_builder=builder)
+    assert QUESTION not in recorded(builder)
+
+    assert remember_translation(QUESTION, query_dict, [{"name": "Ada"}], profile, prompt_builder=builder)
+    assert QUESTION in recorded(builder)
+
+
+def test_translations_with_unknown_fields_are_never_examples(profile):
+    builder = PromptBuilder(max_examples=50)
+    invented = {"filter": {"email": {"$exists": True}}}
+    assert not remember_translation(QUESTION, invented, [{"name": "Ada"}], profile, prompt_builder=builder)
@@ -0,0 +1,66 @@
+import mongomock
+import pytest
+
+from local_llm import LocalChatModel
+from query_cache import TranslationCache
+from querying import process_user_query
+from schema_profiler import SchemaProfiler
+
+SCHEMA = "name: str, gpa: float, major: str"
+
+
+@pytest.fixture
+def cache():
+    return TranslationCache(similarity_threshold=0.9)
+
+
+@pytest.mark.parametrize(
+    "cached, asked",
+    [
+        ("sort students by gpa ascending", "sort students by gpa descending"),
+        ("students whose major is Mathematics", "students whose major is not Mathematics"),
+        ("count students in Physics", "count students in Physic"),
+        ("students with gpa above 3.5", "students with gpa above 3.6"),
+        ("students with gpa above 3.5", "students with gpa below 3.5"),
+    ],
+)
+def test_near_duplicates_with_another_meaning_miss(cache, cached, asked):
+    cache.put(cached, SCHEMA, {"filter": {"cached": cached}})
+    assert cache.get(asked, SCHEMA) is None
+
+
+def test_filler_wording_still_hits(cache):
+    cache.put("students with gpa above 3.5", SCHEMA, {"filter": {"gpa": {"$gt": 3.5}}})
+    assert cache.get("show me student with gpa above 3.5", SCHEMA) == {
+        "filter": {"gpa": {"$gt": 3.5}}
+    }
+    assert cache.near_hits == 1
+
+
+def test_schema_change_misses(cache):
+    cache.put("students with gpa above 3.5", SCHEMA, {"filter": {"gpa": {"$gt": 3.5}}})
+    assert cache.get("students with gpa above 3.5", SCHEMA + ", year: int") is None
+
+
+def test_put_and_get_copy_the_query(cache):
+    query_dict = {"filter": {"major": "Physics"}}
+    cache.put("physics students", SCHEMA, query_dict)
+    query_dict["filter"]["major"] = "Mathematics"
+    served = cache.get("physics students", SCHEMA)
+    served["limit"] = 5
+    assert cache.get("physics students", SCHEMA) == {"filter": {"major": "Physics"}}
+
+
+def test_translations_survive_a_new_profile(cache):
+    collection = mongomock.MongoClient()["University"]["Student"]
+    collection.insert_many([{"name": f"s{i}", "gpa": 1.5 + i / 20} for i in range(40)])
+    first = SchemaProfiler(sample_size=10).profile(collection)
+    second = SchemaProfiler(sample_size=30).profile(collection)
+
+    answer = {"filter": {"gpa": {"$gt": 3.5}}}
+    model = LocalChatModel(default_answer=answer)
+    question = "students with gpa above 3.5"
+    assert process_user_query(question, model, first.describe(), cache, first)["filter"] == answer["filter"]
+    # A re-profiled collection must not send the same question to the model again
+    failing = LocalChatModel(failure_rate=1.0)
+    assert process_user_query(question, failing, second.describe(), cache, second)["filter"] == answer["filter"]
@@ -0,0 +1,95 @@
+import mongomock
+import pytest
+
+from query_guard import QueryGuard, QueryRejected
+from querying import build_cursor
+from schema_profiler import SchemaProfiler
+
+
+@pytest.fixture(scope="module")
+def collection():
+    collection = mongomock.MongoClient()["University"]["Student"]
+    collection.insert_many(
+        [
+            {
+                "name": f"s{i}",
+                "gpa": 3.0,
+                "courses_completed": [{"course_id": f"C{j}"} for j in range(i % 5)],
+            }
+            for i in range(50)
+        ]
+    )
+    return collection
+
+
+@pytest.fixture(scope="module")
+def profile(collection):
+    return SchemaProfiler().profile(collection)
+
+
+@pytest.fixture
+def guard():
+    return QueryGuard(max_limit=100, max_skip=1000)
+
+
+@pytest.mark.parametrize(
+    "pipeline",
+    [
+        [
+            {"$addFields": {"n": {"$size": "$courses_completed"}}},
+            {"$match": {"n": {"$gt": 3}}},
+        ],
+        [{"$set": {"n": {"$size": "$courses_completed"}}}, {"$sort": {"n": -1}}],
+        [
+            {"$unwind": {"path": "$courses_completed", "includeArrayIndex": "position"}},
+            {"$match": {"position": 0}},
+        ],
+        [{"$bucket": {"groupBy": "$gpa", "boundaries": [0, 2, 4]}}, {"$sort": {"count": -1}}],
+    ],
+)
+def test_fields_defined_by_earlier_stages_are_known(guard, collection, profile, pipeline):
+    query_dict, notes = guard.check(
+        collection, {"operation": "aggregate", "pipeline": pipeline}, profile=profile
+    )
+    assert notes == []
+    assert query_dict["max_time_ms"] == guard.max_time_ms
+
+
+def test_unseen_fields_warn_instead_of_rejecting(guard, collection, profile):
+    query_dict, notes = guard.check(collection, {"filter": {"nickname": "x"}}, profile=profile)
+    assert query_dict["filter"] == {"nickname": "x"}
+    assert len(notes) == 1 and "nickname" in notes[0]
+    assert guard.stats() == {"rejected": 0, "rewritten": 0}
+
+
+def test_server_side_javascript_is_rejected(guard, collection):
+    with pytest.raises(QueryRejected):
+        guard.check(collection, {"filter": {"$where": "this.gpa > 3"}})
+
+
+def test_large_skip_is_rejected_not_rewritten(guard, collection):
+    with pytest.raises(QueryRejected):
+        guard.check(collection, {"filter": {}, "sort": {"gpa": -1}, "skip": 5000})
+
+
+def test_limit_is_capped(guard, collection):
+    query_dict, notes = guard.check(collection, {"filter": {}, "limit": 5000})
+    assert query_dict["limit"] == 100
+    assert notes
+
+
+def test_pipelines_keep_disk_use_while_finds_follow_the_policy(guard, collection):
+    calls = []
+
+    class Recording:
+        def aggregate(self, pipeline, **options):
+            calls.append(options)
+            return iter([])
+
+    pipeline = [{"$group": {"_id": "$gpa", "n": {"$sum": 1}}}, {"$sort": {"n": -1}}]
+    query_dict, _ = guard.check(collection, {"operation": "aggregate", "pipeline": pipeline})
+    build_cursor(Recording(), query_dict)
+    assert calls[0]["allowDiskUse"] is True
+
+    query_dict, _ = guard.check(collection, {"filter": {}, "sort": {"gpa": -1}, "allow_disk_use": True})
+    assert query_dict["allow_disk_use"] is False
@@ -0,0 +1,110 @@
+import mongomock
+import pytest
+
+from fast_path import FastPathParser
+from querying import build_cursor, serialize_id
+from refinement import Refiner, merge_filters
+from schema_profiler import SchemaProfiler
+
+MAJORS = ["Computer Science", "Mathematics", "Physics"]
+
+
+@pytest.fixture(scope="module")
+def collection():
+    collection = mongomock.MongoClient()["University"]["Student"]
+    collection.insert_many(
+        [
+            {
+                "name": f"s{i:02d}",
+                "gpa": round(2 + (i % 20) / 10, 1),
+                "major": MAJORS[i % 3],
+                "credits": 10 + i,
+                "address": {"city": "Pune" if i % 4 else "Delhi"},
+            }
+            for i in range(60)
+        ]
+    )
+    return collection
+
+
+@pytest.fixture(scope="module")
+def profile(collection):
+    return SchemaProfiler().profile(collection)
+
+
+def run(collection, query_dict):
+    if query_dict.get("operation") == "count":
+        return collection.count_documents(query_dict["filter"])
+    return [serialize_id(doc) for doc in build_cursor(collection, query_dict)]
+
+
+def previous(collection, query_dict):
+    return {"query_dict": query_dict, "results": run(collection, query_dict), "complete": True}
+
+
+def test_merge_filters_narrows_or_replaces():
+    assert merge_filters({"gpa": {"$gt": 3}}, {"gpa": {"$gt": 3.5}}) == ({"gpa": {"$gt": 3.5}}, True)
+    assert merge_filters({"gpa": {"$gt": 3}}, {"gpa": {"$gt": 2}}) == ({"gpa": {"$gt": 2}}, False)
+    assert merge_filters({"gpa": {"$gt": 3}}, {"major": "Physics"}) == (
+        {"gpa": {"$gt": 3}, "major": "Physics"},
+        True,
+    )
+    assert merge_filters({"major": "Physics"}, {"major": "Mathematics"}) == ({"major": "Mathematics"}, False)
+    merged, narrowing = merge_filters({"$or": [{"a": 1}]}, {"$or": [{"b": 2}]})
+    assert merged == {"$or": [{"a": 1}], "$and": [{"$or": [{"b": 2}]}]} and narrowing
+
+
+@pytest.mark.parametrize(
+    "delta",
+    [
+        {"filter": {"major": "Physics"}},
+        {"filter": {"gpa": {"$gte": 3.5}}, "sort": {"credits": -1}, "limit": 3},
+        {"filter": {"address.city": "Delhi"}, "sort": {"name": 1}},
+        {"filter": {"name": {"$regex": "^s1"}}, "count": True},
+        {"filter": {"$or": [{"major": "Mathematics"}, {"credits": {"$lt": 15}}]}},
+        {"sort": {"gpa": 1, "name": -1}, "projection": {"name": 1, "gpa": 1}},
+    ],
+)
+def test_local_answer_matches_mongodb(collection, profile, delta):
+    refiner = Refiner()
+    last = previous(collection, {"filter": {"gpa": {"$gt": 2.5}}, "projection": {}, "sort": {}, "limit": 0, "skip": 0})
+    query_dict, local = refiner.refine(last, {"operation": "refine", **delta}, profile)
+    assert local is not None
+    assert local == run(collection, query_dict)
+    assert refiner.stats()["answered_locally"] == 1
+
+
+def test_widening_or_limited_results_go_to_mongodb(collection, profile):
+    refiner = Refiner()
+    base = {"filter": {"gpa": {"$gt": 3}}, "projection": {}, "sort": {}, "limit": 0, "skip": 0}
+    query_dict, local = refiner.refine(
+        previous(collection, base), {"operation": "refine", "filter": {"gpa": {"$gt": 2}}}, profile
+    )
+    assert local is None and query_dict["filter"] == {"gpa": {"$gt": 2}}
+
+    partial = {**previous(collection, base), "complete": False}
+    _, local = refiner.refine(partial, {"operation": "refine", "filter": {"major": "Physics"}}, profile)
+    assert local is None
+    assert refiner.stats()["sent_to_mongodb"] == 2
+
+
+def test_new_question_is_returned_unchanged(collection, profile):
+    refiner = Refiner()
+    fresh = {"filter": {"major": "Physics"}, "limit": 0}
+    assert refiner.refine(previous(collection, {"filter": {}}), fresh, profile) == (fresh, None)
+    assert refiner.stats()["new_questions"] == 1
+
+
+def test_fast_delta_parses_follow_ups_without_the_llm(collection, profile):
+    refiner, parser = Refiner(), FastPathParser()
+    assert refiner.is_follow_up("now only those in Physics")
+    assert not refiner.is_follow_up("students in Physics")
+
+    last = previous(collection, {"filter": {"gpa": {"$gt": 3}}, "limit": 0})
+    delta = refiner.fast_delta("now only those in Physics", last, parser, profile)
+    assert delta == {"operation": "refine", "filter": {"major": "Physics"}}
+    assert parser.stats()["follow_up_hits"] == 1 and parser.stats()["hits"] == 0
+
+    query_dict, local = refiner.refine(last, delta, profile)
+    assert query_dict["filter"] == {"gpa": {"$gt": 3}, "major": "Physics"}
+    assert local == run(collection, query_dict)
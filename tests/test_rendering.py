@@ -0,0 +1,22 @@
+import os
+import subprocess
+import sys
+
+from rendering import ResultTable
+
+
+def test_pyarrow_is_imported_on_first_use():
+    code = "import sys, rendering; print('pyarrow' in sys.modules)"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True)
+    assert output.stdout.strip() == "False", output.stderr
+
+
+def test_table_round_trips_through_bytes():
+    table = ResultTable.from_results(
+        [{"_id": "a", "name": "Ada", "gpa": 3.9, "address": {"city": "Pune"}}, {"name": "Bo", "gpa": "n/a"}]
+    )
+    restored = ResultTable.from_bytes(table.to_bytes())
+    assert restored.columns == ["name", "gpa", "address.city"]
+    assert restored.num_rows == 2
+    assert restored.window(0, 1).iloc[0]["address.city"] == "Pune"
@@ -0,0 +1,45 @@
+import mongomock
+import pytest
+
+from query_cache import schema_fingerprint
+from schema_profiler import SchemaProfiler
+
+
+@pytest.fixture
+def collection():
+    collection = mongomock.MongoClient()["University"]["Student"]
+    collection.insert_many(
+        [{"name": f"s{i}", "gpa": 3.0, "legacy": True} for i in range(20)]
+    )
+    return collection
+
+
+def test_refresh_builds_a_new_profile(collection):
+    profiler = SchemaProfiler(sample_size=50, refresh_seconds=0)
+    first = profiler.profile(collection)
+    fields, docs_seen = set(first.fields), first.docs_seen
+
+    collection.update_many({}, {"$unset": {"legacy": ""}})
+    collection.insert_many([{"name": f"n{i}", "gpa": 2.5} for i in range(5)])
+    second = profiler.profile(collection)
+
+    assert second is not first
+    assert set(first.fields) == fields and first.docs_seen == docs_seen
+    # New inserts are also in the fresh sample but counted once
+    assert second.docs_seen == 25
+    assert "legacy" not in second.fields
+    assert profiler.cached(collection) is second
+
+
+def test_cached_profile_is_reused_until_it_is_old(collection):
+    profiler = SchemaProfiler(refresh_seconds=600)
+    assert profiler.profile(collection) is profiler.profile(collection)
+
+
+def test_structure_is_stable_across_samples(collection):
+    collection.insert_many([{"name": f"x{i}", "gpa": 1.5 + i / 10, "legacy": False} for i in range(20)])
+    small = SchemaProfiler(sample_size=10).profile(collection)
+    large = SchemaProfiler(sample_size=40).profile(collection)
+    # Sample counts and ranges differ, so the description does
+    assert small.describe() != large.describe()
+    assert schema_fingerprint(small.structure()) == schema_fingerprint(large.structure())
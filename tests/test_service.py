@@ -0,0 +1,80 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import service
+
+
+class FakeService:
+    def __init__(self):
+        self.concurrency = None
+
+    def answer_many(self, questions, name=None, user=None, limit=None, concurrency=None):
+        self.concurrency = concurrency
+        for index, question in enumerate(questions):
+            yield {"index": index, "question": question}
+
+
+@pytest.fixture
+def server():
+    fake = FakeService()
+    httpd = service.make_server(fake, "127.0.0.1", 0)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield fake, f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def post(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode("utf-8"))
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def test_service_does_not_import_streamlit():
+    code = "import sys, service; print('streamlit' in sys.modules)"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True)
+    assert output.stdout.strip() == "False", output.stderr
+
+
+@pytest.mark.parametrize(
+    "requested, expected",
+    [(None, service.BATCH_CONCURRENCY), (0, 1), (-5, 1), (3, min(3, service.BATCH_CONCURRENCY)),
+     (10**6, service.BATCH_CONCURRENCY), ("2", min(2, service.BATCH_CONCURRENCY))],
+)
+def test_batch_concurrency_is_clamped(server, requested, expected):
+    fake, url = server
+    body = {"questions": ["a", "b"]}
+    if requested is not None:
+        body["concurrency"] = requested
+    status, payload = post(url + "/batch", body)
+    assert status == 200
+    assert len(payload.splitlines()) == 2
+    assert fake.concurrency == expected
+
+
+@pytest.mark.parametrize("requested", ["many", 2.5, [4], True])
+def test_batch_rejects_non_integer_concurrency(server, requested):
+    fake, url = server
+    status, payload = post(url + "/batch", {"questions": ["a"], "concurrency": requested})
+    assert status == 400
+    assert "concurrency" in json.loads(payload)["error"]
+    assert fake.concurrency is None
+
+
+@pytest.mark.parametrize("questions", ["one question", [1, 2], None])
+def test_batch_rejects_malformed_questions(server, questions):
+    _, url = server
+    status, payload = post(url + "/batch", {"questions": questions})
+    assert status == 400
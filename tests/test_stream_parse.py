@@ -0,0 +1,41 @@
+import pytest
+
+from stream_parse import JSONObjectScanner
+
+REPLY = (
+    'Here is the query:\n```json\n'
+    '{"filter": {"name": {"$regex": "^A, \\"B\\" {x}"}}, "sort": {"gpa": -1}, "limit": 5}'
+    '\n```\nThis sorts by gpa.'
+)
+
+
+def feed_in_chunks(text, size):
+    scanner, pairs = JSONObjectScanner(), []
+    for start in range(0, len(text), size):
+        pairs.extend(scanner.feed(text[start : start + size]))
+    return scanner, pairs
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, len(REPLY)])
+def test_pairs_are_reported_once_each_in_order(size):
+    scanner, pairs = feed_in_chunks(REPLY, size)
+    assert [key for key, _ in pairs] == ["filter", "sort", "limit"]
+    assert pairs[0][1] == {"name": {"$regex": '^A, "B" {x}'}}
+    assert scanner.closed
+    assert scanner.result() == dict(pairs)
+
+
+def test_filter_is_available_before_the_object_closes():
+    scanner = JSONObjectScanner()
+    head, tail = REPLY.split('"sort"')
+    assert scanner.feed(head) == [("filter", {"name": {"$regex": '^A, "B" {x}'}})]
+    assert not scanner.closed
+    scanner.feed('"sort"' + tail)
+    assert scanner.completed["limit"] == 5
+
+
+def test_unclosed_object_raises():
+    scanner = JSONObjectScanner()
+    scanner.feed('{"filter": {"gpa": 3}')
+    with pytest.raises(ValueError):
+        scanner.result()
@@ -0,0 +1,120 @@
+import time
+
+import mongomock
+import pytest
+from mongomock.collection import Collection
+from bson import Timestamp
+
+from summaries import MaterializedSummary, SummaryStore
+
+PIPELINE = [{"$group": {"_id": "$major", "n": {"$sum": 1}, "avg_gpa": {"$avg": "$gpa"}}}]
+
+
+@pytest.fixture
+def collection():
+    collection = mongomock.MongoClient()["University"]["Student"]
+    collection.insert_many(
+        [{"name": f"s{i}", "major": "CS" if i % 2 else "Math", "gpa": 2.0 + i / 10} for i in range(20)]
+    )
+    return collection
+
+
+def counts(summary):
+    return {row["_id"]: row["count"] for row in summary.target.find()}
+
+
+def test_events_are_ordered_by_the_rebuild_operation_time(collection):
+    summary = MaterializedSummary(collection, "major", ["gpa"])
+    summary.rebuild()
+    # No operation time (no sessions): every event recomputes its groups
+    assert not summary.is_live({"clusterTime": Timestamp(2**31 - 1, 1)})
+
+    summary.built_operation_time = Timestamp(1000, 5)
+    assert not summary.is_live({"clusterTime": Timestamp(1000, 5)})
+    assert not summary.is_live({"clusterTime": Timestamp(999, 9)})
+    assert summary.is_live({"clusterTime": Timestamp(1000, 6)})
+    assert not summary.is_live({})
+
+
+def test_insert_seen_by_the_rebuild_is_not_counted_twice(collection):
+    summary = MaterializedSummary(collection, "major", ["gpa"])
+    summary.built_operation_time = Timestamp(1000, 5)
+    doc = {"name": "late", "major": "CS", "gpa": 4.0}
+    collection.insert_one(doc)
+    summary.rebuild()
+    summary.built_operation_time = Timestamp(1000, 5)
+
+    event = {"operationType": "insert", "fullDocument": doc, "clusterTime": Timestamp(1000, 4)}
+    summary.apply_change(event, live=summary.is_live(event))
+    summary.flush()
+    assert counts(summary)["CS"] == collection.count_documents({"major": "CS"})
+
+
+def test_delta_scan_marks_deletes_stale(collection):
+    summary = MaterializedSummary(collection, "major", ["gpa"])
+    summary.rebuild()
+    collection.insert_one({"name": "new", "major": "Math", "gpa": 3.0})
+    summary.delta_scan()
+    assert not summary.check_drift()
+    assert counts(summary)["Math"] == 11
+
+    collection.delete_one({"major": "CS"})
+    summary.delta_scan()
+    assert summary.check_drift()
+
+
+def test_store_falls_back_then_rebuilds_after_a_delete(collection):
+    store = SummaryStore(specs={"Student": {"major": ["gpa"]}}, delta_seconds=0.05)
+    store.attach(collection)
+    try:
+        deadline = time.time() + 5
+        while store.route(collection, {"pipeline": PIPELINE}) is None and time.time() < deadline:
+            time.sleep(0.02)
+        summary = store._maintainers[collection.full_name].summaries["major"]
+        assert summary.ready
+
+        collection.delete_many({"major": "CS", "gpa": {"$lt": 2.5}})
+        expected = collection.count_documents({"major": "CS"})
+        # The next scan sees the count drift; the summary is skipped and then rebuilt
+        while counts(summary).get("CS") != expected and time.time() < deadline:
+            time.sleep(0.02)
+        assert counts(summary)["CS"] == expected
+        assert not summary.stale
+        assert store.count(collection, {"major": "CS"}) == expected
+    finally:
+        store.close()
+
+
+@pytest.fixture
+def approximate_counts(monkeypatch):
+    # estimated_document_count comes from metadata: off by a few and slow to follow deletes
+    real = Collection.estimated_document_count
+    monkeypatch.setattr(Collection, "estimated_document_count", lambda self, **kw: real(self) + 3)
+
+
+def test_steady_collection_with_approximate_counts_is_not_rebuilt(collection, approximate_counts):
+    store = SummaryStore(specs={"Student": {"major": ["gpa"]}}, delta_seconds=0.02)
+    store.attach(collection)
+    try:
+        deadline = time.time() + 5
+        while store.route(collection, {"pipeline": PIPELINE}) is None and time.time() < deadline:
+            time.sleep(0.02)
+        summary = store._maintainers[collection.full_name].summaries["major"]
+        built_at = summary.built_at
+        collection.insert_many([{"name": "new", "major": "CS", "gpa": 3.0} for _ in range(5)])
+        time.sleep(0.4)  # about 20 polls
+        assert summary.built_at == built_at and not summary.stale
+        assert counts(summary)["CS"] == collection.count_documents({"major": "CS"})
+    finally:
+        store.close()
+
+
+def test_unscanned_inserts_are_not_drift(collection):
+    summary = MaterializedSummary(collection, "major", ["gpa"])
+    summary.rebuild()
+    assert not summary.check_drift()
+    collection.insert_many([{"name": "new", "major": "Math", "gpa": 3.0} for _ in range(3)])
+    # Counted by the estimate, not folded in yet
+    assert not summary.check_drift()
+    summary.delta_scan()
+    assert not summary.check_drift()
@@ -0,0 +1,140 @@
+"""Pre-warm step for a fresh container: imports, MongoDB connection and schema profiles.
+
+    python warmup.py --database University --collection Student
+    python warmup.py --database University --collection Student streamlit -- --server.port=8501
+
+The first form warms and reports timings. The second warms in the same
+process that then runs the Streamlit app, so the app finds the heavy
+modules imported, the pooled client connected and the profiles cached.
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from catalog import DatabaseCatalog
+from executor import DB_TIMEOUT_SECONDS
+from metrics import span
+from mongo_pool import clients
+from schema_profiler import default_profiler
+
+# Deferred by the app until first use; a warm start pays for them up front
+HEAVY_MODULES = ("pandas", "pyarrow", "langchain_core.messages", "langchain_groq")
+# Imported by the app script's first run; only worth loading when Streamlit runs here
+APP_MODULES = ("helper", "query_cache", "index_advisor", "query_guard", "fast_path")
+
+
+def import_modules(modules=HEAVY_MODULES) -> Dict[str, float]:
+    """Import each module once and return the seconds it took"""
+    timings = {}
+    for name in modules:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            continue
+        timings[name] = round(time.perf_counter() - started, 3)
+    return timings
+
+
+def _step(timings: Dict[str, float], name: str, fn, *args):
+    started = time.perf_counter()
+    with span("warmup", step=name):
+        result = fn(*args)
+    timings[name] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def _profile_all(database, collection, profiler):
+    if collection:
+        profiler.profile(database[collection])
+    # The other collections too, so multi-collection questions start warm
+    DatabaseCatalog(database, profiler).profiles(timeout=DB_TIMEOUT_SECONDS)
+
+
+def warm_start(
+    uri: str,
+    database: Optional[str] = None,
+    collection: Optional[str] = None,
+    profiler=default_profiler,
+    modules=HEAVY_MODULES,
+) -> Dict[str, float]:
+    """Import, connect and profile; returns seconds per step"""
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+    _step(timings, "imports", import_modules, modules)
+    if uri and database:
+        try:
+            db = clients.client(uri)[database]
+            _step(timings, "connect", db.client.admin.command, "ping")
+            _step(timings, "schema", _profile_all, db, collection, profiler)
+        except Exception as e:
+            # The app still starts; the first Submit reports the connection error
+            print(f"Warm-up could not reach MongoDB: {e}", file=sys.stderr)
+    timings["total"] = round(time.perf_counter() - started, 3)
+    return timings
+
+
+_started = set()
+_started_lock = threading.Lock()
+
+
+def warmup_from_env(background: bool = False):
+    """Warm WARM_DATABASE/WARM_COLLECTION once per process; None if already started"""
+    args = (
+        os.getenv("MONGODB_CONNECTION_STRING"),
+        os.getenv("WARM_DATABASE"),
+        os.getenv("WARM_COLLECTION"),
+    )
+    with _started_lock:
+        if args in _started:
+            return None
+        _started.add(args)
+    if not background:
+        return warm_start(*args)
+    thread = threading.Thread(target=warm_start, args=args, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default=os.getenv("WARM_DATABASE"))
+    parser.add_argument("--collection", default=os.getenv("WARM_COLLECTION"))
+    parser.add_argument("--app", default="app.py")
+    parser.add_argument("mode", nargs="?", choices=["report", "streamlit"], default="report")
+    parser.add_argument("streamlit_args", nargs=argparse.REMAINDER)
+    return parser.parse_args()
+
+
+def main():
+    load_dotenv()
+    args = parse_args()
+    # The launched app pre-fills the sidebar with the warmed collection
+    if args.database:
+        os.environ["WARM_DATABASE"] = args.database
+    if args.collection:
+        os.environ["WARM_COLLECTION"] = args.collection
+
+    if args.mode == "report":
+        print(json.dumps(warmup_from_env(), indent=2))
+        return
+
+    # Imports are cheap to wait for; the database part overlaps with server start-up.
+    # Going through the "warmup" module (not __main__) lets the app see it started.
+    import_modules(HEAVY_MODULES + APP_MODULES)
+    importlib.import_module("warmup").warmup_from_env(background=True)
+    from streamlit.web import cli
+
+    sys.argv = ["streamlit", "run", args.app, *args.streamlit_args]
+    sys.exit(cli.main())
+
+
+if __name__ == "__main__":
+    main()